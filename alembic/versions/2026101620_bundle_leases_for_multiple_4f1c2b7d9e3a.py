@@ -0,0 +1,22 @@
+"""bundle leases for multiple workers
+
+Revision ID: 4f1c2b7d9e3a
+Revises: 12a9451988cd
+Create Date: 2026-10-16 20:12:41.318032
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4f1c2b7d9e3a'
+down_revision = '12a9451988cd'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # bundle_lease automatically added
+    pass
+
+def downgrade():
+    op.drop_table('bundle_lease')
@@ -0,0 +1,22 @@
+"""run fingerprints for memoizing runs
+
+Revision ID: 8d2e6a31c5f0
+Revises: 4f1c2b7d9e3a
+Create Date: 2026-10-16 21:03:17.542861
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d2e6a31c5f0'
+down_revision = '4f1c2b7d9e3a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # run_fingerprint automatically added
+    pass
+
+def downgrade():
+    op.drop_table('run_fingerprint')
@@ -0,0 +1,26 @@
+"""permission version and permission indexes
+
+Revision ID: 6b3e9f4a7c21
+Revises: 8d2e6a31c5f0
+Create Date: 2026-10-16 22:07:45.126503
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b3e9f4a7c21'
+down_revision = '8d2e6a31c5f0'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # permission_version and permission_change automatically added
+    op.create_index('group_bundle_permission_object_uuid_index', 'group_bundle_permission', ['object_uuid'], unique=False)
+    op.create_index('group_object_permission_object_uuid_index', 'group_object_permission', ['object_uuid'], unique=False)
+
+def downgrade():
+    op.drop_index('group_object_permission_object_uuid_index', 'group_object_permission')
+    op.drop_index('group_bundle_permission_object_uuid_index', 'group_bundle_permission')
+    op.drop_table('permission_change')
+    op.drop_table('permission_version')
@@ -0,0 +1,81 @@
+"""bundle summary for search
+
+Revision ID: 3a7d5c1e9b42
+Revises: 6b3e9f4a7c21
+Create Date: 2026-10-16 23:14:52.730914
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a7d5c1e9b42'
+down_revision = '6b3e9f4a7c21'
+
+from alembic import op
+import sqlalchemy as sa
+
+# The tables as of this revision (not codalab.model.tables, which will change).
+bundle = sa.table('bundle',
+    sa.column('id', sa.Integer),
+    sa.column('uuid', sa.String),
+    sa.column('state', sa.String),
+    sa.column('owner_id', sa.String),
+)
+bundle_metadata = sa.table('bundle_metadata',
+    sa.column('bundle_uuid', sa.String),
+    sa.column('metadata_key', sa.String),
+    sa.column('metadata_value', sa.Text),
+)
+bundle_summary = sa.table('bundle_summary',
+    sa.column('bundle_uuid', sa.String),
+    sa.column('name', sa.Text),
+    sa.column('created', sa.Integer),
+    sa.column('data_size', sa.BigInteger),
+    sa.column('time', sa.Float),
+    sa.column('state', sa.String),
+    sa.column('owner_id', sa.String),
+)
+# Metadata keys copied to bundle_summary, and how to convert their values.
+METADATA_TYPES = {'name': unicode, 'created': lambda value: int(float(value)), 'data_size': lambda value: int(float(value)), 'time': float}
+BATCH_SIZE = 1000
+
+
+def convert(key, value):
+    try:
+        return METADATA_TYPES[key](value)
+    except (TypeError, ValueError):
+        return None
+
+
+def upgrade():
+    # bundle_summary automatically added; fill it in for the existing bundles
+    # (in batches, skipping the bundles saved since it was added).
+    connection = op.get_bind()
+    last_id = 0
+    num_bundles = 0
+    while True:
+        rows = connection.execute(sa.select([bundle]).where(bundle.c.id > last_id).where(
+            ~bundle.c.uuid.in_(sa.select([bundle_summary.c.bundle_uuid]))
+        ).order_by(bundle.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        num_bundles += len(rows)
+        summaries = dict((row.uuid, {
+            'bundle_uuid': row.uuid,
+            'name': None,
+            'created': None,
+            'data_size': None,
+            'time': None,
+            'state': row.state,
+            'owner_id': row.owner_id,
+        }) for row in rows)
+        for row in connection.execute(sa.select([bundle_metadata]).where(sa.and_(
+            bundle_metadata.c.bundle_uuid.in_(summaries.keys()),
+            bundle_metadata.c.metadata_key.in_(METADATA_TYPES.keys()),
+        ))):
+            summaries[row.bundle_uuid][row.metadata_key] = convert(row.metadata_key, row.metadata_value)
+        op.bulk_insert(bundle_summary, summaries.values())
+    print 'Filled in the bundle summary of %d bundles' % (num_bundles,)
+
+def downgrade():
+    op.drop_table('bundle_summary')
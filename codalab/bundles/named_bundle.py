@@ -20,7 +20,11 @@ class NamedBundle(Bundle):
       MetadataSpec('tags', list, 'space-separated list of tags used for search (e.g., machine-learning)', metavar='TAG'),
       MetadataSpec('created', int, 'time when this bundle was created', generated=True, formatting='date'),
       MetadataSpec('data_size', int, 'size of this bundle (in bytes)', generated=True, formatting='size'),
+      MetadataSpec('data_file_count', int, 'number of files (including symlinks) in this bundle', generated=True),
+      MetadataSpec('data_directory_count', int, 'number of directories in this bundle', generated=True),
+      MetadataSpec('data_largest_file_size', int, 'size of the largest file in this bundle (in bytes)', generated=True, formatting='size'),
       MetadataSpec('failure_message', basestring, 'error message if bundle failed', generated=True),
+      MetadataSpec('final_state', basestring, 'state (ready or failed) that the bundle moves to once its results are installed (internal)', generated=True),
     )
 
     @classmethod
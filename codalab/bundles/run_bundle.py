@@ -8,6 +8,8 @@ When the bundle is executed, it symlinks the program target in to ./program,
 symlinks the input target in to ./input, and then streams output to ./stdout
 and ./stderr. The ./output directory may also be used to store output files.
 '''
+import hashlib
+import json
 import os
 import subprocess
 import re
@@ -44,8 +46,10 @@ class RunBundle(NamedBundle):
     METADATA_SPECS.append(MetadataSpec('time_user', float, 'amount of time (seconds) by user', generated=True, formatting='duration'))
     METADATA_SPECS.append(MetadataSpec('time_system', float, 'amount of time (seconds) by the system', generated=True, formatting='duration'))
     METADATA_SPECS.append(MetadataSpec('memory', float, 'amount of memory (bytes) used by this run', generated=True, formatting='size'))
+    METADATA_SPECS.append(MetadataSpec('memory_max', float, 'peak amount of memory (bytes) used by this run', generated=True, formatting='size'))
     METADATA_SPECS.append(MetadataSpec('disk_read', float, 'number of bytes read', generated=True, formatting='size'))
     METADATA_SPECS.append(MetadataSpec('disk_write', float, 'number of bytes written', generated=True, formatting='size'))
+    METADATA_SPECS.append(MetadataSpec('resource_usage', basestring, 'samples of the CPU time, memory and disk I/O of this run over time (internal)', generated=True))
 
     # Information about running
     METADATA_SPECS.append(MetadataSpec('docker_image', basestring, 'which docker container was used to run the process', generated=True))
@@ -53,6 +57,14 @@ class RunBundle(NamedBundle):
     METADATA_SPECS.append(MetadataSpec('job_handle', basestring, 'identifies the job handle (internal)', generated=True))
     METADATA_SPECS.append(MetadataSpec('remote', basestring, 'where this job was run', generated=True))
     METADATA_SPECS.append(MetadataSpec('temp_dir', basestring, 'temporary directory where job is running (internal)', generated=True))
+    METADATA_SPECS.append(MetadataSpec('staging_mode', basestring, 'how dependencies were staged (copy, hardlink, reflink or symlink)', generated=True))
+    METADATA_SPECS.append(MetadataSpec('queue_wait', float, 'amount of time (seconds) this run waited to be started once its dependencies were ready', generated=True, formatting='duration'))
+    METADATA_SPECS.append(MetadataSpec('scheduling_priority', float, 'priority of this run when it was started (request_priority, plus aging, minus the owner\'s share)', generated=True))
+    METADATA_SPECS.append(MetadataSpec('staging_time', float, 'amount of time (seconds) spent staging dependencies', generated=True, formatting='duration'))
+    METADATA_SPECS.append(MetadataSpec('memoized_from', basestring, 'identical run whose results were reused instead of running this one', generated=True))
+
+    # Metadata copied from the run whose results are reused (see get_memoized_update).
+    MEMOIZED_METADATA_KEYS = ('data_size', 'data_file_count', 'data_directory_count', 'data_largest_file_size', 'exitcode')
 
     @classmethod
     def construct(cls, targets, command, metadata, owner_id, uuid=None, data_hash=None, state=State.CREATED):
@@ -82,3 +94,31 @@ class RunBundle(NamedBundle):
           'dependencies': dependencies,
           'owner_id': owner_id,
         })
+
+    def get_fingerprint(self, parent_dict):
+        '''
+        Return a hash of what determines the results of this run: the command,
+        the docker image it requests, and its dependencies, including the
+        data_hash of their parents.  Return None if some parent is not READY.
+        parent_dict: {parent_uuid: parent bundle}
+        '''
+        dependencies = []
+        for dep in sorted(self.dependencies, key=lambda dep: dep.child_path):
+            parent = parent_dict.get(dep.parent_uuid)
+            if not parent or parent.state != State.READY:
+                return None
+            dependencies.append((dep.child_path, parent.data_hash, dep.parent_path))
+        docker_image = getattr(self.metadata, 'request_docker_image', None) or None
+        return hashlib.sha1(json.dumps([self.command, docker_image, dependencies])).hexdigest()
+
+    def get_memoized_update(self, source):
+        '''
+        Return the update that gives this bundle the results of the READY run
+        source, which has the same fingerprint.
+        '''
+        metadata = {'memoized_from': source.uuid}
+        for key in self.MEMOIZED_METADATA_KEYS:
+            value = getattr(source.metadata, key, None)
+            if value is not None:
+                metadata[key] = value
+        return {'state': State.READY, 'data_hash': source.data_hash, 'metadata': metadata}
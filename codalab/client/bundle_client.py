@@ -41,3 +41,12 @@ class BundleClient(object):
         if not hasattr(self, 'auth_handler'):
             raise NotImplementedError
         return self.auth_handler.generate_token(grant_type, username, key)
+
+    def logout(self, access_token):
+        '''
+        Tell the server that the given access token is no longer used, so that it
+        forgets the user it has cached for it.
+        '''
+        if not hasattr(self, 'auth_handler'):
+            raise NotImplementedError
+        self.auth_handler.invalidate_token(access_token)
@@ -13,6 +13,7 @@ from codalab.bundles import (
     get_bundle_subclass,
     UPLOADED_TYPES,
 )
+from codalab.bundles.run_bundle import RunBundle
 from codalab.common import (
   precondition,
   State,
@@ -56,12 +57,20 @@ def authentication_required(func):
     return decorate
 
 class LocalBundleClient(BundleClient):
-    def __init__(self, address, bundle_store, model, auth_handler, verbose):
+    def __init__(self, address, bundle_store, model, auth_handler, verbose, worker_notifier=None, memoize_runs=False):
         self.address = address
         self.bundle_store = bundle_store
         self.model = model
         self.auth_handler = auth_handler
         self.verbose = verbose
+        # Used to wake up the worker when there is new work for it.
+        self.worker_notifier = worker_notifier
+        # Whether new runs reuse the results of identical READY runs.
+        self.memoize_runs = memoize_runs
+
+    def _notify_worker(self):
+        if self.worker_notifier:
+            self.worker_notifier.notify()
 
     def _current_user(self):
         return self.auth_handler.current_user()
@@ -72,9 +81,10 @@ class LocalBundleClient(BundleClient):
         user = self._current_user()
         return user.name if user else None
 
-    def _bundle_to_bundle_info(self, bundle):
+    def _bundle_to_bundle_info(self, bundle, parent_names):
         '''
         Helper: Convert bundle to bundle_info.
+        parent_names: map from parent uuid to name.
         '''
         # See tables.py
         result = {
@@ -89,7 +99,7 @@ class LocalBundleClient(BundleClient):
         }
         for dep in result['dependencies']:
             uuid = dep['parent_uuid']
-            dep['parent_name'] = self.model.get_bundle_names([uuid]).get(uuid)
+            dep['parent_name'] = parent_names.get(uuid)
 
         return result
 
@@ -176,7 +186,11 @@ class LocalBundleClient(BundleClient):
         return self.upload_bundle(path, info, worksheet_uuid, follow_symlinks, exclude_patterns, True)
 
     @authentication_required
-    def upload_bundle(self, path, info, worksheet_uuid, follow_symlinks, exclude_patterns, add_to_worksheet):
+    def upload_bundle(self, path, info, worksheet_uuid, follow_symlinks, exclude_patterns, add_to_worksheet, contents_hashes=None):
+        '''
+        contents_hashes: optional hashes of the files under a temporary |path|, as
+          for BundleStore.upload.
+        '''
         worksheet = self.model.get_worksheet(worksheet_uuid, fetch_items=False)
         check_worksheet_has_all_permission(self.model, self._current_user(), worksheet)
         self._check_worksheet_not_frozen(worksheet)
@@ -198,7 +212,7 @@ class LocalBundleClient(BundleClient):
 
         # Upload the given path and record additional metadata from the upload.
         if path:
-            (data_hash, bundle_store_metadata) = self.bundle_store.upload(path, follow_symlinks=follow_symlinks, exclude_patterns=exclude_patterns)
+            (data_hash, bundle_store_metadata) = self.bundle_store.upload(path, follow_symlinks=follow_symlinks, exclude_patterns=exclude_patterns, contents_hashes=contents_hashes)
             metadata.update(bundle_store_metadata)
             if construct_args.get('data_hash', data_hash) != data_hash:
                 print >>sys.stderr, 'ERROR: provided data_hash doesn\'t match: %s versus %s' % (construct_args.get('data_hash'), data_hash)
@@ -215,6 +229,8 @@ class LocalBundleClient(BundleClient):
         if add_to_worksheet:
             self.add_worksheet_item(worksheet_uuid, worksheet_util.bundle_item(bundle.uuid))
 
+        # Bundles waiting on this one might be ready to run.
+        self._notify_worker()
         return bundle.uuid
 
     @authentication_required
@@ -240,11 +256,30 @@ class LocalBundleClient(BundleClient):
         self.validate_user_metadata(bundle_subclass, metadata)
         owner_id = self._current_user_id()
         bundle = bundle_subclass.construct(targets=targets, command=command, metadata=metadata, owner_id=owner_id)
+        if self.memoize_runs and isinstance(bundle, RunBundle):
+            self._memoize_run_bundle(bundle)
         self.model.save_bundle(bundle)
         # Inherit properties of worksheet
         self._bundle_inherit_workheet_permissions(bundle.uuid, worksheet_uuid)
+        self._notify_worker()
         return bundle.uuid
 
+    def _memoize_run_bundle(self, bundle):
+        '''
+        If an identical run is READY, give its results to the new bundle, so that
+        it doesn't have to run.  Runs whose parents are not READY yet are
+        memoized by the worker, when they are staged.
+        '''
+        parent_uuids = set(dep.parent_uuid for dep in bundle.dependencies)
+        parents = self.model.batch_get_bundles(uuid=parent_uuids) if parent_uuids else []
+        fingerprint = bundle.get_fingerprint(dict((parent.uuid, parent) for parent in parents))
+        source = fingerprint and self.model.get_memoized_run(fingerprint)
+        if source:
+            update = bundle.get_memoized_update(source)
+            for (key, value) in update.pop('metadata').iteritems():
+                bundle.metadata.set_metadata_key(key, value)
+            bundle.update_in_memory(update)
+
     def _bundle_inherit_workheet_permissions(self, bundle_uuid, worksheet_uuid):
         group_permissions = self.model.get_group_worksheet_permissions(self._current_user_id(), worksheet_uuid)
         for permissions in group_permissions:
@@ -258,6 +293,7 @@ class LocalBundleClient(BundleClient):
         check_bundles_have_all_permission(self.model, self._current_user(), bundle_uuids)
         for bundle_uuid in bundle_uuids:
             self.model.add_bundle_action(bundle_uuid, Command.KILL)
+        self._notify_worker()
 
     @authentication_required
     def chown_bundles(self, bundle_uuids, user_spec):
@@ -308,9 +344,9 @@ class LocalBundleClient(BundleClient):
         # Make sure we don't delete bundles which are active.
         if not force:
             states = self.model.get_bundle_states(uuids)
-            active_uuids = [uuid for (uuid, state) in states.items() if state in [State.QUEUED, State.RUNNING]]
+            active_uuids = [uuid for (uuid, state) in states.items() if state in [State.QUEUED, State.RUNNING, State.FINALIZING]]
             if len(active_uuids) > 0:
-                raise UsageError('Can\'t delete queued or running bundles (--force to override): %s' % ' '.join(active_uuids))
+                raise UsageError('Can\'t delete queued, running or finalizing bundles (--force to override): %s' % ' '.join(active_uuids))
 
         # Make sure that bundles are not referenced in multiple places (otherwise, it's very dangerous)
         result = self.model.get_host_worksheet_uuids(relevant_uuids)
@@ -355,7 +391,8 @@ class LocalBundleClient(BundleClient):
         if len(uuids) == 0:
             return {}
         bundles = self.model.batch_get_bundles(uuid=uuids)
-        bundle_dict = {bundle.uuid: self._bundle_to_bundle_info(bundle) for bundle in bundles}
+        parent_names = self.model.get_bundle_names(list(set(dep.parent_uuid for bundle in bundles for dep in bundle.dependencies)))
+        bundle_dict = {bundle.uuid: self._bundle_to_bundle_info(bundle, parent_names) for bundle in bundles}
 
         # Filter out bundles that we don't have read permission on
         def select_unreadable_bundles(uuids):
@@ -755,25 +792,48 @@ class LocalBundleClient(BundleClient):
             if bundle_uuid is not None
         )
         bundle_dict = self.get_bundle_infos(bundle_uuids)
+        # Same for the subworksheets.
+        subworksheet_uuids = set(
+            subworksheet_uuid for (bundle_uuid, subworksheet_uuid, value, type) in items
+            if subworksheet_uuid is not None
+        )
+        subworksheet_dict = self._get_subworksheet_infos(subworksheet_uuids)
 
         # Go through the items and substitute the components
         new_items = []
         for (bundle_uuid, subworksheet_uuid, value, type) in items:
             bundle_info = bundle_dict.get(bundle_uuid, {'uuid': bundle_uuid}) if bundle_uuid else None
             if subworksheet_uuid:
-                try:
-                    subworksheet_info = self.model.get_worksheet(subworksheet_uuid, fetch_items=False).to_dict()
-                except UsageError, e:
-                    # If can't get the subworksheet, it's probably invalid, so just replace it with an error
-                    #type = worksheet_util.TYPE_MARKUP
-                    subworksheet_info = {'uuid': subworksheet_uuid}
-                    #value = 'ERROR: non-existent worksheet %s' % subworksheet_uuid
+                # If can't get the subworksheet, it's probably invalid, so just replace it with an error
+                #type = worksheet_util.TYPE_MARKUP
+                subworksheet_info = subworksheet_dict.get(subworksheet_uuid, {'uuid': subworksheet_uuid})
+                #value = 'ERROR: non-existent worksheet %s' % subworksheet_uuid
             else:
                 subworksheet_info = None
             value_obj = worksheet_util.string_to_tokens(value) if type == worksheet_util.TYPE_DIRECTIVE else value
             new_items.append((bundle_info, subworksheet_info, value_obj, type))
         return new_items
 
+    def _get_subworksheet_infos(self, uuids):
+        '''
+        Helper: return map from worksheet uuid to info (with owner_name and the
+        permission of the current user) for the worksheets that exist.
+        Use a constant number of database calls.
+        '''
+        if len(uuids) == 0:
+            return {}
+        infos = dict(
+            (worksheet.uuid, worksheet.to_dict())
+            for worksheet in self.model.batch_get_worksheets(fetch_items=False, uuid=list(uuids))
+        )
+        owner_ids = dict((uuid, info['owner_id']) for uuid, info in infos.items())
+        permissions = self.model.get_user_worksheet_permissions(self._current_user_id(), infos.keys(), owner_ids)
+        owner_names = self._user_id_to_names(owner_ids.values())
+        for (uuid, owner_name) in zip(owner_ids.keys(), owner_names):
+            infos[uuid]['owner_name'] = owner_name
+            infos[uuid]['permission'] = permissions[uuid]
+        return infos
+
     @authentication_required
     def add_worksheet_item(self, worksheet_uuid, item):
         '''
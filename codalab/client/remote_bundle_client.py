@@ -5,6 +5,7 @@ the FileServer operations exposed by the RPC server.
 '''
 import os
 import contextlib
+import httplib
 import sys
 import urllib
 import tempfile
@@ -23,7 +24,7 @@ from codalab.lib import (
   path_util,
   zip_util,
 )
-from codalab.server.rpc_file_handle import RPCFileHandle
+from codalab.server.rpc_file_handle import HTTPFileTransfer, ResumableReader, RPCFileHandle
 
 class AuthenticatedTransport(xmlrpclib.SafeTransport):
     '''
@@ -94,6 +95,7 @@ class RemoteBundleClient(BundleClient):
       'resolve_interpreted_items',
       # Commands related to authentication (in BundleClient).
       'login',
+      'logout',
       # Commands related to groups and permissions.
       'list_groups',
       'new_group',
@@ -110,6 +112,9 @@ class RemoteBundleClient(BundleClient):
       'upload_bundle_zip',
       'open_target',  # Limited access to files (read)
       'open_target_zip',  # Limited access to files (read)
+      'open_upload_archive',  # Limited access to files (write)
+      'upload_bundle_archive',
+      'open_target_archive',  # Limited access to files (read)
     )
     # Implemented by the FileServer (superclass of BundleRPCServer).
     FILE_COMMANDS = (
@@ -130,6 +135,8 @@ class RemoteBundleClient(BundleClient):
         host = get_address_host(address)
         transport = AuthenticatedTransport(host, lambda cmd: None if cmd == 'login' else get_auth_token(self))
         self.proxy = xmlrpclib.ServerProxy(host, transport=transport, allow_none=True)
+        # Bulk file transfers bypass XML-RPC.
+        self.file_transfer = HTTPFileTransfer(host, lambda: get_auth_token(self))
         def do_command(command):
             def inner(*args, **kwargs):
                 import time
@@ -166,33 +173,51 @@ class RemoteBundleClient(BundleClient):
         if path and not isinstance(path, list) and path_util.path_is_url(path):
             return self.upload_bundle_url(path, info, worksheet_uuid, follow_symlinks, exclude_patterns)
 
-        # First, zip path up (temporary local zip file).
-        if path:
-            name = info['metadata']['name']
-            zip_path = zip_util.zip(path, follow_symlinks=follow_symlinks, exclude_patterns=exclude_patterns, file_name=name)
-            # Copy it up to the server (temporary remote zip file)
-            with open(zip_path, 'rb') as source:
-                remote_file_uuid = self.open_temp_file()
-                dest = RPCFileHandle(remote_file_uuid, self.proxy)
-                # FileServer does not expose an API for forcibly flushing writes, so
-                # we rely on closing the file to flush it.
-                file_util.copy(source, dest, autoflush=False, print_status='Uploading %s%s to %s' % (zip_path, ' ('+info['uuid']+')' if 'uuid' in info else '', self.address))
-                dest.close()
-        else:
-            remote_file_uuid = None
-            zip_path = None
+        if not path:
+            return self.upload_bundle_zip(None, info, worksheet_uuid, follow_symlinks, add_to_worksheet)
 
-        # Finally, install the zip file (this will be in charge of deleting that zip file).
-        result = self.upload_bundle_zip(remote_file_uuid, info, worksheet_uuid, follow_symlinks, add_to_worksheet)
+        # Stream a tar archive of path to the server, which extracts it as it arrives.
+        name = info['metadata']['name']
+        source = zip_util.tar_stream(path, follow_symlinks=follow_symlinks, exclude_patterns=exclude_patterns, file_name=name)
+        remote_file_uuid = self.open_upload_archive()
+        dest = RPCFileHandle(remote_file_uuid, self.proxy, self.file_transfer)
+        with contextlib.closing(source):
+            self._write_archive(source, dest, 'Uploading %s%s to %s' % (path, ' ('+info['uuid']+')' if 'uuid' in info else '', self.address))
+        # Finally, install the archive (this will be in charge of deleting its contents).
+        return self.upload_bundle_archive(remote_file_uuid, info, worksheet_uuid, follow_symlinks, add_to_worksheet)
 
-        if zip_path:
-            path_util.remove(zip_path)  # Remove local zip
-        return result
+    def _write_archive(self, source, dest, print_status):
+        '''
+        Copy an archive to a stream opened by open_upload_archive and close it.
+        '''
+        try:
+            file_util.copy(source, dest, autoflush=False, print_status=print_status)
+        except (xmlrpclib.Fault, xmlrpclib.ProtocolError):
+            # The server stops reading when the archive can't be extracted, and
+            # upload_bundle_archive reports why.
+            print >>sys.stderr
+        dest.close()
+
+    def _open_resumable(self, file_uuid, reopen):
+        '''
+        Return a ResumableReader for the given file uuid. If the transfer is
+        interrupted, reopen() is called to get a new file uuid for the same file.
+        '''
+        def reopen_at(offset):
+            handle = RPCFileHandle(reopen(), self.proxy, self.file_transfer)
+            handle.seek(offset, 0)
+            return handle
+        def discard(handle):
+            try:
+                self.close_target_handle(handle)
+            except (socket.error, httplib.HTTPException, xmlrpclib.Error, UsageError):
+                pass  # The server may have lost the handle already.
+        return ResumableReader(RPCFileHandle(file_uuid, self.proxy, self.file_transfer), reopen_at, discard)
 
     def open_target_handle(self, target):
         remote_file_uuid = self.open_target(target)
         if remote_file_uuid:
-            return RPCFileHandle(remote_file_uuid, self.proxy)
+            return self._open_resumable(remote_file_uuid, lambda: self.open_target(target))
         return None
     def close_target_handle(self, handle):
         handle.close()
@@ -205,43 +230,50 @@ class RemoteBundleClient(BundleClient):
         self.close_target_handle(source)
 
     def download_target(self, target, follow_symlinks, return_zip=False):
+        if return_zip:
+            return self._download_target_zip(target, follow_symlinks)
+        # Unpack the remote archive as it is generated, without temp files.
+        source_uuid, name = self.open_target_archive(target, follow_symlinks)
+        source = self._open_resumable(source_uuid, lambda: self.open_target_archive(target, follow_symlinks)[0])
+        container_path = tempfile.mkdtemp()
+        try:
+            reader = file_util.ProgressReader(source, 'Downloading %s on %s to %s' % ('/'.join(target), self.address, container_path))
+            result_path = zip_util.untar(reader, container_path, name)
+            reader.done()
+        finally:
+            self.close_target_handle(source)
+        return (result_path, container_path)
+
+    def _download_target_zip(self, target, follow_symlinks):
         # Create remote zip file, download to local zip file
         (fd, zip_path) = tempfile.mkstemp(dir=tempfile.gettempdir())
         os.close(fd)
         source_uuid, name = self.open_target_zip(target, follow_symlinks)
-        source = RPCFileHandle(source_uuid, self.proxy)
+        source = RPCFileHandle(source_uuid, self.proxy, self.file_transfer)
         with open(zip_path, 'wb') as dest:
             with contextlib.closing(source):
                 file_util.copy(source, dest, autoflush=False, print_status='Downloading %s on %s to %s' % ('/'.join(target), self.address, zip_path))
 
         self.finalize_file(source_uuid, True)  # Delete remote zip file
-        # Unpack the local zip file
         container_path = tempfile.mkdtemp()
-        if return_zip:
-            return zip_path, container_path
-
-        result_path = zip_util.unzip(zip_path, container_path, name)
-        path_util.remove(zip_path)  # Delete local zip file
-
-        return (result_path, container_path)
+        return zip_path, container_path
 
     def copy_bundle(self, source_bundle_uuid, info, dest_client, dest_worksheet_uuid, add_to_worksheet):
         '''
         A streamlined combination of download_target and upload_bundle.
         Copy from self to dest_client.
         '''
-        # Open source
-        source_file_uuid, name = self.open_target_zip((source_bundle_uuid, ''), False)
-        source = RPCFileHandle(source_file_uuid, self.proxy)
-        # Open target
-        dest_file_uuid = dest_client.open_temp_file()
-        dest = RPCFileHandle(dest_file_uuid, dest_client.proxy)
+        # Open source (an archive that is generated as we read it)
+        source_file_uuid, name = self.open_target_archive((source_bundle_uuid, ''), False)
+        source = self._open_resumable(source_file_uuid, lambda: self.open_target_archive((source_bundle_uuid, ''), False)[0])
+        # Open target (which is extracted as we write it)
+        dest_file_uuid = dest_client.open_upload_archive()
+        dest = RPCFileHandle(dest_file_uuid, dest_client.proxy, dest_client.file_transfer)
 
         # Copy contents over
-        file_util.copy(source, dest, autoflush=False, print_status='Copying %s from %s to %s' % (source_bundle_uuid, self.address, dest_client.address))
-        dest.close()
-        # Finally, install the zip file (this will be in charge of deleting that zip file).
-        result = dest_client.upload_bundle_zip(dest_file_uuid, info, dest_worksheet_uuid, False, add_to_worksheet)
-
-        self.finalize_file(source_file_uuid, True)  # Delete remote zip file
-        return result
+        try:
+            self._write_archive(source, dest, 'Copying %s from %s to %s' % (source_bundle_uuid, self.address, dest_client.address))
+        finally:
+            self.close_target_handle(source)
+        # Finally, install the archive (this will be in charge of deleting its contents).
+        return dest_client.upload_bundle_archive(dest_file_uuid, info, dest_worksheet_uuid, False, add_to_worksheet)
@@ -55,10 +55,11 @@ class State(object):
     STAGED = 'staged'     # All the dependencies are met
     QUEUED = 'queued'     # Submitted to the queue (and possibly copying files around)
     RUNNING = 'running'   # Actually running
+    FINALIZING = 'finalizing'  # Done running, and the results are being installed in the bundle store
     READY = 'ready'       # Done running and succeeded
     FAILED = 'failed'     # Done running and failed
 
-    OPTIONS = set([CREATED, STAGED, RUNNING, READY, FAILED])
+    OPTIONS = set([CREATED, STAGED, RUNNING, FINALIZING, READY, FAILED])
     FINAL_STATES = set([READY, FAILED])
 
 class Command(object):
@@ -0,0 +1,160 @@
+'''
+ArchiveCache is a cache of the tar archives of bundle targets that are served
+for downloads (see zip_util.tar_stream), stored in a directory under the CodaLab
+home directory.
+
+Archives are keyed on the bundle uuid, its data hash, the path of the target in
+the bundle, the name of the target in the archive (the bundle name, which can
+be edited) and whether symlinks are followed. Bundle data is immutable once it
+has a data hash, so a cached archive never goes stale. An archive is added to
+the cache as it is streamed to the first client that reads it to the end, and
+the least recently used archives are evicted when the cache grows over
+max_bytes.
+
+Cached archives are regular files, so they can be read from any offset, which
+lets interrupted downloads resume. Archives that are not cached are wrapped in
+an ArchiveStream, which can only skip forward.
+'''
+import errno
+import hashlib
+import os
+import sys
+import threading
+import uuid
+
+from codalab.lib import file_util, path_util
+
+
+class ArchiveStream(object):
+    '''
+    File-like wrapper around a stream (such as zip_util.tar_stream), which
+    supports tell and skipping forward with seek, and optionally saves what is
+    read to a file which is passed to on_complete once the stream is read to
+    the end.
+    '''
+    def __init__(self, source, cache_path=None, max_bytes=None, on_complete=None):
+        self.source = source
+        self.position = 0
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.on_complete = on_complete
+        self.cache_file = open(cache_path, 'wb') if cache_path else None
+
+    @property
+    def closed(self):
+        return self.source.closed
+
+    def read(self, num_bytes=None):
+        data = self.source.read() if num_bytes is None else self.source.read(num_bytes)
+        self.position += len(data)
+        if self.cache_file:
+            if not data:
+                self.cache_file.close()
+                self.cache_file = None
+                self.on_complete(self.cache_path)
+            elif self.position > self.max_bytes:
+                # Too large to be cached.
+                self._discard()
+            else:
+                try:
+                    self.cache_file.write(data)
+                except (IOError, OSError), e:
+                    # The cache is full or broken, which shouldn't fail the download.
+                    print >>sys.stderr, 'ArchiveStream: unable to cache %s: %s' % (self.cache_path, e)
+                    self._discard()
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        if whence == 2 or offset < self.position:
+            raise IOError(errno.ESPIPE, 'Archive streams can only skip forward')
+        while self.position < offset:
+            if not self.read(min(file_util.BUFFER_SIZE, offset - self.position)):
+                break
+
+    def close(self):
+        self._discard()
+        self.source.close()
+
+    def _discard(self):
+        if self.cache_file:
+            try:
+                self.cache_file.close()
+            except (IOError, OSError):
+                # Closing flushes what is left, which fails if the disk is full.
+                pass
+            self.cache_file = None
+            path_util.remove(self.cache_path)
+
+
+class ArchiveCache(object):
+    SUFFIX = '.tar'
+    PARTIAL_SUFFIX = '.partial'
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        path_util.make_directory(path)
+        # Remove archives that were being written when the server stopped.
+        for file_name in os.listdir(path):
+            if file_name.endswith(self.PARTIAL_SUFFIX):
+                path_util.remove(os.path.join(path, file_name))
+
+    @staticmethod
+    def get_key(bundle_uuid, data_hash, subpath, name, follow_symlinks):
+        return hashlib.sha1(repr((bundle_uuid, data_hash, subpath, name, bool(follow_symlinks)))).hexdigest()
+
+    def get_location(self, key):
+        return os.path.join(self.path, key + self.SUFFIX)
+
+    def open(self, key, generate):
+        '''
+        Return a file object for reading the archive with the given key. If it is
+        cached, this is the cached file. Otherwise, it is an ArchiveStream of the
+        stream returned by generate(), which is added to the cache once it is
+        read to the end.
+        '''
+        cache_path = self.get_location(key)
+        try:
+            archive = open(cache_path, 'rb')
+            # Mark as recently used.
+            os.utime(cache_path, None)
+            return archive
+        except (IOError, OSError), e:
+            if e.errno != errno.ENOENT:
+                raise
+        # Write to a unique path, in case the same archive is being generated by
+        # several readers.
+        partial_path = os.path.join(self.path, '%s.%s%s' % (key, uuid.uuid4().hex, self.PARTIAL_SUFFIX))
+        def on_complete(path):
+            os.rename(path, cache_path)
+            self.evict()
+        return ArchiveStream(generate(), partial_path, self.max_bytes, on_complete)
+
+    def evict(self):
+        '''
+        Remove the least recently used archives until the cache fits in max_bytes.
+        '''
+        with self.lock:
+            archives = []
+            for file_name in os.listdir(self.path):
+                if not file_name.endswith(self.SUFFIX):
+                    continue
+                try:
+                    archive_stat = os.stat(os.path.join(self.path, file_name))
+                except OSError:
+                    continue
+                archives.append((archive_stat.st_mtime, archive_stat.st_size, file_name))
+            archives.sort()
+            total_bytes = sum(size for (_, size, _) in archives)
+            for (_, size, file_name) in archives:
+                if total_bytes <= self.max_bytes:
+                    break
+                print >>sys.stderr, 'ArchiveCache: evicting %s' % file_name
+                path_util.remove(os.path.join(self.path, file_name))
+                total_bytes -= size
@@ -45,6 +45,7 @@ from codalab.objects.worksheet import Worksheet
 from codalab.objects.work_manager import Worker
 from codalab.machines.remote_machine import RemoteMachine
 from codalab.machines.local_machine import LocalMachine
+from codalab.lib.scheduling import get_scheduling_policy
 from codalab.client.remote_bundle_client import RemoteBundleClient
 from codalab.lib.formatting import contents_str
 
@@ -96,6 +97,7 @@ class BundleCLI(object):
       # Internal commands wihch are used for debugging.
       'events': 'Print the history of commands on this CodaLab instance (local only).',
       'cleanup': 'Clean up the CodaLab bundle store (local only).',
+      'dedup': 'Deduplicate the files of existing bundles in a DedupBundleStore (local only).',
       'reset': 'Delete the CodaLab bundle store and reset the database (local only).',
       # Note: this is not actually handled in BundleCLI, but here just to show the help
       'server': 'Start an instance of the CodaLab server.',
@@ -1586,13 +1588,18 @@ class BundleCLI(object):
         parser.add_argument('-t', '--worker-type', type=str, help="worker type (defined in config.json)", default='local')
         parser.add_argument('--num-iterations', help="number of bundles to process before exiting", type=int, default=None)
         parser.add_argument('--sleep-time', type=int, help='Number of seconds to wait between successive polls', default=1)
+        parser.add_argument('--poll-interval', type=int, help='Number of seconds to wait between successive polls when the worker is notified of changes', default=60)
+        parser.add_argument('--no-notify', action='store_true', help='Poll every --sleep-time seconds instead of waiting for notifications')
+        parser.add_argument('--worker-id', help='Identifies this worker among the workers sharing the database (default: <hostname>:<pid>)')
         args = parser.parse_args(argv)
 
         worker_config = self.manager.config['workers']
         if args.worker_type == 'local':
-            machine = LocalMachine()
+            machine_config = worker_config.get('local', {})
+            machine = LocalMachine(machine_config)
         elif args.worker_type in worker_config:
-            machine = RemoteMachine(worker_config[args.worker_type])
+            machine_config = worker_config[args.worker_type]
+            machine = RemoteMachine(machine_config)
         else:
             print '\'' + args.worker_type + '\'' + \
                   ' is not specified in your config file: ' + self.manager.config_path()
@@ -1600,8 +1607,11 @@ class BundleCLI(object):
             return
 
         client = self.manager.local_client()  # Always use the local bundle client
-        worker = Worker(client.bundle_store, client.model, machine, client.auth_handler)
-        worker.run_loop(args.num_iterations, args.sleep_time)
+        notifier = None if args.no_notify else self.manager.worker_notifier()
+        scheduling_policy = get_scheduling_policy(machine_config)
+        lease_time = machine_config.get('lease_time', Worker.LEASE_TIME)
+        worker = Worker(client.bundle_store, client.model, machine, client.auth_handler, notifier, scheduling_policy, args.worker_id, lease_time, memoize_runs=client.memoize_runs)
+        worker.run_loop(args.num_iterations, args.sleep_time, args.poll_interval)
 
     def do_events_command(self, argv, parser):
         self._fail_if_headless('events')
@@ -1643,9 +1653,25 @@ class BundleCLI(object):
         Delete unused data and temp files (be careful!).
         '''
         parser.add_argument('-i', '--dry-run', action='store_true', help='don\'t actually do it, but see what the command would do')
+        parser.add_argument('-v', '--verify', action='store_true', help='check that the data of each bundle still matches its hash')
         args = parser.parse_args(argv)
         client = self.manager.current_client()
-        client.bundle_store.full_cleanup(client.model, args.dry_run)
+        client.bundle_store.full_cleanup(client.model, args.dry_run, args.verify)
+
+    def do_dedup_command(self, argv, parser):
+        '''
+        Move the files of bundles stored before the bundle store was switched to
+        DedupBundleStore into its object pool.
+        '''
+        self._fail_if_headless('dedup')
+        self._fail_if_not_local('dedup')
+        parser.add_argument('-i', '--dry-run', action='store_true', help='don\'t actually do it, but see what the command would do')
+        args = parser.parse_args(argv)
+        client = self.manager.current_client()
+        from codalab.lib.dedup_bundle_store import DedupBundleStore
+        if not isinstance(client.bundle_store, DedupBundleStore):
+            raise UsageError('Bundle store is not a DedupBundleStore (set bundle_store_class in the server config)')
+        client.bundle_store.migrate(args.dry_run)
 
     def do_reset_command(self, argv, parser):
         '''
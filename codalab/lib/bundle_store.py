@@ -11,7 +11,7 @@ import sys
 import uuid
 import tempfile
 
-from codalab.lib import path_util, file_util, print_util
+from codalab.lib import path_util, file_util, formatting, print_util
 from codalab.common import UsageError
 
 class BundleStore(object):
@@ -25,13 +25,19 @@ class BundleStore(object):
     DATA_CLEANUP_TIME = 60
     TEMP_CLEANUP_TIME = 60*60
 
-    def __init__(self, codalab_home, direct_upload_paths):
+    def __init__(self, codalab_home, direct_upload_paths, hash_workers=1, hash_processes=False, hash_cache=None):
         '''
         codalab_home: data/ is where all the bundles are actually stored, temp/ is temporary
         direct_upload_paths: we can accept file://... uploads from these paths.
+        hash_workers: number of threads (or processes, if hash_processes) used to
+          hash the files of an upload.
+        hash_cache: optional HashCache used to avoid rehashing unchanged files.
         '''
         self.codalab_home = path_util.normalize(codalab_home)
         self.direct_upload_paths = direct_upload_paths
+        self.hash_workers = hash_workers
+        self.hash_processes = hash_processes
+        self.hash_cache = hash_cache
         self.data = os.path.join(self.codalab_home, self.DATA_SUBDIRECTORY)
         self.temp = os.path.join(self.codalab_home, self.TEMP_SUBDIRECTORY)
         self.make_directories()
@@ -73,11 +79,13 @@ class BundleStore(object):
         path_util.make_directory(self.get_temp_location(identifier));
 
 
-    def upload(self, path, follow_symlinks, exclude_patterns):
+    def upload(self, path, follow_symlinks, exclude_patterns, contents_hashes=None):
         '''
         Copy the contents of the directory at |path| into the data subdirectory,
         in a subfolder named by a hash of the contents of the new data directory.
-        If |path| is in a temporary directory, then we just move it.
+        If |path| is in a temporary directory, then we just move it, and
+        |contents_hashes| can map its files to their hashes if they were computed
+        while the files were written, so that they are not read again.
 
         Return a (data_hash, metadata) pair, where the metadata is a dict mapping
         keys to precomputed statistics about the new data directory.
@@ -90,6 +98,8 @@ class BundleStore(object):
         else:
             temp_path = os.path.join(self.temp, uuid.uuid4().hex)
 
+        # (copied file, source file) hash cache keys of the files copied below.
+        copied_keys = []
         if not isinstance(path, list) and path_util.path_is_url(path):
             # Have to be careful.  Want to make sure if we're fetching a URL
             # that points to a file, we are allowing this.
@@ -113,25 +123,22 @@ class BundleStore(object):
                 path_util.check_isvalid(absolute_path, 'upload')
 
             # Recursively copy the directory into a new BundleStore temp directory.
+            source_keys = self._get_source_keys(absolute_path, temp_path)
             print_util.open_line('BundleStore.upload: copying %s to %s' % (absolute_path, temp_path))
-            path_util.copy(absolute_path, temp_path, follow_symlinks=follow_symlinks, exclude_patterns=exclude_patterns)
+            copy_stats = path_util.copy(absolute_path, temp_path, follow_symlinks=follow_symlinks, exclude_patterns=exclude_patterns)
             print_util.clear_line()
+            print >>sys.stderr, 'BundleStore.upload: copied %d files (%s)' % (
+              copy_stats['num_files'], formatting.size_str(copy_stats['num_bytes']))
+            copied_keys = self._seed_hash_cache(source_keys)
 
-        # Multiplex between uploading a directory and uploading a file here.
-        # All other path_util calls will use these lists of directories and files.
-        if os.path.isdir(temp_path):
-            dirs_and_files = path_util.recursive_ls(temp_path)
-        else:
-            dirs_and_files = ([], [temp_path])
-
-        # Hash the contents of the temporary directory, and then if there is no
-        # data with this hash value, move this directory into the data directory.
+        # Walk, hash and size the contents of the temporary directory in one pass,
+        # and then if there is no data with this hash value, move this directory
+        # into the data directory.
         print_util.open_line('BundleStore.upload: hashing %s' % temp_path)
-        data_hash = '0x%s' % (path_util.hash_directory(temp_path, dirs_and_files),)
-        print_util.clear_line()
-        print_util.open_line('BundleStore.upload: computing size of %s' % temp_path)
-        data_size = path_util.get_size(temp_path, dirs_and_files)
+        summary = self._summarize(temp_path, contents_hashes if path == temp_path else None)
         print_util.clear_line()
+        self._record_source_hashes(copied_keys)
+        data_hash = '0x%s' % (summary['hash'],)
         final_path = os.path.join(self.data, data_hash)
         final_path_exists = False
         try:
@@ -140,8 +147,7 @@ class BundleStore(object):
             final_path_exists = True
         except OSError, e:
             if e.errno == errno.ENOENT:
-                print >>sys.stderr, 'BundleStore.upload: moving %s to %s' % (temp_path, final_path)
-                path_util.rename(temp_path, final_path)
+                self._add_data(temp_path, final_path, summary)
             else:
                 raise
         if final_path_exists:
@@ -149,12 +155,95 @@ class BundleStore(object):
 
         # After this operation there should always be a directory at the final path.
         assert(os.path.exists(final_path)), 'Uploaded to %s failed!' % (final_path,)
-        return (data_hash, {'data_size': data_size})
+        return (data_hash, {
+          'data_size': summary['size'],
+          'data_file_count': summary['file_count'],
+          'data_directory_count': summary['directory_count'],
+          'data_largest_file_size': summary['largest_file_size'],
+        })
+
+    def _add_data(self, temp_path, final_path, summary):
+        '''
+        Move new data from |temp_path| into the data directory at |final_path|.
+        |summary| is the path_util.summarize of |temp_path|.
+        '''
+        print >>sys.stderr, 'BundleStore.upload: moving %s to %s' % (temp_path, final_path)
+        path_util.rename(temp_path, final_path)
+
+    def _summarize(self, path, known_hashes=None):
+        '''
+        Return path_util.summarize of the file or directory at the given path.
+        '''
+        return path_util.summarize(path, self.hash_workers, self.hash_processes, self.hash_cache, known_hashes)
+
+    def _get_source_keys(self, source, temp_path):
+        '''
+        Return a dict mapping each file that copying |source| to |temp_path| will
+        create to the (path, hash cache key) of the regular file it is copied from.
+        Called before the copy, so that files changed during the copy can be
+        detected afterwards.
+        '''
+        if self.hash_cache is None:
+            return {}
+        if isinstance(source, list):
+            pairs = [(p, os.path.join(temp_path, os.path.basename(p))) for p in source]
+        else:
+            pairs = [(source, temp_path)]
+        result = {}
+        for (source_path, dest_path) in pairs:
+            if os.path.islink(source_path) or not os.path.isdir(source_path):
+                files = [source_path]
+            else:
+                (_, files) = path_util.recursive_ls(source_path)
+            for source_file in files:
+                key = self.hash_cache.get_key(source_file)
+                if key is not None:
+                    dest_file = dest_path + path_util.get_relative_path(source_path, source_file)
+                    result[dest_file] = (source_file, key)
+        return result
+
+    def _seed_hash_cache(self, source_keys):
+        '''
+        After a copy, give each copied file the cached hash of the file it was
+        copied from, if that file did not change during the copy. Return the list
+        of (copied file, source key) pairs for which this holds, so that their
+        hashes can be recorded for the source files once they are computed.
+        '''
+        if not source_keys:
+            return []
+        cached_hashes = self.hash_cache.lookup(set(key for (_, key) in source_keys.itervalues()))
+        copied_keys = []
+        new_items = []
+        for (dest_file, (source_file, key)) in source_keys.iteritems():
+            if self.hash_cache.get_key(source_file) != key:
+                continue
+            dest_key = self.hash_cache.get_key(dest_file)
+            if dest_key is None:
+                continue
+            copied_keys.append((dest_key, key))
+            if key in cached_hashes:
+                new_items.append((dest_key, cached_hashes[key]))
+        self.hash_cache.store(new_items)
+        return copied_keys
+
+    def _record_source_hashes(self, copied_keys):
+        '''
+        Cache the hashes of copied files for the files they were copied from, so
+        that uploading the same files again does not require reading them.
+        '''
+        if not copied_keys:
+            return
+        cached_hashes = self.hash_cache.lookup([dest_key for (dest_key, _) in copied_keys])
+        self.hash_cache.store([
+          (key, cached_hashes[dest_key]) for (dest_key, key) in copied_keys
+          if dest_key in cached_hashes
+        ])
 
     def cleanup(self, model, data_hash, except_bundle_uuids, dry_run):
         '''
         If the given data hash is not needed by any bundle (not in
-        except_bundle_uuids), delete the data.
+        except_bundle_uuids), delete the data. Return whether it was deleted
+        (or would have been, if dry_run).
         '''
         bundles = model.batch_get_bundles(data_hash=data_hash)
         if all(bundle.uuid in except_bundle_uuids for bundle in bundles):
@@ -162,11 +251,14 @@ class BundleStore(object):
             print >>sys.stderr, "cleanup: data %s" % absolute_path
             if not dry_run:
                 path_util.remove(absolute_path)
+            return True
+        return False
 
-    def full_cleanup(self, model, dry_run):
+    def full_cleanup(self, model, dry_run, verify=False):
         '''
         For each data hash in the store, check if it should be garbage collected and
         delete its data if so. In addition, delete any old temporary files.
+        If verify is set, also check that the remaining data matches its hash.
         '''
         old_data_files = self.list_old_files(self.data, self.DATA_CLEANUP_TIME)
         for data_hash in old_data_files:
@@ -177,6 +269,21 @@ class BundleStore(object):
             print >>sys.stderr, "cleanup: temp %s" % temp_path
             if not dry_run:
                 path_util.remove(temp_path)
+        if verify:
+            for data_hash in os.listdir(self.data):
+                self.verify(data_hash)
+
+    def verify(self, data_hash):
+        '''
+        Rehash the data stored under the given data hash and return whether it
+        still matches. Unchanged files are not reread if there is a hash cache.
+        '''
+        path = self.get_location(data_hash)
+        actual_hash = '0x%s' % (self._summarize(path)['hash'],)
+        if actual_hash != data_hash:
+            print >>sys.stderr, "verify: data %s has hash %s" % (path, actual_hash)
+            return False
+        return True
 
     def list_old_files(self, path, cleanup_time):
         cleanup_cutoff = time.time() - cleanup_time
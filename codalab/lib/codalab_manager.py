@@ -143,7 +143,41 @@ class CodaLabManager(object):
     def bundle_store(self):
         codalab_home = self.codalab_home()
         direct_upload_paths = self.config['server'].get('direct_upload_paths', [])
-        return BundleStore(codalab_home, direct_upload_paths)
+        # Hash uploaded files with this many threads or processes.
+        hash_workers = self.config['server'].get('hash_workers', 1)
+        hash_pool = self.config['server'].get('hash_pool', 'thread')
+        if hash_pool not in ('thread', 'process'):
+            raise UsageError('Unexpected hash pool: %s, expected thread or process' % (hash_pool,))
+        # Cache the hashes of up to this many files across uploads (0 to disable).
+        hash_cache_size = self.config['server'].get('hash_cache_size', 1000000)
+        hash_cache = None
+        if hash_cache_size > 0:
+            from codalab.lib.hash_cache import HashCache
+            hash_cache = HashCache(os.path.join(codalab_home, 'hash_cache.sqlite'), hash_cache_size)
+        bundle_store_class = self.config['server'].get('bundle_store_class', 'BundleStore')
+        if bundle_store_class == 'BundleStore':
+            store_class = BundleStore
+        elif bundle_store_class == 'DedupBundleStore':
+            from codalab.lib.dedup_bundle_store import DedupBundleStore
+            store_class = DedupBundleStore
+        else:
+            raise UsageError('Unexpected bundle store class: %s, expected BundleStore or DedupBundleStore' % (bundle_store_class,))
+        return store_class(codalab_home, direct_upload_paths, hash_workers, hash_pool == 'process', hash_cache)
+
+    @cached
+    def archive_cache(self):
+        from codalab.lib import formatting
+        # Keep up to this many bytes of archives generated for downloads (0 to disable).
+        archive_cache_size = formatting.parse_size(str(self.config['server'].get('archive_cache_size', '10g')))
+        if archive_cache_size <= 0:
+            return None
+        from codalab.lib.archive_cache import ArchiveCache
+        return ArchiveCache(os.path.join(self.codalab_home(), 'archives'), archive_cache_size)
+
+    @cached
+    def worker_notifier(self):
+        from codalab.lib.worker_notifier import WorkerNotifier
+        return WorkerNotifier(os.path.join(self.codalab_home(), 'worker.sock'))
 
     def apply_alias(self, key):
         return self.config['aliases'].get(key, key)
@@ -233,8 +267,10 @@ class CodaLabManager(object):
     @cached
     def oauth_handler(self):
         arguments = ('address', 'app_id', 'app_key')
+        optional_arguments = ('cache_ttl', 'negative_cache_ttl', 'cache_size')
         auth_config = self.config['server']['auth']
         kwargs = {arg: auth_config[arg] for arg in arguments}
+        kwargs.update((arg, auth_config[arg]) for arg in optional_arguments if arg in auth_config)
         from codalab.server.auth import OAuthHandler
         return OAuthHandler(**kwargs)
 
@@ -265,7 +301,8 @@ class CodaLabManager(object):
             auth_handler = self.auth_handler(mock=is_cli)
 
             from codalab.client.local_bundle_client import LocalBundleClient
-            client = LocalBundleClient(address, bundle_store, model, auth_handler, self.cli_verbose)
+            memoize_runs = self.config['server'].get('memoize_runs', False)
+            client = LocalBundleClient(address, bundle_store, model, auth_handler, self.cli_verbose, self.worker_notifier(), memoize_runs)
             self.clients[address] = client
             if is_cli:
                 # Set current user
@@ -368,8 +405,14 @@ class CodaLabManager(object):
         self.save_state()
 
     def logout(self, client):
-        del self.state['auth'][client.address]  # Clear credentials
-        self.save_state()
+        token_info = self.state['auth'][client.address].get('token_info')
+        try:
+            # An expired token can't be used to reach the server, which doesn't cache it anymore anyway.
+            if token_info and token_info.get('expires_at', 0.0) > time.time():
+                client.logout(token_info['access_token'])
+        finally:
+            del self.state['auth'][client.address]  # Clear credentials
+            self.save_state()
 
     def save_config(self):
         if self.temporary: return
@@ -0,0 +1,181 @@
+'''
+DedupBundleStore is a BundleStore that also deduplicates individual files
+across bundles. Bundle data is still laid out under data/<data_hash>, but each
+regular file is a hardlink into a shared object pool:
+
+  objects/<hash[:2]>/<hash>-<mode>: one inode per distinct (contents, mode)
+  manifests/<data_hash>: the objects used by the data with that hash
+
+Hardlinks double as reference counts: an object whose link count is 1 is only
+referenced by the pool and can be deleted. Since all bundle files share inodes
+with the pool, bundle data must never be modified in place.
+'''
+import errno
+import os
+import stat
+import sys
+import uuid
+
+from codalab.lib import path_util
+from codalab.lib.bundle_store import BundleStore
+
+
+class DedupBundleStore(BundleStore):
+    OBJECTS_SUBDIRECTORY = 'objects'
+    MANIFESTS_SUBDIRECTORY = 'manifests'
+
+    def __init__(self, codalab_home, *args, **kwargs):
+        home = path_util.normalize(codalab_home)
+        self.objects = os.path.join(home, self.OBJECTS_SUBDIRECTORY)
+        self.manifests = os.path.join(home, self.MANIFESTS_SUBDIRECTORY)
+        super(DedupBundleStore, self).__init__(codalab_home, *args, **kwargs)
+
+    def _reset(self):
+        path_util.remove(self.objects)
+        path_util.remove(self.manifests)
+        super(DedupBundleStore, self)._reset()
+
+    def make_directories(self):
+        super(DedupBundleStore, self).make_directories()
+        for path in (self.objects, self.manifests):
+            path_util.make_directory(path)
+
+    def get_manifest_location(self, data_hash):
+        return os.path.join(self.manifests, data_hash)
+
+    def _add_data(self, temp_path, final_path, summary):
+        super(DedupBundleStore, self)._add_data(temp_path, final_path, summary)
+        files = [
+          final_path + path_util.get_relative_path(temp_path, file_path)
+          for file_path in summary['files']
+        ]
+        self._deduplicate(os.path.basename(final_path), zip(files, summary['contents_hashes']))
+
+    def _deduplicate(self, data_hash, files_and_hashes):
+        '''
+        Replace each regular file in the given list of (path, contents hash) pairs
+        by a hardlink into the object pool, and write the manifest for data_hash.
+        Return the number of files that were already in the pool.
+        '''
+        object_names = []
+        num_shared = 0
+        for (file_path, contents_hash) in files_and_hashes:
+            file_stat = os.lstat(file_path)
+            if not stat.S_ISREG(file_stat.st_mode):
+                continue
+            object_name = os.path.join(
+              contents_hash[:2], '%s-%o' % (contents_hash, stat.S_IMODE(file_stat.st_mode)))
+            result = self._link_object(file_path, file_stat, object_name)
+            if result is not None:
+                object_names.append(object_name)
+                num_shared += result
+        with open(self.get_manifest_location(data_hash), 'w') as manifest:
+            for object_name in sorted(set(object_names)):
+                print >>manifest, object_name
+        return num_shared
+
+    def _link_object(self, file_path, file_stat, object_name):
+        '''
+        Make the file at file_path share its inode with the given object, adding
+        the file to the pool if the object does not exist yet. Return whether
+        the object already existed, or None if the file could not be linked.
+        '''
+        object_path = os.path.join(self.objects, object_name)
+        try:
+            os.mkdir(os.path.dirname(object_path))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Retry if the object is garbage collected while we are linking to it.
+        for _ in range(3):
+            try:
+                os.link(file_path, object_path)
+                return False
+            except OSError, e:
+                if e.errno in (errno.EXDEV, errno.EMLINK):
+                    return None
+                if e.errno != errno.EEXIST:
+                    raise
+            object_stat = os.lstat(object_path)
+            if object_stat.st_ino == file_stat.st_ino:
+                return True
+            if object_stat.st_mode != file_stat.st_mode:
+                # The object was made read-only (see path_util.materialize).
+                return None
+            temp_link = '%s.%s' % (file_path, uuid.uuid4().hex)
+            try:
+                os.link(object_path, temp_link)
+            except OSError, e:
+                if e.errno == errno.ENOENT:
+                    continue
+                if e.errno == errno.EMLINK:
+                    return None
+                raise
+            os.rename(temp_link, file_path)
+            return True
+        return None
+
+    def _release_objects(self, data_hash, dry_run):
+        '''
+        Delete the manifest of data that has been deleted, along with any of its
+        objects that are no longer used by other data.
+        '''
+        manifest_path = self.get_manifest_location(data_hash)
+        if not os.path.exists(manifest_path):
+            return
+        with open(manifest_path) as manifest:
+            object_names = manifest.read().splitlines()
+        for object_name in object_names:
+            self._collect_object(os.path.join(self.objects, object_name), dry_run)
+        if not dry_run:
+            os.remove(manifest_path)
+
+    def _collect_object(self, object_path, dry_run):
+        try:
+            if os.lstat(object_path).st_nlink > 1:
+                return
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        print >>sys.stderr, "cleanup: object %s" % object_path
+        if not dry_run:
+            os.remove(object_path)
+
+    def cleanup(self, model, data_hash, except_bundle_uuids, dry_run):
+        removed = super(DedupBundleStore, self).cleanup(model, data_hash, except_bundle_uuids, dry_run)
+        if removed and not dry_run:
+            self._release_objects(data_hash, dry_run)
+        return removed
+
+    def full_cleanup(self, model, dry_run, verify=False):
+        '''
+        In addition to the BundleStore cleanup, delete manifests of missing data
+        and sweep the object pool for unreferenced objects.
+        '''
+        super(DedupBundleStore, self).full_cleanup(model, dry_run, verify)
+        for data_hash in os.listdir(self.manifests):
+            if not os.path.lexists(self.get_location(data_hash)):
+                self._release_objects(data_hash, dry_run)
+        for prefix in os.listdir(self.objects):
+            prefix_path = os.path.join(self.objects, prefix)
+            for object_name in os.listdir(prefix_path):
+                self._collect_object(os.path.join(prefix_path, object_name), dry_run)
+
+    def migrate(self, dry_run):
+        '''
+        Deduplicate the files of data that was stored before this store was used
+        (that is, data without a manifest).
+        '''
+        for data_hash in sorted(os.listdir(self.data)):
+            if os.path.exists(self.get_manifest_location(data_hash)):
+                continue
+            path = self.get_location(data_hash)
+            print >>sys.stderr, "migrate: data %s" % path
+            if dry_run:
+                continue
+            # Allow creating the temporary links next to the files.
+            path_util.set_write_permissions(path)
+            summary = self._summarize(path)
+            num_shared = self._deduplicate(data_hash, zip(summary['files'], summary['contents_hashes']))
+            print >>sys.stderr, "migrate: %d of %d files were already stored" % (num_shared, summary['file_count'])
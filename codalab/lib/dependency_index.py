@@ -0,0 +1,130 @@
+'''
+DependencyIndex tracks which parents each CREATED bundle is still waiting on,
+so that the worker (see Worker.update_created_bundles) only has to look at
+bundles whose parents changed state, rather than loading every CREATED bundle
+and all of their parents on each iteration.
+
+The index is kept in memory and built from the database:
+  - CREATED bundles are discovered incrementally, by id.
+  - The worker reports the state changes it makes (bundles becoming READY or
+    FAILED) with update_state, which resolves the waiting children right away.
+  - State changes made elsewhere (e.g., by another worker, an upload or cl
+    edit, or parents that did not exist yet) are picked up on each sync, by
+    looking up the states of the parents that are still waited on.
+  - The index is rebuilt from scratch every resync_interval seconds, which
+    drops the bundles that left the CREATED state elsewhere (e.g., were
+    deleted).
+'''
+import time
+
+from codalab.common import State
+
+
+class DependencyIndex(object):
+    RESOLVED_STATES = (State.READY, State.FAILED)
+
+    def __init__(self, model, resync_interval=300):
+        self.model = model
+        self.resync_interval = resync_interval
+        self.reset()
+
+    def reset(self):
+        # Largest id of the CREATED bundles that have been indexed.
+        self.last_id = 0
+        # child uuid -> set of parent uuids that aren't READY or FAILED yet
+        self.waiting = {}
+        # parent uuid -> set of child uuids waiting on it
+        self.children = {}
+        # child uuid -> list of failed parent uuids, for children that are ready
+        # to be processed (staged if the list is empty, failed otherwise)
+        self.resolved = {}
+        self.last_resync_time = time.time()
+
+    def sync(self):
+        '''
+        Add the CREATED bundles that were created since the last call, resolve
+        the ones whose parents changed state, and rebuild the index if it's
+        time to.
+        '''
+        if time.time() - self.last_resync_time > self.resync_interval:
+            self.reset()
+        else:
+            self._sync_parents()
+        self._add_new_bundles()
+
+    def _sync_parents(self):
+        if not self.children:
+            return
+        parent_states = self.model.get_bundle_states(self.children.keys())
+        for (parent_uuid, state) in parent_states.iteritems():
+            self.update_state(parent_uuid, state)
+
+    def _add_new_bundles(self):
+        new_bundles = self.model.get_created_bundle_parents(self.last_id)
+        if not new_bundles:
+            return
+        self.last_id = max(self.last_id, max(bundle_id for (bundle_id, _) in new_bundles.itervalues()))
+        # Only parents that aren't already known to be pending need to be looked up.
+        parent_uuids = set(
+          parent_uuid for (_, parent_uuids) in new_bundles.itervalues() for parent_uuid in parent_uuids
+          if parent_uuid not in self.children
+        )
+        parent_states = self.model.get_bundle_states(parent_uuids) if parent_uuids else {}
+        for (uuid, (_, parent_uuids)) in new_bundles.iteritems():
+            if uuid in self.waiting or uuid in self.resolved:
+                continue
+            failed_uuids = [
+              parent_uuid for parent_uuid in parent_uuids
+              if parent_states.get(parent_uuid) == State.FAILED
+            ]
+            # Missing parents (which might show up later) are waited on.
+            pending_uuids = set(
+              parent_uuid for parent_uuid in parent_uuids
+              if parent_states.get(parent_uuid) not in self.RESOLVED_STATES
+            )
+            if failed_uuids or not pending_uuids:
+                self.resolved[uuid] = failed_uuids
+                continue
+            self.waiting[uuid] = pending_uuids
+            for parent_uuid in pending_uuids:
+                self.children.setdefault(parent_uuid, set()).add(uuid)
+
+    def update_state(self, uuid, state):
+        '''
+        Record that the bundle with the given uuid moved to the given state.
+        '''
+        if state not in self.RESOLVED_STATES:
+            return
+        for child_uuid in self.children.pop(uuid, ()):
+            pending_uuids = self.waiting.get(child_uuid)
+            if pending_uuids is None:
+                continue
+            pending_uuids.discard(uuid)
+            if state == State.FAILED or not pending_uuids:
+                self._resolve(child_uuid, [uuid] if state == State.FAILED else [])
+
+    def _resolve(self, uuid, failed_uuids):
+        for parent_uuid in self.waiting.pop(uuid):
+            child_uuids = self.children.get(parent_uuid)
+            if child_uuids is not None:
+                child_uuids.discard(uuid)
+                if not child_uuids:
+                    del self.children[parent_uuid]
+        self.resolved[uuid] = failed_uuids
+
+    def pop_resolved(self):
+        '''
+        Return {uuid: [failed parent uuid, ...], ...} for the CREATED bundles
+        whose parents are all READY, or one of which FAILED, and remove them from
+        the index.
+        '''
+        resolved = self.resolved
+        self.resolved = {}
+        return resolved
+
+    def restore_resolved(self, resolved):
+        '''
+        Put back bundles returned by pop_resolved that couldn't be processed, in
+        the same format, so that they are returned again.
+        '''
+        self.resolved.update(resolved)
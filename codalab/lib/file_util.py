@@ -13,6 +13,7 @@ from codalab.common import UsageError
 def copy(source, dest, autoflush=True, print_status=None):
     '''
     Read from the source file handle and write the data to the dest file handle.
+    Returns the number of bytes copied.
     '''
     n = 0
     while True:
@@ -28,6 +29,27 @@ def copy(source, dest, autoflush=True, print_status=None):
             sys.stderr.flush()
     if print_status:
         print >>sys.stderr, "\r%s: %s [done]" % (print_status, formatting.size_str(n))
+    return n
+
+class ProgressReader(object):
+    '''
+    Wraps a file handle that is being read sequentially (for example, by
+    tarfile), and prints the number of bytes read so far like copy does.
+    '''
+    def __init__(self, source, print_status):
+        self.source = source
+        self.print_status = print_status
+        self.num_bytes = 0
+
+    def read(self, num_bytes=None):
+        buffer = self.source.read(num_bytes)
+        self.num_bytes += len(buffer)
+        print >>sys.stderr, "\r%s: %s" % (self.print_status, formatting.size_str(self.num_bytes)),
+        sys.stderr.flush()
+        return buffer
+
+    def done(self):
+        print >>sys.stderr, "\r%s: %s [done]" % (self.print_status, formatting.size_str(self.num_bytes))
 
 def download_url(source_url, target_path, print_status=False):
     '''
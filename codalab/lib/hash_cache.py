@@ -0,0 +1,128 @@
+'''
+HashCache is a persistent cache of file content hashes (as computed by
+path_util.hash_file_contents), stored in a sqlite database under the CodaLab
+home directory.
+
+Entries are keyed on (device, inode) and are only valid while the file's size
+and mtime match the ones recorded with the hash, so modifying, replacing or
+truncating a file invalidates its entry. The cache holds at most max_entries
+entries; when it grows past that, the least recently used entries are evicted.
+
+Only regular files are cached: hashing a symlink only requires a readlink.
+'''
+import os
+import sqlite3
+import stat
+import threading
+import time
+
+
+class HashCache(object):
+    # Fraction of max_entries that is evicted at once when the cache is full,
+    # so that we don't run an eviction query on every insert.
+    EVICTION_FRACTION = 0.1
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # The server is multithreaded, so the connection is shared between
+        # threads and serialized by self.lock.
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+              'CREATE TABLE IF NOT EXISTS file_hash ('
+              '  device INTEGER NOT NULL,'
+              '  inode INTEGER NOT NULL,'
+              '  size INTEGER NOT NULL,'
+              '  mtime REAL NOT NULL,'
+              '  hash TEXT NOT NULL,'
+              '  last_used REAL NOT NULL,'
+              '  PRIMARY KEY (device, inode)'
+              ')'
+            )
+            self.connection.execute(
+              'CREATE INDEX IF NOT EXISTS file_hash_last_used_index ON file_hash (last_used)'
+            )
+
+    @staticmethod
+    def get_key(path):
+        '''
+        Return the (device, inode, size, mtime) key of the file at the given path,
+        or None if it is not a regular file.
+        '''
+        try:
+            file_stat = os.lstat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        return (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime)
+
+    def lookup(self, keys):
+        '''
+        Return a dict mapping each of the given keys that has a valid cached hash
+        to that hash, and mark those entries as recently used.
+        '''
+        result = {}
+        with self.lock, self.connection:
+            for key in keys:
+                row = self.connection.execute(
+                  'SELECT size, mtime, hash FROM file_hash WHERE device = ? AND inode = ?',
+                  key[:2],
+                ).fetchone()
+                if row is None:
+                    continue
+                if (row[0], row[1]) != key[2:]:
+                    # The file was changed since it was hashed.
+                    self.connection.execute(
+                      'DELETE FROM file_hash WHERE device = ? AND inode = ?', key[:2]
+                    )
+                    continue
+                result[key] = str(row[2])
+            now = time.time()
+            self.connection.executemany(
+              'UPDATE file_hash SET last_used = ? WHERE device = ? AND inode = ?',
+              [(now,) + key[:2] for key in result],
+            )
+        return result
+
+    def store(self, items):
+        '''
+        Record the given (key, hash) pairs, replacing any existing entries for the
+        same files, and evict old entries if the cache is over capacity.
+        '''
+        if not items:
+            return
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+              'INSERT OR REPLACE INTO file_hash VALUES (?, ?, ?, ?, ?, ?)',
+              [key + (contents_hash, now) for (key, contents_hash) in items],
+            )
+            (num_entries,) = self.connection.execute('SELECT COUNT(*) FROM file_hash').fetchone()
+            if num_entries > self.max_entries:
+                num_evicted = num_entries - self.max_entries + int(self.max_entries * self.EVICTION_FRACTION)
+                self.connection.execute(
+                  'DELETE FROM file_hash WHERE rowid IN '
+                  '(SELECT rowid FROM file_hash ORDER BY last_used LIMIT ?)',
+                  (num_evicted,),
+                )
+
+    def invalidate(self, paths):
+        '''
+        Remove the entries for the files at the given paths, if any.
+        '''
+        keys = filter(None, (self.get_key(path) for path in paths))
+        with self.lock, self.connection:
+            self.connection.executemany(
+              'DELETE FROM file_hash WHERE device = ? AND inode = ?',
+              [key[:2] for key in keys],
+            )
+
+    def clear(self):
+        '''
+        Remove all entries from the cache.
+        '''
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM file_hash')
@@ -9,19 +9,29 @@ There are a few classes of methods provided here:
     safe_join, get_relative_path, ls, recursive_ls
 
   Functions to read files to compute hashes, write results to stdout, etc:
-    cat, getmtime, get_size, hash_directory, hash_file_contents
+    cat, getmtime, get_size, hash_directory, hash_files_contents,
+    hash_file_contents, summarize
 
   Functions that modify that filesystem in controlled ways:
-    copy, make_directory, remove, remove_symlinks, set_permissions
+    copy, materialize, make_directory, remove, remove_materialized, remove_symlinks,
+    set_permissions
 '''
 import contextlib
+import ctypes
+import ctypes.util
 import errno
+import fcntl
+import fnmatch
 import hashlib
 import itertools
+import mmap
+import multiprocessing
 import os
 import shutil
+import stat
 import subprocess
 import sys
+from multiprocessing.pool import ThreadPool
 
 from codalab.common import (
   precondition,
@@ -29,11 +39,34 @@ from codalab.common import (
 )
 from codalab.lib import file_util
 
+# scandir gets the type of each directory entry without a stat call. It is in
+# the standard library from Python 3.5 on, and in the scandir package before.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 # Block sizes and canonical strings used when hashing files.
 BLOCK_SIZE = 0x40000
 FILE_PREFIX = 'file'
 LINK_PREFIX = 'link'
+# Files at least MMAP_THRESHOLD bytes long are hashed through a read-only
+# memory map in chunks of MMAP_BLOCK_SIZE, which avoids a read syscall and a
+# buffer copy per block.
+MMAP_THRESHOLD = 0x4000000
+MMAP_BLOCK_SIZE = 0x1000000
+
+# Number of threads used to copy files, and the size of each kernel copy call.
+COPY_WORKERS = 4
+COPY_BLOCK_SIZE = 0x10000000
+
+# Ways in which materialize can make a file or directory available elsewhere.
+MATERIALIZE_MODES = ('copy', 'hardlink', 'reflink', 'symlink')
+# The Linux ioctl that clones a file's extents into another file (copy-on-write).
+FICLONE = 0x40049409
 
 
 class TargetPath(unicode):
@@ -270,96 +303,502 @@ def get_info(path, depth):
         result['perm'] = os.stat(path).st_mode & 0777
     return result
 
-def hash_directory(path, dirs_and_files=None):
+def hash_directory(path, dirs_and_files=None, num_workers=1, use_processes=False, hash_cache=None):
     '''
     Return the hash of the contents of the folder at the given path.
     This hash is independent of the path itself - if you were to move the
     directory and call get_hash again, you would get the same result.
+
+    File contents are hashed by hash_files_contents, in parallel if num_workers
+    is greater than 1 and through hash_cache if it is given. The result does not
+    depend on either.
     '''
     (directories, files) = dirs_and_files or recursive_ls(path)
+    sorted_files = sorted(files)
+    contents_hashes = hash_files_contents(sorted_files, num_workers, use_processes, hash_cache)
+    return _combine_hashes(path, sorted(directories), sorted_files, contents_hashes)
+
+
+def _combine_hashes(path, sorted_directories, sorted_files, contents_hashes):
     # Sort and then hash all directories and then compute a hash of the hashes.
     # This two-level hash is necessary so that the overall hash is unambiguous -
     # if we updated directory_hash with the directory names themselves, then
     # we'd be hashing the concatenation of these names, which could be generated
     # in multiple ways.
     directory_hash = hashlib.sha1()
-    for directory in sorted(directories):
+    for directory in sorted_directories:
         relative_path = get_relative_path(path, directory)
         directory_hash.update(hashlib.sha1(relative_path).hexdigest())
     # Use a similar two-level hashing scheme for all files, but incorporate a
     # hash of both the file name and contents.
     file_hash = hashlib.sha1()
-    for file_name in sorted(files):
+    for (file_name, contents_hash) in zip(sorted_files, contents_hashes):
         relative_path = get_relative_path(path, file_name)
         file_hash.update(hashlib.sha1(relative_path).hexdigest())
-        file_hash.update(hash_file_contents(file_name))
+        file_hash.update(contents_hash)
     # Return a hash of the two hashes.
     overall_hash = hashlib.sha1(directory_hash.hexdigest())
     overall_hash.update(file_hash.hexdigest())
     return overall_hash.hexdigest()
 
 
-def hash_file_contents(path):
+def _scan_directory(path):
+    '''
+    Yield a (name, is_directory, lstat result) triple for each entry of the
+    directory at the given path. Symlinks to directories are not directories.
+    '''
+    if scandir is not None:
+        for entry in scandir(path):
+            yield (entry.name, entry.is_dir(follow_symlinks=False), entry.stat(follow_symlinks=False))
+    else:
+        for file_name in os.listdir(path):
+            file_stat = os.lstat(os.path.join(path, file_name))
+            yield (file_name, stat.S_ISDIR(file_stat.st_mode), file_stat)
+
+
+def summarize(path, num_workers=1, use_processes=False, hash_cache=None, known_hashes=None):
+    '''
+    Walk the file or directory at the given path once, stat-ing each entry
+    once, and then hash each file once. Return a dict with the keys:
+      directories, files: as returned by recursive_ls, sorted
+      contents_hashes: the hash_file_contents of each file, in the same order
+      hash: hash_directory(path)
+      size: get_size(path)
+      file_count, directory_count: the lengths of files and directories
+      largest_file_size: the size of the largest regular file (0 if none)
+    The hashing options are as for hash_directory. known_hashes optionally maps
+    files to their hash_file_contents, computed as they were written: these
+    files are not read (and their hashes are added to hash_cache).
+    '''
+    root_stat = os.lstat(path)
+    (directories, files) = ([], [])
+    size = root_stat.st_size
+    largest_file_size = 0
+    if stat.S_ISDIR(root_stat.st_mode):
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            directories.append(directory)
+            for (file_name, is_directory, file_stat) in _scan_directory(directory):
+                full_path = os.path.join(directory, file_name)
+                size += file_stat.st_size
+                if is_directory:
+                    pending.append(full_path)
+                else:
+                    files.append(full_path)
+                    if stat.S_ISREG(file_stat.st_mode):
+                        largest_file_size = max(largest_file_size, file_stat.st_size)
+    else:
+        files.append(path)
+        if stat.S_ISREG(root_stat.st_mode):
+            largest_file_size = root_stat.st_size
+    directories.sort()
+    files.sort()
+    if known_hashes:
+        unknown_files = [file_name for file_name in files if file_name not in known_hashes]
+        all_hashes = dict(zip(unknown_files, hash_files_contents(unknown_files, num_workers, use_processes, hash_cache)))
+        all_hashes.update(known_hashes)
+        contents_hashes = [all_hashes[file_name] for file_name in files]
+        if hash_cache is not None:
+            items = [(hash_cache.get_key(file_name), known_hashes[file_name]) for file_name in files if file_name in known_hashes]
+            hash_cache.store([(key, contents_hash) for (key, contents_hash) in items if key is not None])
+    else:
+        contents_hashes = hash_files_contents(files, num_workers, use_processes, hash_cache)
+    return {
+      'directories': directories,
+      'files': files,
+      'contents_hashes': contents_hashes,
+      'hash': _combine_hashes(path, directories, files, contents_hashes),
+      'size': size,
+      'file_count': len(files),
+      'directory_count': len(directories),
+      'largest_file_size': largest_file_size,
+    }
+
+
+def hash_files_contents(paths, num_workers=1, use_processes=False, hash_cache=None):
+    '''
+    Return the list of hash_file_contents(path) for each of the given paths.
+    If num_workers > 1, the files are hashed concurrently by a pool of that many
+    threads, or processes if use_processes is set. Threads are enough when
+    hashing is bound by disk reads (hashlib releases the GIL on large updates);
+    processes help when it is bound by CPU.
+
+    If a HashCache is given, files with a valid cached hash are not read, and
+    the hashes of the other files are added to the cache.
+    '''
+    if hash_cache is None:
+        return _hash_files_contents(paths, num_workers, use_processes)
+    keys = [hash_cache.get_key(path) for path in paths]
+    cached_hashes = hash_cache.lookup(filter(None, keys))
+    missing_indices = [i for (i, key) in enumerate(keys) if key not in cached_hashes]
+    missing_hashes = _hash_files_contents([paths[i] for i in missing_indices], num_workers, use_processes)
+    result = [cached_hashes.get(key) for key in keys]
+    new_items = []
+    for (i, contents_hash) in zip(missing_indices, missing_hashes):
+        result[i] = contents_hash
+        # Only cache the hash if the file did not change while we were reading it.
+        if keys[i] is not None and hash_cache.get_key(paths[i]) == keys[i]:
+            new_items.append((keys[i], contents_hash))
+    hash_cache.store(new_items)
+    return result
+
+
+def _hash_files_contents(paths, num_workers, use_processes):
+    num_workers = min(num_workers, len(paths))
+    if num_workers <= 1:
+        return [hash_file_contents(path) for path in paths]
+    pool = (multiprocessing.Pool if use_processes else ThreadPool)(num_workers)
+    try:
+        # Hand out small batches so that a few large files do not leave the
+        # other workers idle at the end.
+        chunk_size = max(1, len(paths) / (num_workers * 16))
+        return pool.map(hash_file_contents, paths, chunk_size)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def hash_file_contents(path, hash_cache=None):
     '''
-    Return the hash of the file's contents, read in blocks of size BLOCK_SIZE.
+    Return the hash of the file's contents, read in blocks of size BLOCK_SIZE,
+    or through a memory map for files of at least MMAP_THRESHOLD bytes.
+    If a HashCache is given, it is consulted first.
     '''
     message = 'hash_file called with relative path: %s' % (path,)
     precondition(os.path.isabs(path), message)
-    contents_hash = hashlib.sha1()
+    if hash_cache is not None:
+        return hash_files_contents([path], hash_cache=hash_cache)[0]
     if os.path.islink(path):
-        contents_hash = hashlib.sha1(LINK_PREFIX)
-        contents_hash.update(os.readlink(path))
+        return hash_link_contents(os.readlink(path))
     else:
-        contents_hash = hashlib.sha1(FILE_PREFIX)
+        contents_hash = new_contents_hash()
         with open(path, 'rb') as file_handle:
-            while True:
-                data = file_handle.read(BLOCK_SIZE)
-                if not data:
-                    break
-                contents_hash.update(data)
+            size = os.fstat(file_handle.fileno()).st_size
+            if size >= MMAP_THRESHOLD:
+                contents = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for offset in xrange(0, len(contents), MMAP_BLOCK_SIZE):
+                        contents_hash.update(buffer(contents, offset, MMAP_BLOCK_SIZE))
+                finally:
+                    contents.close()
+            else:
+                while True:
+                    data = file_handle.read(BLOCK_SIZE)
+                    if not data:
+                        break
+                    contents_hash.update(data)
     return contents_hash.hexdigest()
 
 
+def new_contents_hash():
+    '''
+    Return a hash object which gives the hash_file_contents of a regular file
+    once it is updated with the file's contents, for hashing files as they are
+    written.
+    '''
+    return hashlib.sha1(FILE_PREFIX)
+
+
+def hash_link_contents(link_target):
+    '''
+    Return the hash_file_contents of a symlink to the given target.
+    '''
+    return hashlib.sha1(LINK_PREFIX + link_target).hexdigest()
+
+
 ################################################################################
 # Functions that modify that filesystem in controlled ways.
 ################################################################################
 
-def copy(source_path, dest_path, follow_symlinks=False, exclude_patterns=[]):
+def copy(source_path, dest_path, follow_symlinks=False, exclude_patterns=None, num_workers=COPY_WORKERS):
     '''
     source_path can be a list of files, in which case we need to create a
     directory first.  Assume dest_path doesn't exist.
     Don't copy things that match |exclude_patterns|.
+
+    Like rsync -pr, this copies permissions but not times, and skips devices,
+    sockets and pipes. Symlinks are copied as symlinks, unless follow_symlinks
+    is set, in which case their targets are copied. Exclude patterns are globs
+    that match a file name, or a relative path if they contain a '/' (anchored
+    at the top if they start with one); a trailing '/' only matches directories.
+    Regular files are copied by num_workers threads, in the kernel if possible.
+
+    Returns a dict with the number of files (including symlinks) and bytes copied.
     '''
-    # Note: this only works in Linux.
     if os.path.exists(dest_path):
         raise path_error('already exists', dest_path)
 
-    if isinstance(source_path, list):
-        os.mkdir(dest_path)
-        source = ' '.join(source_path)
-    else:
-        source = source_path
-
     if source_path == '/dev/stdin':
         with open(dest_path, 'wb') as dest:
-            file_util.copy(sys.stdin, dest, autoflush=False, print_status='Copying %s to %s' % (source_path, dest_path))
+            num_bytes = file_util.copy(sys.stdin, dest, autoflush=False, print_status='Copying %s to %s' % (source_path, dest_path))
+        return {'num_files': 1, 'num_bytes': num_bytes}
+
+    try:
+        if isinstance(source_path, list):
+            os.mkdir(dest_path)
+        (directories, files, links) = plan_copy(source_path, dest_path, follow_symlinks, exclude_patterns)
+
+        # Directories are listed parents first. Create them writable, and only set
+        # their permissions once their contents have been copied.
+        for (directory, _) in directories:
+            os.mkdir(directory, 0700)
+        files = [(source, dest, file_stat.st_mode) for (source, dest, file_stat) in files]
+        num_workers = min(num_workers, len(files))
+        if num_workers > 1:
+            pool = ThreadPool(num_workers)
+            try:
+                file_sizes = pool.map(_copy_file_star, files, 1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            file_sizes = [_copy_file(*args) for args in files]
+        for (link_target, link_path) in links:
+            os.symlink(link_target, link_path)
+        for (directory, directory_stat) in reversed(directories):
+            os.chmod(directory, stat.S_IMODE(directory_stat.st_mode))
+    except (IOError, OSError), e:
+        raise path_error('Unable to copy %s (%s) to' % (source_path, e), dest_path)
+    return {'num_files': len(files) + len(links), 'num_bytes': sum(file_sizes)}
+
+
+def _parse_exclude_pattern(pattern):
+    directory_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    anchored = pattern.startswith('/')
+    return (pattern.lstrip('/'), '/' in pattern, anchored, directory_only)
+
+
+def _is_excluded(relative_path, is_directory, exclude_patterns):
+    for (pattern, match_path, anchored, directory_only) in exclude_patterns:
+        if directory_only and not is_directory:
+            continue
+        if not match_path:
+            if fnmatch.fnmatchcase(os.path.basename(relative_path), pattern):
+                return True
+            continue
+        if anchored:
+            candidates = [relative_path]
+        else:
+            # Match the pattern against every trailing part of the path.
+            parts = relative_path.split(os.sep)
+            candidates = [os.sep.join(parts[i:]) for i in range(len(parts))]
+        if any(fnmatch.fnmatchcase(candidate, pattern) for candidate in candidates):
+            return True
+    return False
+
+
+def plan_copy(source_path, dest_path, follow_symlinks=False, exclude_patterns=None):
+    '''
+    Return the (directories, files, links) that copy would create when copying
+    source_path to dest_path, without touching dest_path: lists of (dest
+    directory, stat), (source file, dest file, stat) and (link target, dest
+    link) tuples, in a deterministic order with parent directories first.
+    If source_path is a list, dest_path itself is not included.
+    '''
+    exclude_patterns = [_parse_exclude_pattern(pattern) for pattern in exclude_patterns or []]
+    (directories, files, links) = ([], [], [])
+    if isinstance(source_path, list):
+        for path in source_path:
+            name = os.path.basename(path)
+            _plan_copy(path, os.path.join(dest_path, name), name, follow_symlinks,
+                       exclude_patterns, directories, files, links)
     else:
-        #command = "cp -pR%s %s %s" % (('L' if follow_symlinks else 'P'), source, dest_path)
-        command = "rsync -pr%s %s%s %s" % (('L' if follow_symlinks else 'l'), source, '/' if os.path.isdir(source) else '', dest_path)
-        if exclude_patterns:
-            for pattern in exclude_patterns:
-                command += ' --exclude "' + pattern + '"'
-        #print command
-        if os.system(command) != 0:
-            raise path_error('Unable to copy %s to' % source_path, dest_path)
-
-    #if os.path.islink(source_path):
-    #    link_target = os.readlink(source_path)
-    #    os.symlink(link_target, dest_path)
-    #elif os.path.isdir(source_path):
-    #    shutil.copytree(source_path, dest_path, symlinks=True)
-    #else:
-    #    shutil.copyfile(source_path, dest_path)
+        _plan_copy(source_path, dest_path, '', follow_symlinks,
+                   exclude_patterns, directories, files, links)
+    return (directories, files, links)
+
+
+def _plan_copy(source_path, dest_path, relative_path, follow_symlinks,
+               exclude_patterns, directories, files, links):
+    '''
+    Walk source_path and append the tuples described in plan_copy to the given
+    lists.
+    '''
+    stack = [(source_path, dest_path, relative_path, ())]
+    while stack:
+        (source, dest, relative, ancestors) = stack.pop()
+        if os.path.islink(source) and not follow_symlinks:
+            if not (relative and _is_excluded(relative, False, exclude_patterns)):
+                links.append((os.readlink(source), dest))
+            continue
+        try:
+            source_stat = os.stat(source) if follow_symlinks else os.lstat(source)
+        except OSError, e:
+            raise path_error('Unable to copy broken symlink %s to' % (source,), dest)
+        is_directory = stat.S_ISDIR(source_stat.st_mode)
+        if relative and _is_excluded(relative, is_directory, exclude_patterns):
+            continue
+        if is_directory:
+            # Don't loop forever on symlinks to ancestors when following them.
+            key = (source_stat.st_dev, source_stat.st_ino)
+            if key in ancestors:
+                continue
+            directories.append((dest, source_stat))
+            for name in sorted(os.listdir(source), reverse=True):
+                stack.append((
+                  os.path.join(source, name),
+                  os.path.join(dest, name),
+                  os.path.join(relative, name),
+                  ancestors + (key,),
+                ))
+        elif stat.S_ISREG(source_stat.st_mode):
+            files.append((source, dest, source_stat))
+
+
+def _copy_file_star(args):
+    return _copy_file(*args)
+
+
+def _copy_file(source_path, dest_path, mode):
+    '''
+    Copy the contents and permissions of a regular file.
+    Returns the number of bytes copied.
+    '''
+    with open(source_path, 'rb') as source:
+        dest_fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        try:
+            num_bytes = _copy_file_contents(source.fileno(), dest_fd)
+            os.fchmod(dest_fd, stat.S_IMODE(mode))
+        finally:
+            os.close(dest_fd)
+    return num_bytes
+
+
+# Python 2 has neither os.sendfile nor os.copy_file_range, so call them through
+# libc if it has them. Both copy data without moving it through user space, and
+# copy_file_range can also share extents or copy on the server side.
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+    _libc = None
+_KERNEL_COPIES = []
+if hasattr(_libc, 'copy_file_range'):
+    _libc.copy_file_range.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint)
+    _libc.copy_file_range.restype = ctypes.c_ssize_t
+    _KERNEL_COPIES.append(lambda source_fd, dest_fd, count: _libc.copy_file_range(source_fd, None, dest_fd, None, count, 0))
+if hasattr(_libc, 'sendfile'):
+    _libc.sendfile.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t)
+    _libc.sendfile.restype = ctypes.c_ssize_t
+    _KERNEL_COPIES.append(lambda source_fd, dest_fd, count: _libc.sendfile(dest_fd, source_fd, None, count))
+
+
+def _copy_file_contents(source_fd, dest_fd):
+    '''
+    Copy the rest of source_fd to dest_fd, with copy_file_range or sendfile if
+    they work for these files, and with reads and writes otherwise.
+    Returns the number of bytes copied.
+    '''
+    for kernel_copy in _KERNEL_COPIES:
+        num_copied = 0
+        while True:
+            result = kernel_copy(source_fd, dest_fd, COPY_BLOCK_SIZE)
+            if result > 0:
+                num_copied += result
+                continue
+            if result == 0:
+                return num_copied
+            error = ctypes.get_errno()
+            if error == errno.EINTR:
+                continue
+            if num_copied == 0 and error in (errno.ENOSYS, errno.EINVAL, errno.EXDEV,
+                                             errno.EOPNOTSUPP, errno.EBADF, errno.EPERM):
+                break
+            raise OSError(error, os.strerror(error))
+    num_copied = 0
+    while True:
+        data = os.read(source_fd, file_util.BUFFER_SIZE)
+        if not data:
+            return num_copied
+        num_copied += len(data)
+        while data:
+            data = data[os.write(dest_fd, data):]
+
+
+def materialize(source_path, dest_path, mode):
+    '''
+    Make the file or directory at source_path available at dest_path, which must
+    not exist, without following symlinks. mode is one of MATERIALIZE_MODES:
+      copy: copy everything (see copy).
+      hardlink: hardlink regular files, which are then shared with source_path.
+      reflink: clone regular files copy-on-write, on filesystems that support it.
+      symlink: symlink regular files to their absolute paths under source_path.
+    Except in copy mode, directories are recreated and symlinks are copied, and
+    regular files that cannot be linked (e.g. across devices) are copied.
+    With hardlink and symlink, the files under dest_path are the files under
+    source_path, so their write permissions are removed first (the data in the
+    bundle store is immutable), and files that can't be made read-only are
+    copied.
+    '''
+    precondition(mode in MATERIALIZE_MODES, 'Unexpected materialize mode: %s' % (mode,))
+    if mode == 'copy':
+        copy(source_path, dest_path, follow_symlinks=False)
+        return
+    if os.path.lexists(dest_path):
+        raise path_error('already exists', dest_path)
+    if os.path.islink(source_path) or not os.path.isdir(source_path):
+        _materialize_file(source_path, dest_path, mode)
+        return
+    (directories, files) = recursive_ls(source_path)
+    directories.sort()
+    for directory in directories:
+        os.mkdir(dest_path + get_relative_path(source_path, directory))
+    for file_path in files:
+        _materialize_file(file_path, dest_path + get_relative_path(source_path, file_path), mode)
+    # Set directory permissions last, in case they are not writable.
+    for directory in reversed(directories):
+        shutil.copymode(directory, dest_path + get_relative_path(source_path, directory))
+
+
+def _materialize_file(source_path, dest_path, mode):
+    if os.path.islink(source_path):
+        os.symlink(os.readlink(source_path), dest_path)
+        return
+    if not stat.S_ISREG(os.lstat(source_path).st_mode):
+        # Like copy, skip devices, sockets and pipes.
+        return
+    try:
+        if mode in ('hardlink', 'symlink'):
+            _remove_write_permissions(source_path)
+        if mode == 'hardlink':
+            os.link(source_path, dest_path)
+        elif mode == 'symlink':
+            os.symlink(source_path, dest_path)
+        else:
+            with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+                fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+            shutil.copymode(source_path, dest_path)
+        return
+    except (IOError, OSError), e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EINVAL,
+                           errno.ENOTTY, errno.EOPNOTSUPP):
+            raise
+    # Fall back to copying the file.
+    _copy_file(source_path, dest_path, os.lstat(source_path).st_mode)
+
+
+def _remove_write_permissions(path):
+    mode = stat.S_IMODE(os.lstat(path).st_mode)
+    if mode & 0222:
+        os.chmod(path, mode & ~0222)
+
+
+def remove_materialized(path):
+    '''
+    Remove the file or directory at path made by materialize. Unlike remove,
+    this doesn't give the files write permissions, since they can be shared
+    with the source: only the directories, which materialize creates, are
+    made writable.
+    '''
+    if os.path.islink(path) or not os.path.isdir(path):
+        os.unlink(path)
+        return
+    os.chmod(path, stat.S_IMODE(os.lstat(path).st_mode) | stat.S_IRWXU)
+    for file_name in os.listdir(path):
+        remove_materialized(os.path.join(path, file_name))
+    os.rmdir(path)
+
 
 def make_directory(path):
     '''
@@ -0,0 +1,213 @@
+'''
+Resource usage of running bundles.
+
+The machines sample the CPU time, memory and disk I/O of each running bundle
+every few seconds: LocalMachine reads /proc, and RemoteMachine reads the cgroup
+files that the docker wrapper copies to <temp_dir>.status. The samples go into
+a ResourceSeries, which keeps at most max_samples points. When it is full,
+neighbouring points are merged pairwise (keeping the largest memory), so the
+spacing between points doubles and the series stays small enough to be saved
+with the bundle, in the resource_usage metadata. The peak memory is saved as
+memory_max.
+'''
+import json
+import os
+import threading
+import time
+
+# Fields of a sample. Times and disk I/O are cumulative, memory is the current
+# usage.
+FIELDS = ('time_user', 'time_system', 'memory', 'disk_read', 'disk_write')
+
+
+class ResourceSeries(object):
+    def __init__(self, start_time=None, interval=5, max_samples=64):
+        self.start_time = time.time() if start_time is None else start_time
+        self.interval = interval
+        self.max_samples = max_samples
+        # List of [seconds since start_time, CPU seconds, memory, disk_read, disk_write].
+        # A point holds the counters at the end of its interval, and the largest
+        # memory within it.
+        self.points = []
+        # Last value of each field.
+        self.latest = {}
+        self.memory_max = 0
+        self.lock = threading.Lock()
+
+    def add(self, sample, now=None):
+        '''
+        Add a sample, which is a dict with some of FIELDS, and optionally
+        memory_max (the peak memory so far, when the source knows it).
+        A sample that comes less than interval seconds after the previous point
+        is merged into it.
+        '''
+        if now is None: now = time.time()
+        with self.lock:
+            for field in FIELDS:
+                if sample.get(field) is not None:
+                    self.latest[field] = sample[field]
+            self.memory_max = max(self.memory_max, sample.get('memory_max') or 0, sample.get('memory') or 0)
+            point = [
+                round(now - self.start_time, 1),
+                round(self.latest.get('time_user', 0) + self.latest.get('time_system', 0), 2),
+                int(sample.get('memory') or 0),
+                int(self.latest.get('disk_read', 0)),
+                int(self.latest.get('disk_write', 0)),
+            ]
+            if self.points and point[0] - self.points[-1][0] < self.interval:
+                point[2] = max(point[2], self.points[-1][2])
+                point[0] = self.points[-1][0]
+                self.points[-1] = point
+                return
+            self.points.append(point)
+            if len(self.points) > self.max_samples:
+                self._downsample()
+
+    def _downsample(self):
+        points = []
+        for i in range(0, len(self.points) - 1, 2):
+            (first, second) = self.points[i:i + 2]
+            points.append(second[:2] + [max(first[2], second[2])] + second[3:])
+        if len(self.points) % 2 == 1:
+            points.append(self.points[-1])
+        self.points = points
+        self.interval *= 2
+
+    def get_usage(self):
+        '''
+        Return the bundle metadata with the resource usage: the last value of
+        each field, memory_max and the series (resource_usage), if there are any
+        samples.
+        '''
+        with self.lock:
+            usage = dict(self.latest)
+            if self.memory_max:
+                usage['memory_max'] = self.memory_max
+            if self.points:
+                usage['resource_usage'] = json.dumps({
+                    'start_time': self.start_time,
+                    'interval': self.interval,
+                    'points': self.points,
+                    'latest': self.latest,
+                }, separators=(',', ':'))
+            return usage
+
+    @classmethod
+    def from_string(cls, value, max_samples=64):
+        '''
+        Load a series saved in the resource_usage metadata, so that sampling can
+        continue where it stopped (e.g., when the worker restarts).
+        '''
+        info = json.loads(value)
+        series = cls(info['start_time'], info['interval'], max_samples)
+        series.points = info['points']
+        series.latest = info['latest']
+        if series.points:
+            series.memory_max = max(point[2] for point in series.points)
+        return series
+
+
+def sample_processes(pids):
+    '''
+    Return {pid: sample} with the usage of each of the given processes and all
+    of their descendants, read from /proc (empty if there is no /proc).
+    The memory is the sum of the resident set sizes of the processes, so pages
+    shared between them are counted more than once.
+    '''
+    try:
+        names = os.listdir('/proc')
+    except OSError:
+        return {}
+    clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    children = {}
+    stats = {}
+    for name in names:
+        if not name.isdigit(): continue
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                data = f.read()
+        except IOError:
+            continue  # Exited in the meantime
+        # Skip the command name, which is in parentheses and can contain spaces.
+        fields = data[data.rindex(')') + 2:].split()
+        pid = int(name)
+        children.setdefault(int(fields[1]), []).append(pid)
+        # Include the time of the children that have been waited for.
+        stats[pid] = {
+            'time_user': (int(fields[11]) + int(fields[13])) / clock_ticks,
+            'time_system': (int(fields[12]) + int(fields[14])) / clock_ticks,
+            'memory': int(fields[21]) * page_size,
+        }
+
+    samples = {}
+    for root in pids:
+        if root not in stats: continue
+        sample = dict((field, 0) for field in FIELDS)
+        pending = [root]
+        while pending:
+            pid = pending.pop()
+            pending.extend(children.get(pid, []))
+            for (field, value) in stats.get(pid, {}).iteritems():
+                sample[field] += value
+            try:
+                with open('/proc/%d/io' % pid) as f:
+                    for line in f:
+                        (key, value) = line.split(':')
+                        if key == 'read_bytes':
+                            sample['disk_read'] += int(value)
+                        elif key == 'write_bytes':
+                            sample['disk_write'] += int(value)
+            except IOError:
+                pass
+        samples[root] = sample
+    return samples
+
+
+def sample_rusage(rusage):
+    '''
+    Return the sample given by the resource usage of a process that has been
+    waited for (see os.wait4), which includes the descendants it waited for.
+    '''
+    return {
+        'time_user': rusage.ru_utime,
+        'time_system': rusage.ru_stime,
+        'memory_max': rusage.ru_maxrss * 1024,  # Linux reports kilobytes
+    }
+
+
+def sample_cgroup(status_dir):
+    '''
+    Return the sample given by the cgroup files in status_dir, which are copied
+    from the cgroup of the docker container (see RemoteMachine.start_bundle).
+    '''
+    sample = {}
+    try:
+        for line in open(os.path.join(status_dir, 'cpuacct.stat')):
+            key, value = line.split(" ")
+            # NOTE: there is a bug in /cgroup where the first values are garbage (way too high).
+            # Convert jiffies to seconds
+            if key == 'user':
+                sample['time_user'] = int(value) / 100.0
+            elif key == 'system':
+                sample['time_system'] = int(value) / 100.0
+    except:
+        pass
+    try:
+        sample['memory'] = int(open(os.path.join(status_dir, 'memory.usage_in_bytes')).read())
+    except:
+        pass
+    try:
+        sample['memory_max'] = int(open(os.path.join(status_dir, 'memory.max_usage_in_bytes')).read())
+    except:
+        pass
+    try:
+        for line in open(os.path.join(status_dir, 'blkio.throttle.io_service_bytes')):
+            _, key, value = line.split(" ")
+            if key == 'Read':
+                sample['disk_read'] = int(value)
+            elif key == 'Write':
+                sample['disk_write'] = int(value)
+    except:
+        pass
+    return sample
@@ -0,0 +1,95 @@
+'''
+Scheduling policies decide the order in which the worker offers STAGED bundles
+to its machine (see Worker.update_staged_bundles).
+
+FifoPolicy offers bundles in the order they were created.
+
+FairSharePolicy offers bundles by decreasing score, where the score of a bundle
+is:
+  request_priority
+  + (seconds since the bundle was staged) / aging_interval
+  - fair_share_weight * (number of bundles of the same owner that are running,
+                         or that are ahead in the queue)
+so that a user with many bundles doesn't starve the others, and bundles that
+have waited long enough eventually overtake higher priority ones.
+
+The policy is chosen in the worker config:
+  "scheduling": {"policy": "fair_share", "aging_interval": 600, "fair_share_weight": 1}
+'''
+import heapq
+
+from codalab.common import UsageError
+
+
+class SchedulingPolicy(object):
+    def order(self, bundles, running_counts, wait_times):
+        '''
+        bundles: the STAGED bundles.
+        running_counts: {owner_id: number of bundles running}
+        wait_times: {uuid: seconds since the bundle was staged}
+        Return a list of (bundle, score) in the order they should be started.
+        '''
+        raise NotImplementedError
+
+
+class FifoPolicy(SchedulingPolicy):
+    def order(self, bundles, running_counts, wait_times):
+        return [(bundle, None) for bundle in sorted(bundles, key=lambda bundle: bundle.id)]
+
+
+class FairSharePolicy(SchedulingPolicy):
+    def __init__(self, aging_interval=600, fair_share_weight=1):
+        self.aging_interval = aging_interval
+        self.fair_share_weight = fair_share_weight
+
+    def get_priority(self, bundle, wait_time):
+        '''
+        Return the priority of the bundle, including aging.
+        '''
+        priority = getattr(bundle.metadata, 'request_priority', None) or 0
+        if self.aging_interval:
+            priority += float(wait_time) / self.aging_interval
+        return priority
+
+    def order(self, bundles, running_counts, wait_times):
+        # Order the bundles of each owner by priority. The share of an owner is the
+        # same for all of their bundles, so only the first one in each queue can
+        # be next.
+        queues = {}
+        for bundle in bundles:
+            priority = self.get_priority(bundle, wait_times.get(bundle.uuid, 0))
+            queues.setdefault(bundle.owner_id, []).append((-priority, bundle.id, bundle))
+        for queue in queues.itervalues():
+            # The first bundle is at the end, so that it can be popped cheaply.
+            queue.sort(reverse=True)
+        loads = dict((owner_id, running_counts.get(owner_id, 0)) for owner_id in queues)
+        # Heap of (-score, id, owner_id), with the first bundle of each queue.
+        heads = []
+        def push(owner_id):
+            (negative_priority, bundle_id, _) = queues[owner_id][-1]
+            heapq.heappush(heads, (negative_priority + self.fair_share_weight * loads[owner_id], bundle_id, owner_id))
+        for owner_id in queues:
+            push(owner_id)
+        result = []
+        while heads:
+            (negative_score, _, owner_id) = heapq.heappop(heads)
+            (_, _, bundle) = queues[owner_id].pop()
+            result.append((bundle, -negative_score))
+            loads[owner_id] += 1
+            if queues[owner_id]:
+                push(owner_id)
+        return result
+
+
+def get_scheduling_policy(config):
+    '''
+    Return the scheduling policy given by the scheduling entry of the worker
+    config (default fair_share).
+    '''
+    config = dict(config.get('scheduling', {}))
+    policy = config.pop('policy', 'fair_share')
+    if policy == 'fifo':
+        return FifoPolicy()
+    elif policy == 'fair_share':
+        return FairSharePolicy(**config)
+    raise UsageError('Unexpected scheduling policy: %s, expected fifo or fair_share' % (policy,))
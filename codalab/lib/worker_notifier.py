@@ -0,0 +1,86 @@
+'''
+WorkerNotifier wakes up the worker (see Worker.run_loop) when something it
+should act on happens, so that it doesn't have to poll the database
+frequently. The worker listens on a unix datagram socket under the CodaLab
+home directory, and other processes (such as the server, after a bundle is
+created or killed) send it empty datagrams.
+
+Notifications are best effort: notify never fails or blocks, even when no
+worker is listening, so the worker still polls as a fallback.
+'''
+import errno
+import os
+import select
+import socket
+import sys
+
+
+class WorkerNotifier(object):
+    def __init__(self, path):
+        self.path = path
+        self.socket = None
+
+    def notify(self):
+        '''
+        Wake up the worker, if one is listening.
+        '''
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sender.setblocking(False)
+            sender.sendto('', self.path)
+            return True
+        except socket.error:
+            # Typically, no worker is listening (ENOENT or ECONNREFUSED) or the
+            # worker already has pending notifications (EAGAIN).
+            return False
+        finally:
+            sender.close()
+
+    def listen(self):
+        '''
+        Start receiving notifications. Return False if that is not possible (for
+        example, because another worker is already listening).
+        '''
+        if os.path.exists(self.path):
+            if self.notify():
+                return False
+            # Left over from a worker that exited.
+            os.remove(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.socket.bind(self.path)
+        except socket.error, e:
+            print >>sys.stderr, 'WorkerNotifier: unable to listen on %s: %s' % (self.path, e)
+            self.socket.close()
+            self.socket = None
+            return False
+        self.socket.setblocking(False)
+        return True
+
+    def wait(self, timeout):
+        '''
+        Wait until a notification is received or timeout seconds have passed,
+        and return whether a notification was received. Notifications that
+        arrived while the worker was busy are all consumed at once.
+        '''
+        try:
+            (readable, _, _) = select.select([self.socket], [], [], timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return False
+        if not readable:
+            return False
+        try:
+            while True:
+                self.socket.recv(1)
+        except socket.error, e:
+            if e.errno != errno.EAGAIN:
+                raise
+        return True
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+            os.remove(self.path)
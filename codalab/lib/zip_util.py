@@ -2,20 +2,28 @@
 zip_util provides helpers that:
   a) zip a directory on the local filesystem and return the zip file
   b) unzip a zip file and extract the zipped directory
+  c) stream a tar archive of a directory as it is generated
+  d) extract a tar archive as it is read
 
 The zip files here are not arbitrary: they contain one designated
 file/directory.  In other words, zip files represent unnamed file/directories.
 
-To zip/unzip, we use the standard temp files.
+To zip/unzip, we use the standard temp files. Tar archives are streamed, so
+they don't need any temp files.
 '''
+import errno
+import io
 import os
 import shutil
+import stat
 import sys
+import tarfile
 import tempfile
+import threading
 from zipfile import ZipFile
 
 from codalab.common import UsageError
-from codalab.lib import path_util, print_util
+from codalab.lib import file_util, path_util, print_util
 
 def zip(path, follow_symlinks, exclude_patterns, file_name):
     '''
@@ -87,3 +95,212 @@ def is_zip_file(path):
         return True
     except:
         return False
+
+
+def tar_stream(path, follow_symlinks, exclude_patterns, file_name):
+    '''
+    Take a path to a file or directory |path| (or a list of them, as for zip)
+    and return a file object from which a tar archive of its contents can be
+    read while it is being generated.  |file_name| is what the archive contains.
+    Entries are added in a deterministic order, so archiving the same data
+    twice gives the same bytes.
+    If the archive can't be completed (for example, because a file was removed
+    or truncated in the meantime), it is made invalid, so that untar fails, and
+    reading the end of the returned TarStream raises the error.
+    '''
+    if isinstance(path, list):
+        absolute_path = [path_util.normalize(p) for p in path]
+        for p in absolute_path:
+            path_util.check_isvalid(p, 'tar_stream')
+    else:
+        absolute_path = path_util.normalize(path)
+        path_util.check_isvalid(absolute_path, 'tar_stream')
+    # Walk the source before returning, so that errors are reported to the caller.
+    (directories, files, links) = path_util.plan_copy(absolute_path, file_name, follow_symlinks, exclude_patterns)
+    if isinstance(path, list):
+        directories.insert(0, (file_name, None))
+
+    (read_fd, write_fd) = os.pipe()
+    stream = TarStream(os.fdopen(read_fd, 'rb'))
+    def generate():
+        output = os.fdopen(write_fd, 'wb')
+        # Whether the archive is between two entries.
+        between_entries = True
+        try:
+            for (name, directory_stat) in directories:
+                if directory_stat is None:
+                    _write_tar_entry(output, _tar_info(name, tarfile.DIRTYPE, 0755, 0))
+                else:
+                    _write_tar_entry(output, _tar_info(name, tarfile.DIRTYPE, directory_stat.st_mode, directory_stat.st_mtime))
+            for (source, name, file_stat) in files:
+                with open(source, 'rb') as f:
+                    info = _tar_info(name, tarfile.REGTYPE, file_stat.st_mode, file_stat.st_mtime)
+                    info.size = file_stat.st_size
+                    between_entries = False
+                    _write_tar_entry(output, info, f)
+                    between_entries = True
+            for (link_target, name) in links:
+                info = _tar_info(name, tarfile.SYMTYPE, 0777, 0)
+                info.linkname = link_target
+                _write_tar_entry(output, info)
+            # The end of the archive is marked by two empty blocks.
+            output.write(tarfile.NUL * 2 * tarfile.BLOCKSIZE)
+        except (IOError, OSError), e:
+            # EPIPE means that the reader closed the stream before the end.
+            if e.errno != errno.EPIPE:
+                print >>sys.stderr, 'tar_stream: unable to archive %s: %s' % (path, e)
+                # Set before closing the pipe, so that the reader sees it at the end.
+                stream.error = e
+                if between_entries:
+                    # An archive that stops between two entries looks complete,
+                    # so end with the header of a GNU long name, which readers
+                    # reject when it isn't followed by the entry it names. One
+                    # that stops within a file is shorter than its header says.
+                    try:
+                        info = tarfile.TarInfo('././@LongLink')
+                        info.type = tarfile.GNUTYPE_LONGNAME
+                        info.size = 1
+                        _write_tar_entry(output, info, io.BytesIO(tarfile.NUL))
+                    except (IOError, OSError):
+                        pass
+        finally:
+            try:
+                output.close()
+            except (IOError, OSError):
+                pass
+    thread = threading.Thread(target=generate)
+    thread.daemon = True
+    thread.start()
+    return stream
+
+
+class TarStream(object):
+    '''
+    The read end of the pipe that tar_stream writes to, which raises the error
+    that stopped tar_stream, if any, when the end is read.
+    '''
+    def __init__(self, source):
+        self.source = source
+        self.error = None
+
+    @property
+    def closed(self):
+        return self.source.closed
+
+    def read(self, num_bytes=-1):
+        data = self.source.read(num_bytes)
+        if not data and num_bytes != 0 and self.error:
+            raise IOError('Unable to archive: %s' % (self.error,))
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+def _write_tar_entry(output, info, source=None):
+    '''
+    Write the header of the given TarInfo, followed by info.size bytes read from
+    source padded to a whole block, like TarFile.addfile does.
+    '''
+    output.write(info.tobuf(tarfile.GNU_FORMAT))
+    if source is not None:
+        tarfile.copyfileobj(source, output, info.size)
+        remainder = info.size % tarfile.BLOCKSIZE
+        if remainder:
+            output.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+
+def _tar_info(name, type, mode, mtime):
+    info = tarfile.TarInfo(name)
+    info.type = type
+    info.mode = stat.S_IMODE(mode)
+    info.mtime = int(mtime)
+    return info
+
+
+def untar(source, temp_path, file_name, contents_hashes=None):
+    '''
+    Extract the tar archive read from the file object |source|, which can be a
+    stream, into |temp_path| as it is read, and return the path to the file or
+    directory called |file_name| in |temp_path| (or temp_path itself if
+    |file_name| is not specified), like unzip.
+    Only directories, regular files and symlinks are extracted, without
+    ownership, and entries that would be written outside of temp_path
+    (including through symlinks in the archive) are rejected.
+    If |contents_hashes| is a dict, the path_util.hash_file_contents of each
+    extracted file is computed while it is written and stored in it.
+    '''
+    if file_name:
+        temp_subpath = os.path.join(temp_path, file_name)
+    else:
+        temp_subpath = temp_path
+
+    root = os.path.realpath(temp_path)
+    def check_path(member, target):
+        parent = os.path.realpath(os.path.dirname(target))
+        if parent != root and not parent.startswith(root + os.sep):
+            raise UsageError('Archive entry %s is outside of the archive' % member.name)
+        # Never write through (or replace) something that is already there,
+        # such as a symlink extracted from an earlier entry.
+        try:
+            existing_mode = os.lstat(target).st_mode
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        if not (member.isdir() and stat.S_ISDIR(existing_mode)):
+            raise UsageError('Archive entry %s already exists' % member.name)
+
+    names = set()
+    directory_modes = []
+    try:
+        # Read the source in large chunks, since it can be a remote file handle.
+        tar = tarfile.open(fileobj=source, mode='r|', bufsize=file_util.BUFFER_SIZE)
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if os.path.isabs(name) or name == os.pardir or name.startswith(os.pardir + os.sep):
+                raise UsageError('Archive entry %s is outside of the archive' % member.name)
+            target = os.path.join(temp_path, name)
+            if name == os.curdir:
+                continue
+            if name in names:
+                raise UsageError('Archive entry %s is duplicated' % member.name)
+            names.add(name)
+            check_path(member, target)
+            if member.isdir():
+                # Keep directories writable until their contents are extracted.
+                if not os.path.lexists(target):
+                    os.mkdir(target, 0700)
+                directory_modes.append((target, member.mode))
+            elif member.isfile():
+                member_source = tar.extractfile(member)
+                contents_hash = path_util.new_contents_hash()
+                num_bytes = 0
+                fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0600)
+                with os.fdopen(fd, 'wb') as dest:
+                    while True:
+                        data = member_source.read(file_util.BUFFER_SIZE)
+                        if not data:
+                            break
+                        dest.write(data)
+                        num_bytes += len(data)
+                        if contents_hashes is not None:
+                            contents_hash.update(data)
+                if num_bytes != member.size:
+                    raise UsageError('Archive entry %s is truncated' % member.name)
+                os.chmod(target, stat.S_IMODE(member.mode))
+                if contents_hashes is not None:
+                    contents_hashes[target] = contents_hash.hexdigest()
+            elif member.issym():
+                os.symlink(member.linkname, target)
+                if contents_hashes is not None:
+                    contents_hashes[target] = path_util.hash_link_contents(member.linkname)
+        tar.close()
+        for (target, mode) in reversed(directory_modes):
+            os.chmod(target, stat.S_IMODE(mode))
+    except (tarfile.TarError, IOError, OSError), e:
+        raise UsageError('Unable to extract archive to %s: %s' % (temp_path, e))
+
+    if not os.path.exists(temp_subpath) and not os.path.islink(temp_subpath):
+        raise UsageError('Archive missing %s (%s doesn\'t exist)' % (file_name, temp_subpath))
+    return temp_subpath
@@ -1,11 +1,27 @@
+import errno
+import multiprocessing
 import os
+import socket
 import sys
 import subprocess
+import threading
+import time
+import traceback
 
+from codalab.common import (
+  State,
+  UsageError,
+)
 from codalab.lib import (
   canonicalize,
+  formatting,
   path_util,
 )
+from codalab.lib.resource_usage import (
+  ResourceSeries,
+  sample_processes,
+  sample_rusage,
+)
 
 from codalab.objects.machine import Machine
 
@@ -13,17 +29,63 @@ class LocalMachine(Machine):
     '''
     Run commands on the local machine.  This is for simple testing or personal
     use only, since there is no security.
+
+    Several bundles can run at once. A bundle is started only if the CPUs and
+    memory it requests (request_cpus and request_memory, which default to the
+    values in the worker config) fit in what is left of the machine's capacity
+    (cpus and memory in the worker config, which default to the whole machine).
+
+    The resource usage of the running bundles is sampled every sample_interval
+    seconds (5 by default) from /proc.
     '''
-    def __init__(self):
-        self.bundle = None
-        self.process = None
-        self.temp_dir = None
+    NOTIFIES_ON_CHANGES = True
+
+    def __init__(self, config):
+        self.staging_mode = self.get_staging_mode(config)
+        self.cpus = int(config.get('cpus') or multiprocessing.cpu_count())
+        if config.get('memory'):
+            self.memory = formatting.parse_size(str(config['memory']))
+        else:
+            self.memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        self.default_request_cpus = int(config.get('request_cpus', 1))
+        self.default_request_memory = config.get('request_memory')
+        self.sample_interval = config.get('sample_interval', 5)
+        # job handle -> {bundle, process, temp_dir, cpus, memory, start_time, end_time, usage}
+        self.jobs = {}
+        self.sampler = None
+        # Held while reaping a process (see _watch_process) and while killing one,
+        # so that a pid is never killed after it was reaped and possibly reused.
+        self.process_lock = threading.Lock()
+
+    def get_requested_resources(self, bundle):
+        '''
+        Return the number of CPUs and the amount of memory (in bytes) that the
+        bundle requests. A bundle that requests more than the capacity of the
+        machine gets all of it.
+        '''
+        cpus = getattr(bundle.metadata, 'request_cpus', None) or self.default_request_cpus
+        memory = getattr(bundle.metadata, 'request_memory', None) or self.default_request_memory
+        try:
+            memory = formatting.parse_size(str(memory)) if memory else 0
+        except ValueError:
+            raise UsageError('Invalid request_memory: %s' % memory)
+        return (min(cpus, self.cpus), min(memory, self.memory))
+
+    def _get_job(self, bundle):
+        for (job_handle, job) in self.jobs.iteritems():
+            if job['bundle'].uuid == bundle.uuid:
+                return (job_handle, job)
+        return (None, None)
 
     def start_bundle(self, bundle, bundle_store, parent_dict, username):
         '''
-        Start a bundle in the background.
+        Start a bundle in the background, if there are enough free resources.
         '''
-        if self.bundle != None: return None
+        (cpus, memory) = self.get_requested_resources(bundle)
+        if sum(job['cpus'] for job in self.jobs.itervalues()) + cpus > self.cpus:
+            return None
+        if sum(job['memory'] for job in self.jobs.itervalues()) + memory > self.memory:
+            return None
         temp_dir = canonicalize.get_current_location(bundle_store, bundle.uuid)
         path_util.make_directory(temp_dir)
 
@@ -32,55 +94,117 @@ class LocalMachine(Machine):
         # copy random files on the system).  Of course in local mode,
         # if some of those symlinks are absolute, the run can
         # read/write those locations.  But we're not sandboxed, so
-        # anything could happen.  The dependencies are copied, so in
-        # practice, this is not a bit worry.
-        pairs = bundle.get_dependency_paths(bundle_store, parent_dict, temp_dir)
-        print >>sys.stderr, 'LocalMachine.start_bundle: copying dependencies of %s to %s' % (bundle.uuid, temp_dir)
-        for (source, target) in pairs:
-            path_util.copy(source, target, follow_symlinks=False)
+        # anything could happen.  The dependencies are copied by default, so
+        # in practice, this is not a bit worry.
+        staging_metadata = self.stage_dependencies(bundle, bundle_store, parent_dict, temp_dir, self.staging_mode)
 
         script_file = temp_dir + '.sh'
         with open(script_file, 'w') as f:
             f.write("cd %s &&\n" % temp_dir)
             f.write('(%s) > stdout 2>stderr\n' % bundle.command)
         # Use stdbuf (if it exists) to turn off buffering so we get real-time feedback.
+        # The output of the command goes to files, so stdout is only closed when
+        # the process exits (see _watch_process).
         if os.path.exists('/usr/bin/stdbuf'):
-            process = subprocess.Popen("/usr/bin/stdbuf -o0 bash " + script_file, shell=True)
+            process = subprocess.Popen("exec /usr/bin/stdbuf -o0 bash " + script_file, shell=True, stdout=subprocess.PIPE)
         else:
-            process = subprocess.Popen("bash " + script_file, shell=True)
+            process = subprocess.Popen("exec bash " + script_file, shell=True, stdout=subprocess.PIPE)
 
-        self.bundle = bundle
-        self.temp_dir = temp_dir
-        self.process = process
-        return {
+        # Include the host, so that handles are unique across the workers sharing
+        # the database.
+        job_handle = '%s:%d' % (socket.gethostname(), process.pid)
+        self.jobs[job_handle] = {
             'bundle': bundle,
+            'process': process,
             'temp_dir': temp_dir,
-            'job_handle': str(process.pid)
+            'cpus': cpus,
+            'memory': memory,
+            'start_time': time.time(),
+            'end_time': None,
+            'usage': ResourceSeries(interval=self.sample_interval),
         }
+        # Wait for the process in the background, so that the worker is woken up
+        # as soon as it finishes.
+        watcher = threading.Thread(target=self._watch_process, args=(self.jobs[job_handle],))
+        watcher.daemon = True
+        watcher.start()
+        if not self.sampler:
+            self.sampler = threading.Thread(target=self._sample_jobs)
+            self.sampler.daemon = True
+            self.sampler.start()
+        return dict(staging_metadata, **{
+            'bundle': bundle,
+            'state': State.RUNNING,
+            'temp_dir': temp_dir,
+            'job_handle': job_handle,
+        })
+
+    def _watch_process(self, job):
+        # Wait for the process to exit without reaping it, by reading its stdout
+        # until it is closed, so that kill_bundle can't kill a reused pid.
+        process = job['process']
+        while True:
+            try:
+                if not process.stdout.read(): break
+            except IOError, e:
+                if e.errno != errno.EINTR: raise
+        process.stdout.close()
+        # Reap it with wait4 to get the final resource usage of the process.
+        with self.process_lock:
+            while True:
+                try:
+                    (_, status, rusage) = os.wait4(process.pid, 0)
+                    break
+                except OSError, e:
+                    if e.errno != errno.EINTR: raise
+            job['end_time'] = time.time()
+            job['usage'].add(sample_rusage(rusage))
+            # Same as Popen.wait.
+            process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        if self.wakeup:
+            self.wakeup()
+
+    def _sample_jobs(self):
+        while True:
+            time.sleep(self.sample_interval)
+            jobs = [job for job in self.jobs.values() if job['process'].returncode is None]
+            if not jobs: continue
+            samples = sample_processes([job['process'].pid for job in jobs])
+            for job in jobs:
+                sample = samples.get(job['process'].pid)
+                # Don't sample processes that have just finished.
+                if sample and job['process'].returncode is None:
+                    job['usage'].add(sample)
 
     def kill_bundle(self, bundle):
-        if not self.bundle or self.bundle.uuid != bundle.uuid: return False
+        (_, job) = self._get_job(bundle)
+        if not job: return False
         print >>sys.stderr, 'LocalMachine.kill_bundle %s' % (bundle.uuid)
-        self.process.kill()
+        with self.process_lock:
+            # The process hasn't been reaped yet, so the pid is still its own.
+            if job['process'].returncode is None:
+                job['process'].kill()
         return True
 
     def get_bundle_statuses(self):
-        if self.process == None: return []
-
-        self.process.poll()
-        # TODO: include time and memory
-        status = {
-            'job_handle': str(self.process.pid),
-            'exitcode': self.process.returncode,
-        }
-        status['success'] = status['exitcode'] == 0 if status['exitcode'] != None else None
-        return [status]
+        statuses = []
+        for (job_handle, job) in self.jobs.iteritems():
+            # The process is reaped by _watch_process, which sets returncode.
+            status = dict(job['usage'].get_usage(), **{
+                'job_handle': job_handle,
+                'exitcode': job['process'].returncode,
+                'time': (job['end_time'] or time.time()) - job['start_time'],
+            })
+            status['success'] = status['exitcode'] == 0 if status['exitcode'] != None else None
+            statuses.append(status)
+        return statuses
 
     def finalize_bundle(self, bundle):
-        if not self.bundle or self.bundle.uuid != bundle.uuid: return False
+        (job_handle, job) = self._get_job(bundle)
+        if not job: return False
 
         try:
-            script_file = self.temp_dir + '.sh'
+            script_file = job['temp_dir'] + '.sh'
             for f in [script_file]:
                 if os.path.exists(f):
                     path_util.remove(f)
@@ -90,7 +214,5 @@ class LocalMachine(Machine):
             traceback.print_exc()
             ok = False
 
-        self.bundle = None
-        self.temp_dir = None
-        self.process = None
+        del self.jobs[job_handle]
         return ok
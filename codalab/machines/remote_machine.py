@@ -13,6 +13,10 @@ from codalab.lib import (
   formatting,
 )
 
+from codalab.lib.resource_usage import (
+  ResourceSeries,
+  sample_cgroup,
+)
 from codalab.objects.machine import Machine
 
 '''
@@ -31,13 +35,95 @@ kill that job with the handle.
 4) When constantly poll to see if the job has finished.
 
 The above steps depend on a dispatch_command, which is set in the config.json.
+By default, the dispatch_command is run once per step.  If dispatch_serve is
+set in the config, the worker instead keeps a single `<dispatch_command> serve`
+process, which answers requests written as JSON lines (see scripts/dispatch-q.py),
+and falls back to running the dispatch_command once per step if that fails.
 
 Convention: command is a string, args is a list of arguments
 '''
+class DispatcherError(Exception):
+    '''
+    Raised when the dispatcher server can't be reached.  request_sent is whether
+    the request might have been received anyway.
+    '''
+    def __init__(self, message, request_sent):
+        super(DispatcherError, self).__init__(message)
+        self.request_sent = request_sent
+
+
+class DispatcherServer(object):
+    '''
+    A long-lived `<dispatch_command> serve` process, which reads one JSON request
+    per line on stdin, and writes one JSON response per line on stdout.
+    '''
+    def __init__(self, args, verbose):
+        self.args = args
+        self.verbose = verbose
+        self.proc = None
+        # Whether the server ever answered, i.e., whether it supports serve mode.
+        self.answered = False
+        # handle -> last info about the job, kept up to date with incremental info
+        # requests.  The server only knows what it told this process.
+        self.infos = {}
+
+    def start(self):
+        if self.verbose >= 1: print '=== DispatcherServer: starting %s' % (self.args,)
+        self.proc = subprocess.Popen(self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.infos = {}
+
+    def close(self):
+        if self.proc is None: return
+        try:
+            self.proc.stdin.close()
+            self.proc.wait()
+        except (IOError, OSError):
+            pass
+        self.proc = None
+
+    def request(self, mode, args):
+        '''
+        Send the request and return the response.  Raise DispatcherError if the
+        server is gone, and SystemError if the command failed.
+        '''
+        if self.proc is None or self.proc.poll() is not None:
+            self.start()
+        request = {'mode': mode, 'args': args}
+        if mode == 'info':
+            request['incremental'] = True
+        if self.verbose >= 3: print '=== DispatcherServer.request: %s' % (request,)
+        try:
+            self.proc.stdin.write(json.dumps(request) + '\n')
+            self.proc.stdin.flush()
+        except (IOError, OSError), e:
+            self.close()
+            raise DispatcherError('Writing to dispatcher failed: %s' % e, False)
+        line = self.proc.stdout.readline()
+        try:
+            response = json.loads(line)
+        except ValueError:
+            self.close()
+            raise DispatcherError('Invalid response from dispatcher: %r' % line, True)
+        self.answered = True
+        if 'error' in response:
+            raise SystemError('Command failed: %s %s: %s' % (mode, ' '.join(args), response['error']))
+        if mode == 'info':
+            for handle in response['removed']:
+                self.infos.pop(handle, None)
+            for info in response['infos']:
+                self.infos[info['handle']] = info
+            response = {'infos': self.infos.values()}
+        return response
+
+
 class RemoteMachine(Machine):
     def __init__(self, config):
         self.verbose = config.get('verbose', 1)
         self.dispatch_command = config['dispatch_command']
+        if config.get('dispatch_serve'):
+            self.dispatcher = DispatcherServer(self.dispatch_command.split() + ['serve'], self.verbose)
+        else:
+            self.dispatcher = None
         self.default_docker_image = config.get('docker_image')
         self.default_request_time = config.get('request_time')
         self.default_request_memory = config.get('request_memory')
@@ -45,6 +131,11 @@ class RemoteMachine(Machine):
         self.default_request_gpus = config.get('request_gpus')
         self.default_request_queue = config.get('request_queue')
         self.default_request_priority = config.get('request_priority')
+        self.staging_mode = self.get_staging_mode(config)
+        # Resource usage of the running jobs (job handle -> ResourceSeries), which
+        # is sampled whenever their statuses are read.
+        self.sample_interval = config.get('sample_interval', 5)
+        self.usage = {}
 
     def run_command_get_stdout(self, args):
         if self.verbose >= 3: print "=== run_command_get_stdout: %s" % (args,)
@@ -66,6 +157,24 @@ class RemoteMachine(Machine):
             print stdout
             raise
 
+    def dispatch(self, mode, args):
+        '''
+        Run the dispatch_command in the given mode and return its JSON output,
+        using the dispatcher server if there is one.
+        '''
+        if self.dispatcher:
+            try:
+                return self.dispatcher.request(mode, args)
+            except DispatcherError, e:
+                print '=== dispatch(): %s' % e
+                if not self.dispatcher.answered:
+                    print '=== dispatch(): dispatcher does not support serve mode, running it once per command'
+                    self.dispatcher = None
+                elif mode == 'start' and e.request_sent:
+                    # Don't risk starting the job twice.
+                    raise
+        return self.run_command_get_stdout_json(self.dispatch_command.split() + [mode] + args)
+
     def start_bundle(self, bundle, bundle_store, parent_dict, username):
         '''
         Sets up all the temporary files and then dispatches the job.
@@ -77,16 +186,18 @@ class RemoteMachine(Machine):
         temp_dir = os.path.realpath(temp_dir)  # Follow symlinks
         path_util.make_directory(temp_dir)
 
-        # Copy all the dependencies to that temporary directory.
-        pairs = bundle.get_dependency_paths(bundle_store, parent_dict, temp_dir)
-        print >>sys.stderr, 'RemoteMachine.start_bundle: copying dependencies of %s to %s' % (bundle.uuid, temp_dir)
-        for (source, target) in pairs:
-            path_util.copy(source, target, follow_symlinks=False)
-
         # Set defaults for the dispatcher.
         docker_image = self.default_docker_image
         if bundle.metadata.request_docker_image:
             docker_image = bundle.metadata.request_docker_image
+
+        # Stage all the dependencies in that temporary directory.
+        # Symlinks into the bundle store would dangle inside a docker container,
+        # which only sees the temporary directory, so copy instead.
+        staging_mode = self.staging_mode
+        if docker_image and staging_mode == 'symlink':
+            staging_mode = 'copy'
+        staging_metadata = self.stage_dependencies(bundle, bundle_store, parent_dict, temp_dir, staging_mode)
         request_time = self.default_request_time
         if bundle.metadata.request_time:
             request_time = bundle.metadata.request_time
@@ -143,6 +254,7 @@ class RemoteMachine(Machine):
                     'if [ -e /cgroup ]; then cgroup=/cgroup; else cgroup=/sys/fs/cgroup; fi',  # find where cgroup is
                     copy_if_exists('$cgroup/cpuacct/docker/$(cat %s)/cpuacct.stat', ptr_container_file, ptr_status_dir),
                     copy_if_exists('$cgroup/memory/docker/$(cat %s)/memory.usage_in_bytes', ptr_container_file, ptr_status_dir),
+                    copy_if_exists('$cgroup/memory/docker/$(cat %s)/memory.max_usage_in_bytes', ptr_container_file, ptr_status_dir),
                     copy_if_exists('$cgroup/blkio/docker/$(cat %s)/blkio.throttle.io_service_bytes', ptr_container_file, ptr_status_dir),
                     # Respond to kill action
                     '[ -e %s ] && [ "$(cat %s)" == "kill" ] && docker kill $(cat %s) && rm %s' % (ptr_action_file, ptr_action_file, ptr_container_file, ptr_action_file),
@@ -205,18 +317,18 @@ class RemoteMachine(Machine):
             resource_args.extend(['--username', username])
 
         # Start the command
-        args = self.dispatch_command.split() + ['start'] + map(str, resource_args) + [script_file]
-        if self.verbose >= 1: print '=== start_bundle(): running %s' % args
-        result = json.loads(self.run_command_get_stdout(args))
+        args = map(str, resource_args) + [script_file]
+        if self.verbose >= 1: print '=== start_bundle(): starting %s' % args
+        result = self.dispatch('start', args)
         if self.verbose >= 1: print '=== start_bundle(): got %s' % result
 
         # Return the information about the job.
-        return {
+        return dict(staging_metadata, **{
             'bundle': bundle,
             'temp_dir': temp_dir,
             'job_handle': result['handle'],
             'docker_image': docker_image,
-        }
+        })
 
     def get_bundle_statuses(self):
         '''
@@ -224,8 +336,7 @@ class RemoteMachine(Machine):
         '''
         try:
             # Get status
-            args = self.dispatch_command.split() + ['info']
-            response = self.run_command_get_stdout_json(args)
+            response = self.dispatch('info', [])
             if self.verbose >= 2: print '=== get_bundle_statuses: %s' % response
             statuses = []
             for info in response['infos']:
@@ -242,38 +353,24 @@ class RemoteMachine(Machine):
                 # We don't have access to the temp_dir at this point, so make a
                 # function when given a directory, will retrieve the
                 # appropriate information.
-                def bundle_handler(bundle):
-                    # Read out information from the status file
-                    # (See start_bundle for what's printed out)
+                def bundle_handler(bundle, status=status):
+                    # Read out information from the status files
+                    # (See start_bundle for what's printed out), and add it to
+                    # the resource usage of the bundle.
+                    series = self.usage.get(status['job_handle'])
+                    if not series:
+                        saved = getattr(bundle.metadata, 'resource_usage', None)
+                        if saved:
+                            series = ResourceSeries.from_string(saved)
+                        else:
+                            series = ResourceSeries(interval=self.sample_interval)
+                        self.usage[status['job_handle']] = series
+                    sample = {'memory': status['memory']}
                     temp_dir = getattr(bundle.metadata, 'temp_dir', None)
-                    if temp_dir == None: return {}
-                    status_dir = temp_dir + '.status'
-                    status_update = {}
-                    try:
-                        for line in open(os.path.join(status_dir, 'cpuacct.stat')):
-                            key, value = line.split(" ")
-                            # NOTE: there is a bug in /cgroup where the first values are garbage (way too high).
-                            # Convert jiffies to seconds
-                            if key == 'user':
-                                status_update['time_user'] = int(value) / 100.0
-                            elif key == 'system':
-                                status_update['time_system'] = int(value) / 100.0
-                    except:
-                        pass
-                    try:
-                        status_update['memory'] = int(open(os.path.join(status_dir, 'memory.usage_in_bytes')).read())
-                    except:
-                        pass
-                    try:
-                        for line in open(os.path.join(status_dir, 'blkio.throttle.io_service_bytes')):
-                            _, key, value = line.split(" ")
-                            if key == 'Read':
-                                status_update['disk_read'] = int(value)
-                            elif key == 'Write':
-                                status_update['disk_write'] = int(value)
-                    except:
-                        pass
-                    return status_update
+                    if temp_dir != None:
+                        sample.update(sample_cgroup(temp_dir + '.status'))
+                    series.add(sample)
+                    return series.get_usage()
 
                 status['bundle_handler'] = bundle_handler
                     
@@ -299,8 +396,7 @@ class RemoteMachine(Machine):
                     print >>f, 'kill'
             else:
                 if self._exists(bundle):
-                    args = self.dispatch_command.split() + ['kill', bundle.metadata.job_handle]
-                    result = self.run_command_get_stdout_json(args)
+                    result = self.dispatch('kill', [bundle.metadata.job_handle])
             return True
         except Exception, e:
             print '=== INTERNAL ERROR: %s' % e
@@ -312,8 +408,8 @@ class RemoteMachine(Machine):
         if not self._exists(bundle): return True
 
         try:
-            args = self.dispatch_command.split() + ['cleanup', bundle.metadata.job_handle]
-            result = self.run_command_get_stdout_json(args)
+            result = self.dispatch('cleanup', [bundle.metadata.job_handle])
+            self.usage.pop(bundle.metadata.job_handle, None)
             # Sync this with files created in start_bundle
             temp_dir = bundle.metadata.temp_dir
             if getattr(bundle.metadata, 'docker_image', None):
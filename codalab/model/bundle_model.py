@@ -2,6 +2,7 @@
 BundleModel is a wrapper around database calls to save and load bundle metadata.
 '''
 from sqlalchemy import (
+    event,
     and_,
     or_,
     not_,
@@ -11,6 +12,7 @@ from sqlalchemy import (
     func,
 )
 from sqlalchemy.exc import (
+    IntegrityError as SQLIntegrityError,
     OperationalError,
     ProgrammingError,
 )
@@ -36,9 +38,14 @@ from codalab.model.tables import (
     bundle_dependency as cl_bundle_dependency,
     bundle_metadata as cl_bundle_metadata,
     bundle_action as cl_bundle_action,
+    bundle_lease as cl_bundle_lease,
+    bundle_summary as cl_bundle_summary,
     group as cl_group,
     group_bundle_permission as cl_group_bundle_permission,
     group_object_permission as cl_group_worksheet_permission,
+    permission_change as cl_permission_change,
+    permission_version as cl_permission_version,
+    run_fingerprint as cl_run_fingerprint,
     GROUP_OBJECT_PERMISSION_ALL,
     GROUP_OBJECT_PERMISSION_READ,
     GROUP_OBJECT_PERMISSION_NONE,
@@ -53,12 +60,21 @@ from codalab.objects.worksheet import (
     Worksheet,
 )
 from codalab.objects.permission import parse_permission
+from codalab.model.permission_cache import PermissionCache
+from codalab.model.request_cache import RequestCache
 
 import re, collections
+import contextlib
 import datetime
+import threading
+import time
 
 SEARCH_KEYWORD_REGEX = re.compile('^([\.\w/]*)=(.*)$')
 
+# Bundle columns and metadata keys that are copied to the bundle_summary table.
+BUNDLE_SUMMARY_COLUMNS = ('state', 'owner_id')
+BUNDLE_SUMMARY_METADATA_KEYS = ('name', 'created', 'data_size', 'time')
+
 def str_key_dict(row):
     '''
     row comes out of an element of a database query.
@@ -69,20 +85,71 @@ def str_key_dict(row):
     return dict((str(k), v) for k, v in row.items())
 
 class BundleModel(object):
+    # Maximum number of permissions and group lists kept by the PermissionCache.
+    PERMISSION_CACHE_SIZE = 100000
+    # Every PERMISSION_CHANGE_PRUNE_INTERVAL permission changes, the ones before
+    # the last PERMISSION_CHANGE_LOG_SIZE are deleted.
+    PERMISSION_CHANGE_PRUNE_INTERVAL = 1000
+    PERMISSION_CHANGE_LOG_SIZE = 10000
+
     def __init__(self, engine):
         '''
         Initialize a BundleModel with the given SQLAlchemy engine.
         '''
         self.engine = engine
         self.public_group_uuid = ''
+        self._permission_cache = PermissionCache(self.PERMISSION_CACHE_SIZE)
+        # The RequestCache of the request being handled by each thread (see request_cache).
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
         self.create_tables()
 
+    @contextlib.contextmanager
+    def request_cache(self):
+        '''
+        Cache the bundles, worksheets, owner ids, group memberships and
+        permissions read by this thread until the end of the with block, which
+        should span one request. Nested blocks share the outer cache.
+        Yield the RequestCache, whose counters tell how many queries were made.
+        '''
+        cache = self._get_request_cache()
+        if cache:
+            yield cache
+            return
+        cache = self._local.cache = RequestCache()
+        try:
+            yield cache
+        finally:
+            self._local.cache = None
+
+    def _get_request_cache(self):
+        return getattr(self._local, 'cache', None)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        cache = self._get_request_cache()
+        if cache:
+            cache.num_queries += 1
+            # Drop everything on writes, so that the request sees its own writes.
+            if not statement.lstrip().upper().startswith('SELECT'):
+                cache.clear()
+
+    def _get_cached(self, namespace, keys, fetch, default=None):
+        '''
+        Return {key: value} for the given keys, where fetch(keys) gets them from
+        the database. Go through the request cache if there is one.
+        '''
+        cache = self._get_request_cache()
+        if not cache:
+            return fetch(keys)
+        return cache.get_many(namespace, keys, fetch, default)
+
     def _reset(self):
         '''
         Do a drop / create table to clear and reset the schema of all tables.
         '''
         # Do not run this function in production!
         db_metadata.drop_all(self.engine)
+        self._permission_cache.clear()
         self.create_tables()
 
     def create_tables(self):
@@ -91,6 +158,7 @@ class BundleModel(object):
         '''
         db_metadata.create_all(self.engine)
         self._create_default_groups()
+        self._create_permission_version()
 
     def do_multirow_insert(self, connection, table, values):
         '''
@@ -146,15 +214,18 @@ class BundleModel(object):
         '''
         if len(uuids) == 0:
             return []
-        with self.engine.begin() as connection:
-            rows = connection.execute(select([
-                cl_bundle_metadata.c.bundle_uuid,
-                cl_bundle_metadata.c.metadata_value
-            ]).where(
-                and_(cl_bundle_metadata.c.metadata_key == 'name',
-                     cl_bundle_metadata.c.bundle_uuid.in_(uuids))
-            )).fetchall()
-            return dict((row.bundle_uuid, row.metadata_value) for row in rows)
+        def fetch(uuids):
+            with self.engine.begin() as connection:
+                rows = connection.execute(select([
+                    cl_bundle_metadata.c.bundle_uuid,
+                    cl_bundle_metadata.c.metadata_value
+                ]).where(
+                    and_(cl_bundle_metadata.c.metadata_key == 'name',
+                         cl_bundle_metadata.c.bundle_uuid.in_(uuids))
+                )).fetchall()
+                return dict((row.bundle_uuid, row.metadata_value) for row in rows)
+        names = self._get_cached('bundle_name', uuids, fetch)
+        return dict((uuid, name) for (uuid, name) in names.iteritems() if name is not None)
 
     def get_owner_ids(self, table, uuids):
         '''
@@ -163,12 +234,15 @@ class BundleModel(object):
         '''
         if len(uuids) == 0:
             return []
-        with self.engine.begin() as connection:
-            rows = connection.execute(select([
-                table.c.uuid,
-                table.c.owner_id,
-            ]).where(table.c.uuid.in_(uuids))).fetchall()
-            return dict((row.uuid, row.owner_id) for row in rows)
+        def fetch(uuids):
+            with self.engine.begin() as connection:
+                rows = connection.execute(select([
+                    table.c.uuid,
+                    table.c.owner_id,
+                ]).where(table.c.uuid.in_(uuids))).fetchall()
+                return dict((row.uuid, row.owner_id) for row in rows)
+        owner_ids = self._get_cached(('owner_id', table.name), uuids, fetch)
+        return dict((uuid, owner_id) for (uuid, owner_id) in owner_ids.iteritems() if owner_id is not None)
     def get_bundle_owner_ids(self, uuids):
         return self.get_owner_ids(cl_bundle, uuids)
     def get_worksheet_owner_ids(self, uuids):
@@ -268,16 +342,30 @@ class BundleModel(object):
         def is_numeric(key):
             return key != 'name'
 
+        def is_typed(key):
+            # The bundle_summary columns don't need to be cast to numbers.
+            return key in BUNDLE_SUMMARY_COLUMNS or key in BUNDLE_SUMMARY_METADATA_KEYS
+
+        # Join with bundle_summary the first time one of its columns is used.
+        # This is an outer join, so that bundles which don't have a summary row
+        # yet (saved by an older version, whose summary is added by the
+        # migration or their next update_bundle) are only left out by
+        # conditions on the summary, not by the join itself.
+        summary_joined = [False]
+        def summary_field(key):
+            summary_joined[0] = True
+            return getattr(cl_bundle_summary.c, key)
+
         def make_condition(key, field, value):
             # Special
             if value == '.sort':
-                if is_numeric(key): field = field * 1
+                if is_numeric(key) and not is_typed(key): field = field * 1
                 sort_key[0] = field
             elif value == '.sort-':
-                if is_numeric(key): field = field * 1
+                if is_numeric(key) and not is_typed(key): field = field * 1
                 sort_key[0] = desc(field)
             elif value == '.sum':
-                sum_key[0] = field * 1
+                sum_key[0] = field if is_typed(key) else field * 1
             else:
                 # Ordinary value
                 if '%' in value:
@@ -332,12 +420,11 @@ class BundleModel(object):
                 clause = make_condition(key, cl_bundle.c.uuid, value)
             elif key == 'data_hash':
                 clause = make_condition(key, cl_bundle.c.data_hash, value)
-            elif key == 'state':
-                clause = make_condition(key, cl_bundle.c.state, value)
             elif key == 'command':
                 clause = make_condition(key, cl_bundle.c.command, value)
-            elif key == 'owner_id':
-                clause = make_condition(key, cl_bundle.c.owner_id, value)
+            # Bundle fields and metadata in the bundle summary
+            elif is_typed(key):
+                clause = make_condition(key, summary_field(key), value)
             # Special fields
             elif key == 'dependency':
                 # Match uuid of dependency
@@ -368,10 +455,12 @@ class BundleModel(object):
             elif key == 'uuid_name': # Search uuid and name by default
                 clause = []
                 clause.append(cl_bundle.c.uuid.like('%' + value + '%'))
-                clause.append(cl_bundle.c.uuid.in_(alias(select([cl_bundle_metadata.c.bundle_uuid]).where(and_(
+                # Fall back on the metadata for bundles without a summary row.
+                name = select([cl_bundle_metadata.c.metadata_value]).where(and_(
+                    cl_bundle_metadata.c.bundle_uuid == cl_bundle.c.uuid,
                     cl_bundle_metadata.c.metadata_key == 'name',
-                    cl_bundle_metadata.c.metadata_value.like('%' + value + '%'),
-                )))))
+                )).limit(1).as_scalar()
+                clause.append(func.coalesce(summary_field('name'), name).like('%' + value + '%'))
                 clause = or_(*clause)
             elif key == '':  # Match any field
                 clause = []
@@ -404,22 +493,24 @@ class BundleModel(object):
             # Restrict to the bundles that we have access to.
             access_via_owner = (cl_bundle.c.owner_id == user_id)
             access_via_group = cl_bundle.c.uuid.in_(select([cl_group_bundle_permission.c.object_uuid]).where(and_(
-                or_(  # Join constraint (group)
-                    cl_group_bundle_permission.c.group_uuid == self.public_group_uuid,  # Public group
-                    cl_group_bundle_permission.c.group_uuid.in_(alias(select([cl_user_group.c.group_uuid]).where(cl_user_group.c.user_id == user_id)))  # Private group
-                ),
+                cl_group_bundle_permission.c.group_uuid.in_(self._get_user_groups(user_id)),  # Public and private groups
                 cl_group_bundle_permission.c.permission >= GROUP_OBJECT_PERMISSION_READ,  # Match the uuid of the parent
             )))
             clause = and_(clause, or_(access_via_owner, access_via_group))
 
+        if summary_joined[0]:
+            bundles = cl_bundle.outerjoin(cl_bundle_summary, cl_bundle_summary.c.bundle_uuid == cl_bundle.c.uuid)
+        else:
+            bundles = cl_bundle
+
         # Aggregate (sum)
         if sum_key[0] is not None:
             # Construct a table with only the uuid and the num (and make sure it's distinct!)
-            query = alias(select([cl_bundle.c.uuid, sum_key[0].label('num')]).distinct().where(clause))
+            query = alias(select([cl_bundle.c.uuid, sum_key[0].label('num')]).select_from(bundles).distinct().where(clause))
             # Sum the numbers
             query = select([func.sum(query.c.num)])
         else:
-            query = select([cl_bundle.c.uuid]).distinct().where(clause).offset(offset).limit(limit)
+            query = select([cl_bundle.c.uuid]).select_from(bundles).distinct().where(clause).offset(offset).limit(limit)
 
         # Sort
         if sort_key[0] is not None:
@@ -489,6 +580,16 @@ class BundleModel(object):
         '''
         Return a list of bundles given a SQLAlchemy clause on the cl_bundle table.
         '''
+        if self._get_request_cache() and kwargs.keys() == ['uuid'] and not isinstance(kwargs['uuid'], LikeQuery):
+            uuids = kwargs['uuid']
+            if isinstance(uuids, basestring):
+                uuids = [uuids]
+            fetch = lambda uuids: dict((bundle.uuid, bundle) for bundle in self._batch_get_bundles(uuid=uuids))
+            bundles = [bundle for bundle in self._get_cached('bundle', uuids, fetch).itervalues() if bundle]
+            return sorted(bundles, key=lambda bundle: bundle.id)
+        return self._batch_get_bundles(**kwargs)
+
+    def _batch_get_bundles(self, **kwargs):
         clause = self.make_kwargs_clause(cl_bundle, kwargs)
         with self.engine.begin() as connection:
             bundle_rows = connection.execute(
@@ -546,10 +647,19 @@ class BundleModel(object):
             clause = cl_bundle.c.id.in_(bundle_ids)
             if condition:
                 clause = and_(clause, self.make_kwargs_clause(cl_bundle, condition))
+            summary_update = dict((key, value) for (key, value) in update.iteritems() if key in BUNDLE_SUMMARY_COLUMNS)
             with self.engine.begin() as connection:
                 result = connection.execute(
                   cl_bundle.update().where(clause).values(update)
                 )
+                if summary_update:
+                    # Only the bundles that satisfied the condition were updated.
+                    updated_uuids = select([cl_bundle.c.uuid]).where(
+                      and_(cl_bundle.c.id.in_(bundle_ids), self.make_kwargs_clause(cl_bundle, summary_update))
+                    )
+                    connection.execute(cl_bundle_summary.update().where(
+                      cl_bundle_summary.c.bundle_uuid.in_(updated_uuids)
+                    ).values(summary_update))
                 success = result.rowcount == len(bundle_ids)
                 if success:
                     for bundle in bundles:
@@ -565,12 +675,119 @@ class BundleModel(object):
         with self.engine.begin() as connection:
             self.do_multirow_insert(connection, cl_bundle_action, bundle_actions)
 
-    def pop_bundle_actions(self):
+    def pop_bundle_actions(self, worker_id=None):
+        '''
+        Return and delete the pending bundle actions. If worker_id is given, skip
+        the actions on bundles that another worker holds a lease on.
+        '''
         with self.engine.begin() as connection:
-            results = connection.execute(cl_bundle_action.select()).fetchall()  # Get the actions
-            connection.execute(cl_bundle_action.delete())  # Delete all actions
+            query = cl_bundle_action.select()
+            if worker_id is not None:
+                query = query.where(not_(cl_bundle_action.c.bundle_uuid.in_(select([cl_bundle_lease.c.bundle_uuid]).where(and_(
+                  cl_bundle_lease.c.worker_id != worker_id,
+                  cl_bundle_lease.c.expires >= time.time(),
+                )))))
+            results = connection.execute(query).fetchall()  # Get the actions
+            if results:
+                # Delete these actions
+                connection.execute(cl_bundle_action.delete().where(cl_bundle_action.c.id.in_([x.id for x in results])))
             return [x for x in results]
 
+    def acquire_bundle_lease(self, uuid, worker_id, lease_time):
+        '''
+        Take a lease on the bundle for lease_time seconds, unless another worker
+        holds an unexpired lease on it. Return whether the lease was taken.
+        '''
+        now = time.time()
+        try:
+            with self.engine.begin() as connection:
+                # Take over the lease if it is ours or if it expired.
+                result = connection.execute(cl_bundle_lease.update().where(and_(
+                  cl_bundle_lease.c.bundle_uuid == uuid,
+                  or_(cl_bundle_lease.c.worker_id == worker_id, cl_bundle_lease.c.expires < now),
+                )).values({'worker_id': worker_id, 'expires': now + lease_time}))
+                if result.rowcount == 0:
+                    connection.execute(cl_bundle_lease.insert().values({
+                      'bundle_uuid': uuid,
+                      'worker_id': worker_id,
+                      'expires': now + lease_time,
+                    }))
+            return True
+        except SQLIntegrityError:
+            # Another worker holds the lease.
+            return False
+
+    def renew_bundle_leases(self, worker_id, lease_time):
+        '''
+        Extend all the leases of the worker by lease_time seconds from now.
+        '''
+        with self.engine.begin() as connection:
+            connection.execute(cl_bundle_lease.update().where(
+              cl_bundle_lease.c.worker_id == worker_id
+            ).values({'expires': time.time() + lease_time}))
+
+    def release_bundle_lease(self, uuid, worker_id):
+        with self.engine.begin() as connection:
+            connection.execute(cl_bundle_lease.delete().where(and_(
+              cl_bundle_lease.c.bundle_uuid == uuid,
+              cl_bundle_lease.c.worker_id == worker_id,
+            )))
+
+    def get_leased_bundle_uuids(self, worker_id):
+        '''
+        Return the set of uuids of the bundles that the worker holds leases on.
+        '''
+        with self.engine.begin() as connection:
+            rows = connection.execute(select([cl_bundle_lease.c.bundle_uuid]).where(
+              cl_bundle_lease.c.worker_id == worker_id
+            )).fetchall()
+        return set(row.bundle_uuid for row in rows)
+
+    def get_unleased_bundle_states(self, states):
+        '''
+        Return {uuid: state, ...} for the bundles in one of the given states that
+        nobody holds an unexpired lease on.
+        '''
+        with self.engine.begin() as connection:
+            rows = connection.execute(select([
+              cl_bundle.c.uuid,
+              cl_bundle.c.state,
+            ]).select_from(cl_bundle.outerjoin(
+              cl_bundle_lease, cl_bundle.c.uuid == cl_bundle_lease.c.bundle_uuid
+            )).where(and_(
+              cl_bundle.c.state.in_(states),
+              or_(cl_bundle_lease.c.expires == None, cl_bundle_lease.c.expires < time.time()),
+            ))).fetchall()
+        return dict((row.uuid, row.state) for row in rows)
+
+    def add_run_fingerprint(self, fingerprint, bundle_uuid):
+        '''
+        Record that the READY run bundle_uuid has the given fingerprint, unless
+        another run already has it.
+        '''
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(cl_run_fingerprint.insert().values({
+                  'fingerprint': fingerprint,
+                  'bundle_uuid': bundle_uuid,
+                }))
+        except SQLIntegrityError:
+            pass
+
+    def get_memoized_run(self, fingerprint):
+        '''
+        Return the READY run with the given fingerprint that still has its data,
+        or None.
+        '''
+        with self.engine.begin() as connection:
+            row = connection.execute(select([cl_run_fingerprint.c.bundle_uuid]).where(
+              cl_run_fingerprint.c.fingerprint == fingerprint
+            )).fetchone()
+        if not row:
+            return None
+        bundles = self.batch_get_bundles(uuid=[row.bundle_uuid], state=State.READY)
+        return bundles[0] if bundles and bundles[0].data_hash else None
+
     def save_bundle(self, bundle):
         '''
         Save a bundle. On success, sets the Bundle object's id from the result.
@@ -586,8 +803,19 @@ class BundleModel(object):
                 result = connection.execute(cl_bundle.insert().values(bundle_value))
                 self.do_multirow_insert(connection, cl_bundle_dependency, dependency_values)
                 self.do_multirow_insert(connection, cl_bundle_metadata, metadata_values)
+                connection.execute(cl_bundle_summary.insert().values(self._get_bundle_summary(bundle)))
                 bundle.id = result.lastrowid
 
+    def _get_bundle_summary(self, bundle):
+        '''
+        Return the bundle_summary row of the given bundle.
+        '''
+        row = {'bundle_uuid': bundle.uuid}
+        for key in BUNDLE_SUMMARY_COLUMNS:
+            row[key] = getattr(bundle, key, None)
+        for key in BUNDLE_SUMMARY_METADATA_KEYS:
+            row[key] = getattr(bundle.metadata, key, None)
+        return row
 
     def update_bundle(self, bundle, update):
         '''
@@ -618,6 +846,10 @@ class BundleModel(object):
               row_dict for row_dict in bundle.to_dict().pop('metadata')
               if row_dict['metadata_key'] in metadata_update
             ]
+        summary_update = (
+          any(key in BUNDLE_SUMMARY_COLUMNS for key in update) or
+          any(key in BUNDLE_SUMMARY_METADATA_KEYS for key in metadata_update)
+        )
         # Perform the actual updates.
         with self.engine.begin() as connection:
             if update:
@@ -625,6 +857,12 @@ class BundleModel(object):
             if metadata_update:
                 connection.execute(cl_bundle_metadata.delete().where(metadata_clause))
                 self.do_multirow_insert(connection, cl_bundle_metadata, metadata_values)
+            if summary_update:
+                result = connection.execute(cl_bundle_summary.update().where(
+                  cl_bundle_summary.c.bundle_uuid == bundle.uuid
+                ).values(self._get_bundle_summary(bundle)))
+                if result.rowcount == 0:
+                    connection.execute(cl_bundle_summary.insert().values(self._get_bundle_summary(bundle)))
 
     def get_bundle_states(self, uuids):
         '''
@@ -634,6 +872,40 @@ class BundleModel(object):
             rows = connection.execute(select([cl_bundle.c.uuid, cl_bundle.c.state]).where(cl_bundle.c.uuid.in_(uuids))).fetchall()
             return dict((r.uuid, r.state) for r in rows)
 
+    def get_owner_bundle_counts(self, states):
+        '''
+        Return {owner_id: number of bundles in one of the given states, ...}
+        '''
+        with self.engine.begin() as connection:
+            rows = connection.execute(select([
+              cl_bundle.c.owner_id,
+              func.count(cl_bundle.c.id),
+            ]).where(cl_bundle.c.state.in_(states)).group_by(cl_bundle.c.owner_id)).fetchall()
+        return dict((row[0], row[1]) for row in rows)
+
+    def get_created_bundle_parents(self, min_id):
+        '''
+        Get the CREATED bundles with id > min_id, without their metadata.
+        Return {uuid: (id, set(parent_uuids)), ...}
+        '''
+        with self.engine.begin() as connection:
+            rows = connection.execute(select([
+              cl_bundle.c.id,
+              cl_bundle.c.uuid,
+              cl_bundle_dependency.c.parent_uuid,
+            ]).select_from(cl_bundle.outerjoin(
+              cl_bundle_dependency, cl_bundle.c.uuid == cl_bundle_dependency.c.child_uuid
+            )).where(and_(
+              cl_bundle.c.state == State.CREATED,
+              cl_bundle.c.id > min_id,
+            ))).fetchall()
+        result = {}
+        for row in rows:
+            (_, parent_uuids) = result.setdefault(row.uuid, (row.id, set()))
+            if row.parent_uuid is not None:
+                parent_uuids.add(row.parent_uuid)
+        return result
+
     def delete_bundles(self, uuids):
         '''
         Delete bundles with the given uuids.
@@ -653,6 +925,15 @@ class BundleModel(object):
             connection.execute(cl_bundle_dependency.delete().where(
                 cl_bundle_dependency.c.child_uuid.in_(uuids)
             ))
+            connection.execute(cl_bundle_lease.delete().where(
+                cl_bundle_lease.c.bundle_uuid.in_(uuids)
+            ))
+            connection.execute(cl_run_fingerprint.delete().where(
+                cl_run_fingerprint.c.bundle_uuid.in_(uuids)
+            ))
+            connection.execute(cl_bundle_summary.delete().where(
+                cl_bundle_summary.c.bundle_uuid.in_(uuids)
+            ))
             connection.execute(cl_bundle.delete().where(
                 cl_bundle.c.uuid.in_(uuids)
             ))
@@ -660,6 +941,10 @@ class BundleModel(object):
     def remove_data_hash_references(self, uuids):
         with self.engine.begin() as connection:
             connection.execute(cl_bundle.update().where(cl_bundle.c.uuid.in_(uuids)).values({'data_hash': None}))
+            # Runs without data can't be reused.
+            connection.execute(cl_run_fingerprint.delete().where(
+                cl_run_fingerprint.c.bundle_uuid.in_(uuids)
+            ))
 
     #############################################################################
     # Worksheet-related model methods follow!
@@ -680,6 +965,15 @@ class BundleModel(object):
         '''
         Get a list of worksheets, all of which satisfy the clause given by kwargs.
         '''
+        if self._get_request_cache() and kwargs.keys() == ['uuid'] and not isinstance(kwargs['uuid'], LikeQuery):
+            uuids = kwargs['uuid']
+            if isinstance(uuids, basestring):
+                uuids = [uuids]
+            fetch = lambda uuids: dict((worksheet.uuid, worksheet) for worksheet in self._batch_get_worksheets(fetch_items, uuid=uuids))
+            return [worksheet for worksheet in self._get_cached(('worksheet', fetch_items), uuids, fetch).itervalues() if worksheet]
+        return self._batch_get_worksheets(fetch_items, **kwargs)
+
+    def _batch_get_worksheets(self, fetch_items, **kwargs):
         base_worksheet_uuid = kwargs.pop('base_worksheet_uuid', None)
         clause = self.make_kwargs_clause(cl_worksheet, kwargs)
         # Handle base_worksheet_uuid specially
@@ -696,7 +990,7 @@ class BundleModel(object):
                 if base_worksheet_uuid != None:
                     # We didn't find any results restricting to base_worksheet_uuid,
                     # so do a global search
-                    return self.batch_get_worksheets(fetch_items, **kwargs)
+                    return self._batch_get_worksheets(fetch_items, **kwargs)
                 return []
             # Fetch the items of all the worksheets
             if fetch_items:
@@ -814,11 +1108,9 @@ class BundleModel(object):
         # Enforce permissions
         if user_id != self.root_user_id:
             access_via_owner = (cl_worksheet.c.owner_id == user_id)
-            access_via_group = cl_worksheet.c.uuid.in_(select([cl_group_worksheet_permission.c.object_uuid]).where(or_(
-                cl_group_worksheet_permission.c.group_uuid == self.public_group_uuid, # Public group
-                cl_group_worksheet_permission.c.group_uuid.in_(  # Private group
-                    alias(select([cl_user_group.c.group_uuid]).where(cl_user_group.c.user_id == user_id)))
-            )))
+            access_via_group = cl_worksheet.c.uuid.in_(select([cl_group_worksheet_permission.c.object_uuid]).where(
+                cl_group_worksheet_permission.c.group_uuid.in_(self._get_user_groups(user_id))  # Public and private groups
+            ))
             clause = and_(clause, or_(access_via_owner, access_via_group))
 
         cols_to_select = [cl_worksheet.c.id,
@@ -1004,6 +1296,77 @@ class BundleModel(object):
             group_dict = groups[0]
         self.public_group_uuid = group_dict['uuid']
 
+    def _create_permission_version(self):
+        '''
+        Create the row of the permission_version table. This is called by create_tables.
+        '''
+        with self.engine.begin() as connection:
+            if not connection.execute(cl_permission_version.select()).fetchall():
+                connection.execute(cl_permission_version.insert().values({'version': 0}))
+
+    def _get_permission_state(self):
+        '''
+        Return (version, changes, change_id), where version is the current
+        permission version, and changes is the list of (table name, object uuid)
+        of the permission changes after the last one the PermissionCache has
+        seen, up to the one with id change_id (read once per request).
+        '''
+        def fetch(keys):
+            change_id = self._permission_cache.change_id
+            with self.engine.begin() as connection:
+                if change_id is None:
+                    # The cache is empty, so only the last id is needed.
+                    row = connection.execute(select([
+                      cl_permission_version.c.version,
+                      select([func.max(cl_permission_change.c.id)]).as_scalar().label('change_id'),
+                    ])).fetchone()
+                    return {None: (row.version, [], row.change_id or 0) if row else (0, [], 0)}
+                rows = connection.execute(select([
+                  cl_permission_version.c.version,
+                  cl_permission_change.c.id,
+                  cl_permission_change.c.object_table,
+                  cl_permission_change.c.object_uuid,
+                ]).select_from(cl_permission_version.outerjoin(
+                  cl_permission_change, cl_permission_change.c.id > change_id
+                ))).fetchall()
+            changes = [(row.object_table, row.object_uuid) for row in rows if row.id is not None]
+            change_id = max([change_id] + [row.id for row in rows if row.id is not None])
+            return {None: (rows[0].version if rows else 0, changes, change_id)}
+        return self._get_cached('permission_state', [None], fetch)[None]
+
+    def _increment_permission_version(self, connection):
+        '''
+        Tell all the PermissionCaches that group memberships have changed, which
+        drops everything they hold. Call this in the transaction that changes them.
+        '''
+        connection.execute(cl_permission_version.update().values({'version': cl_permission_version.c.version + 1}))
+
+    def _add_permission_change(self, connection, table, object_uuid):
+        '''
+        Tell all the PermissionCaches that the permissions of the given object
+        have changed. Call this in the transaction that changes them.
+        '''
+        result = connection.execute(cl_permission_change.insert().values({
+          'object_table': table.name,
+          'object_uuid': object_uuid,
+        }))
+        change_id = result.lastrowid
+        if change_id % self.PERMISSION_CHANGE_PRUNE_INTERVAL == 0:
+            connection.execute(cl_permission_change.delete().where(
+              cl_permission_change.c.id <= change_id - self.PERMISSION_CHANGE_LOG_SIZE
+            ))
+            # The caches that haven't seen the deleted changes have to start over.
+            self._increment_permission_version(connection)
+
+    def _get_cached_permissions(self, namespace, keys, fetch):
+        '''
+        Return {key: value} for the given keys through the PermissionCache, where
+        fetch(keys) gets the values from the database.
+        '''
+        (version, changes, change_id) = self._get_permission_state()
+        state = self._permission_cache.update(version, changes, change_id)
+        return self._permission_cache.get_many(namespace, keys, fetch, state)
+
     def list_groups(self, owner_id):
         '''
         Return a list of row dicts --one per group-- for the given owner.
@@ -1108,6 +1471,7 @@ class BundleModel(object):
             connection.execute(cl_group.delete().where(
               cl_group.c.uuid == uuid
             ))
+            self._increment_permission_version(connection)
 
     def add_user_in_group(self, user_id, group_uuid, is_admin):
         '''
@@ -1117,6 +1481,7 @@ class BundleModel(object):
         with self.engine.begin() as connection:
             result = connection.execute(cl_user_group.insert().values(row))
             row['id'] = result.lastrowid
+            self._increment_permission_version(connection)
         return row
 
     def delete_user_in_group(self, user_id, group_uuid):
@@ -1128,6 +1493,7 @@ class BundleModel(object):
                 where(cl_user_group.c.user_id == user_id).\
                 where(cl_user_group.c.group_uuid == group_uuid)
             )
+            self._increment_permission_version(connection)
 
     def update_user_in_group(self, user_id, group_uuid, is_admin):
         '''
@@ -1156,10 +1522,12 @@ class BundleModel(object):
 
     # Helper function: return list of group uuids that |user_id| is in.
     def _get_user_groups(self, user_id):
-        groups = [self.public_group_uuid]  # Everyone is in the public group implicitly.
-        if user_id != None:
-            groups += [row['group_uuid'] for row in self.batch_get_user_in_group(user_id=user_id)]
-        return groups
+        def fetch(user_ids):
+            groups = [self.public_group_uuid]  # Everyone is in the public group implicitly.
+            if user_id != None:
+                groups += [row['group_uuid'] for row in self.batch_get_user_in_group(user_id=user_id)]
+            return {user_id: groups}
+        return self._get_cached_permissions('user_groups', [user_id], fetch)[user_id]
 
     def add_permission(self, table, group_uuid, object_uuid, permission):
         '''
@@ -1169,6 +1537,7 @@ class BundleModel(object):
         with self.engine.begin() as connection:
             result = connection.execute(table.insert().values(row))
             row['id'] = result.lastrowid
+            self._add_permission_change(connection, table, object_uuid)
         return row
     def add_bundle_permission(self, group_uuid, bundle_uuid, permission):
         self.add_permission(cl_group_bundle_permission, group_uuid, bundle_uuid, permission)
@@ -1184,6 +1553,7 @@ class BundleModel(object):
                 where(table.c.group_uuid == group_uuid). \
                 where(table.c.object_uuid == object_uuid)
             )
+            self._add_permission_change(connection, table, object_uuid)
     def delete_bundle_permission(self, group_uuid, bundle_uuid):
         self.delete_permission(cl_group_bundle_permission, group_uuid, bundle_uuid)
     def delete_worksheet_permission(self, group_uuid, worksheet_uuid):
@@ -1199,6 +1569,7 @@ class BundleModel(object):
                 where(table.c.group_uuid == group_uuid). \
                 where(table.c.object_uuid == object_uuid). \
                 values({'permission': permission}))
+            self._add_permission_change(connection, table, object_uuid)
     def update_bundle_permission(self, group_uuid, bundle_uuid, permission):
         self.update_permission(cl_group_bundle_permission, group_uuid, bundle_uuid, permission)
     def update_worksheet_permission(self, group_uuid, worksheet_uuid, permission):
@@ -1210,20 +1581,25 @@ class BundleModel(object):
         Note: if user_id != None, only involve groups that user_id is in. If user_id is None (i.e.
         user is not logged in), involve only the public group.
         '''
-        with self.engine.begin() as connection:
-            if user_id is None:
-                # Not logged in: include only public group
-                group_restrict = (table.c.group_uuid == self.public_group_uuid)
-            elif user_id != self.root_user_id:
-                # Logged in but not root: include only public group and groups that user_id is in
-                group_restrict = or_(
-                    table.c.group_uuid == self.public_group_uuid,
-                    table.c.group_uuid.in_(select([cl_user_group.c.group_uuid]).where(cl_user_group.c.user_id == user_id))
-                )
-            else:
-                # Logged in as root: include all groups
-                group_restrict = true()
+        permissions = self._get_cached(
+            ('group_permissions', table.name, user_id), object_uuids,
+            lambda object_uuids: self._batch_get_group_permissions(table, user_id, object_uuids),
+            default=[])
+        result = collections.defaultdict(list)  # object_uuid => list of rows
+        for (object_uuid, rows) in permissions.iteritems():
+            if rows:
+                result[object_uuid] = list(rows)
+        return result
 
+    def _batch_get_group_permissions(self, table, user_id, object_uuids):
+        if user_id != self.root_user_id:
+            # Include only public group and groups that user_id is in (only
+            # public group if not logged in)
+            group_restrict = table.c.group_uuid.in_(self._get_user_groups(user_id))
+        else:
+            # Logged in as root: include all groups
+            group_restrict = true()
+        with self.engine.begin() as connection:
             rows = connection.execute(select([table, cl_group.c.name])
                 .where(table.c.group_uuid == cl_group.c.uuid)
                 .where(group_restrict)
@@ -1282,13 +1658,19 @@ class BundleModel(object):
             else:
                 remaining_object_uuids.append(object_uuid)
 
-        if len(remaining_object_uuids) > 0:
-            result = self.batch_get_group_permissions(table, user_id, remaining_object_uuids)
+        def fetch(object_uuids):
+            result = self.batch_get_group_permissions(table, user_id, object_uuids)
             user_groups = self._get_user_groups(user_id)
-            for object_uuid, permissions in result.items():
-                for row in permissions:
+            permissions = dict((object_uuid, GROUP_OBJECT_PERMISSION_NONE) for object_uuid in object_uuids)
+            for object_uuid, rows in result.items():
+                for row in rows:
                     if row['group_uuid'] in user_groups:
-                        object_permissions[object_uuid] = max(object_permissions[object_uuid], row['permission'])
+                        permissions[object_uuid] = max(permissions[object_uuid], row['permission'])
+            return permissions
+        if len(remaining_object_uuids) > 0:
+            # The permissions given by the groups don't depend on the owner, so
+            # they can be cached until permissions or groups change.
+            object_permissions.update(self._get_cached_permissions((table.name, user_id), remaining_object_uuids, fetch))
         return object_permissions
     def get_user_bundle_permissions(self, user_id, bundle_uuids, owner_ids):
         return self.get_user_permissions(cl_group_bundle_permission, user_id, bundle_uuids, owner_ids)
@@ -0,0 +1,78 @@
+'''
+PermissionCache keeps the effective permissions of users on bundles and
+worksheets, and the groups that users are in, across requests, so that most
+permission checks don't touch the group and permission tables.
+
+Every change to the permissions of an object adds a row to the
+permission_change table (in the same transaction), and the cache drops the
+permissions it holds for the objects that appear in the rows it hasn't seen
+yet. Changes to group memberships, which can affect any object, increment the
+number in the permission_version table instead, and the cache is dropped as
+soon as a newer version is read. This way, changes made by other processes are
+seen too.
+'''
+import threading
+
+
+class PermissionCache(object):
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.version = None
+        self.change_id = None  # Id of the last permission change seen
+        self.values = {}  # (namespace, key) -> value
+        # (table name, object uuid) -> set of (namespace, key) that hold the
+        # permissions on that object.
+        self.object_keys = {}
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+            self.object_keys = {}
+            self.version = None
+            self.change_id = None
+
+    def update(self, version, changes, change_id):
+        '''
+        Drop everything if the permission version has changed since the cache
+        was filled, and otherwise the permissions of the objects in changes, a
+        list of (table name, object uuid). change_id is the id of the last of
+        these changes. Return the state to pass to get_many.
+        '''
+        with self.lock:
+            if version != self.version or self.change_id is None:
+                self.values = {}
+                self.object_keys = {}
+                self.version = version
+            else:
+                for change in changes:
+                    for entry in self.object_keys.pop(change, ()):
+                        self.values.pop(entry, None)
+            if self.change_id is None or change_id > self.change_id:
+                self.change_id = change_id
+            return (self.version, self.change_id)
+
+    def get_many(self, namespace, keys, fetch, state):
+        '''
+        Return {key: value} for the given keys, using fetch(keys) to compute the
+        ones that are not cached. state is what update returned before calling
+        this: fetched values are only kept if no changes have been seen since.
+        A namespace that is a tuple holds permissions on objects, and starts with
+        the name of their table; its keys are their uuids.
+        '''
+        with self.lock:
+            result = dict((key, self.values[(namespace, key)]) for key in keys if (namespace, key) in self.values)
+        missing = [key for key in set(keys) if key not in result]
+        if missing:
+            fetched = fetch(missing)
+            result.update(fetched)
+            with self.lock:
+                if state == (self.version, self.change_id):
+                    if len(self.values) + len(fetched) > self.max_entries:
+                        self.values = {}
+                        self.object_keys = {}
+                    for (key, value) in fetched.iteritems():
+                        self.values[(namespace, key)] = value
+                        if isinstance(namespace, tuple):
+                            self.object_keys.setdefault((namespace[0], key), set()).add((namespace, key))
+        return result
@@ -0,0 +1,39 @@
+'''
+RequestCache is an identity map that lives for the duration of one request
+(e.g., one RPC handled by BundleRPCServer; see BundleModel.request_cache), so
+that the bundles, worksheets, owner ids, group memberships and permissions that
+the different code paths of the request look up are fetched from the database
+only once.
+
+The cache is dropped as soon as the request writes to the database, so that
+the request always sees its own writes. It also counts the queries made during
+the request, which tests use to check the number of queries per RPC.
+'''
+
+
+class RequestCache(object):
+    def __init__(self):
+        # namespace -> {key: value}
+        self.values = {}
+        self.num_queries = 0
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.values = {}
+
+    def get_many(self, namespace, keys, fetch, default=None):
+        '''
+        Return {key: value} for the given keys. The keys that are not cached are
+        fetched all at once with fetch(keys), which returns {key: value}; the
+        keys it doesn't return get the default value.
+        '''
+        values = self.values.setdefault(namespace, {})
+        missing = [key for key in set(keys) if key not in values]
+        self.hits += len(set(keys)) - len(missing)
+        if missing:
+            self.misses += len(missing)
+            fetched = fetch(missing)
+            for key in missing:
+                values[key] = fetched.get(key, default)
+        return dict((key, values[key]) for key in keys)
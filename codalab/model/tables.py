@@ -10,6 +10,7 @@ from sqlalchemy import (
   UniqueConstraint,
 )
 from sqlalchemy.types import (
+  BigInteger,
   Integer,
   String,
   Text,
@@ -49,6 +50,31 @@ bundle_metadata = Table(
   sqlite_autoincrement=True,
 )
 
+# One row per bundle with the columns of bundle and the metadata that are
+# commonly searched and sorted on, with proper types and indexes (the metadata
+# values are stored as text). Kept in sync by save_bundle, update_bundle and
+# batch_update_bundles, and used by search_bundle_uuids.
+bundle_summary = Table(
+  'bundle_summary',
+  db_metadata,
+  Column('id', Integer, primary_key=True, nullable=False),
+  Column('bundle_uuid', String(63), ForeignKey(bundle.c.uuid), nullable=False),
+  Column('name', Text, nullable=True),
+  Column('created', Integer, nullable=True),  # Unix time
+  Column('data_size', BigInteger, nullable=True),
+  Column('time', Float, nullable=True),
+  Column('state', String(63), nullable=False),
+  Column('owner_id', String(255), nullable=True),
+  UniqueConstraint('bundle_uuid', name='uix_1'),
+  Index('bundle_summary_name_index', 'name', mysql_length=63),
+  Index('bundle_summary_created_index', 'created'),
+  Index('bundle_summary_data_size_index', 'data_size'),
+  Index('bundle_summary_time_index', 'time'),
+  Index('bundle_summary_state_created_index', 'state', 'created'),
+  Index('bundle_summary_owner_id_created_index', 'owner_id', 'created'),
+  sqlite_autoincrement=True,
+)
+
 # For each child_uuid, we have: key = child_path, target = (parent_uuid, parent_path)
 bundle_dependency = Table(
   'bundle_dependency',
@@ -73,6 +99,36 @@ bundle_action = Table(
   sqlite_autoincrement=True,
 )
 
+# Leases that workers hold on the bundles they are starting, running or
+# finalizing, so that several workers can share the bundle table. A lease that
+# isn't renewed before it expires can be taken over by another worker.
+bundle_lease = Table(
+  'bundle_lease',
+  db_metadata,
+  Column('id', Integer, primary_key=True, nullable=False),
+  # Deliberately omit ForeignKey(bundle.c.uuid), so that bundles can be deleted
+  # while they are leased.
+  Column('bundle_uuid', String(63), nullable=False),
+  Column('worker_id', String(255), nullable=False),
+  Column('expires', Float, nullable=False),  # Unix time
+  UniqueConstraint('bundle_uuid', name='uix_1'),
+  Index('bundle_lease_worker_id_index', 'worker_id'),
+  sqlite_autoincrement=True,
+)
+
+# Index of READY runs by fingerprint (see RunBundle.get_fingerprint), to reuse
+# their results for identical runs.
+run_fingerprint = Table(
+  'run_fingerprint',
+  db_metadata,
+  Column('id', Integer, primary_key=True, nullable=False),
+  Column('fingerprint', String(63), nullable=False),
+  Column('bundle_uuid', String(63), ForeignKey(bundle.c.uuid), nullable=False),
+  UniqueConstraint('fingerprint', name='uix_1'),
+  Index('run_fingerprint_bundle_uuid_index', 'bundle_uuid'),
+  sqlite_autoincrement=True,
+)
+
 # The worksheet table does not have many columns now, but it will eventually
 # include columns for owner, group, permissions, etc.
 worksheet = Table(
@@ -152,6 +208,7 @@ group_bundle_permission = Table(
   Column('object_uuid', String(63), ForeignKey(bundle.c.uuid), nullable=False),
   # Permissions encoded as integer (see below)
   Column('permission', Integer, nullable=False),
+  Index('group_bundle_permission_object_uuid_index', 'object_uuid'),
   sqlite_autoincrement=True,
 )
 
@@ -165,6 +222,28 @@ group_object_permission = Table(
   Column('object_uuid', String(63), ForeignKey(worksheet.c.uuid), nullable=False),
   # Permissions encoded as integer (see below)
   Column('permission', Integer, nullable=False),
+  Index('group_object_permission_object_uuid_index', 'object_uuid'),
+  sqlite_autoincrement=True,
+)
+
+# Single row with a number that is incremented whenever group memberships
+# change, so that the processes that cache effective permissions (see
+# PermissionCache) know when to drop them.
+permission_version = Table(
+  'permission_version',
+  db_metadata,
+  Column('id', Integer, primary_key=True, nullable=False),
+  Column('version', Integer, nullable=False),
+)
+
+# One row for each change to the permissions of an object, so that the
+# processes that cache effective permissions only drop the ones of that object.
+permission_change = Table(
+  'permission_change',
+  db_metadata,
+  Column('id', Integer, primary_key=True, nullable=False),
+  Column('object_table', String(63), nullable=False),  # Name of the permission table
+  Column('object_uuid', String(63), nullable=False),
   sqlite_autoincrement=True,
 )
 
@@ -128,8 +128,8 @@ class Bundle(ORMObject):
         pairs = self.get_dependency_paths(bundle_store, parent_dict, dest_path, relative_symlinks=not copy)
         for (target, link_path) in pairs:
             # If the dependency already exists, remove it (this happens when we are reinstalling)
-            if os.path.exists(link_path):
-                path_util.remove(link_path)
+            if os.path.lexists(link_path):
+                path_util.remove_materialized(link_path)
             # Either copy (but not follow further symlinks) or symlink.
             if copy:
                 path_util.copy(target, link_path, follow_symlinks=False)
@@ -144,5 +144,5 @@ class Bundle(ORMObject):
         pairs = self.get_dependency_paths(bundle_store, parent_dict, dest_path, relative_symlinks=False)
         for (target, link_path) in pairs:
             # If the dependency already exists, remove it (this happens when we are reinstalling)
-            if os.path.exists(link_path):
-                path_util.remove(link_path)
+            if os.path.lexists(link_path):
+                path_util.remove_materialized(link_path)
@@ -1,8 +1,49 @@
 '''
 Machine is a class that manages execution of bundle(s) that need to be run.
 '''
+import sys
+import time
+
+from codalab.common import UsageError
+from codalab.lib import path_util
 
 class Machine(object):
+    # Whether the machine calls the wakeup callback (see set_wakeup) whenever a
+    # bundle finishes. If not, the worker has to poll get_bundle_statuses.
+    NOTIFIES_ON_CHANGES = False
+    wakeup = None
+
+    def set_wakeup(self, wakeup):
+        '''
+        Set a function for the machine to call when the status of a bundle
+        changes, which wakes up the worker.
+        '''
+        self.wakeup = wakeup
+
+    @staticmethod
+    def get_staging_mode(config):
+        '''
+        Return the path_util.materialize mode used to stage dependencies, as set by
+        staging_mode in the worker config (default copy).
+        '''
+        staging_mode = config.get('staging_mode', 'copy')
+        if staging_mode not in path_util.MATERIALIZE_MODES:
+            raise UsageError('Unexpected staging mode: %s, expected one of %s' % (staging_mode, ', '.join(path_util.MATERIALIZE_MODES)))
+        return staging_mode
+
+    def stage_dependencies(self, bundle, bundle_store, parent_dict, temp_dir, staging_mode):
+        '''
+        Materialize the dependencies of the bundle in temp_dir.
+        Returns the staging metadata (staging_mode and staging_time).
+        '''
+        start_time = time.time()
+        pairs = bundle.get_dependency_paths(bundle_store, parent_dict, temp_dir)
+        print >>sys.stderr, '%s.start_bundle: staging (%s) dependencies of %s to %s' % (
+          self.__class__.__name__, staging_mode, bundle.uuid, temp_dir)
+        for (source, target) in pairs:
+            path_util.materialize(source, target, staging_mode)
+        return {'staging_mode': staging_mode, 'staging_time': time.time() - start_time}
+
     def start_bundle(self, bundle, bundle_store, parent_dict):
         '''
         Attempts to begin bundle execution.
@@ -5,12 +5,27 @@ It requires direct access to the bundle database and data store, and it
 provides a few methods once it is initialized:
   update_created_bundles: update bundles that are blocking on others.
   update_ready_bundles: run a single bundle in the ready state.
+
+Several workers can share the same database: each worker takes a lease on the
+bundles it starts (see BundleModel.acquire_bundle_lease), renews its leases
+from a heartbeat thread, and only finalizes the bundles it holds leases on.
+When a worker stops, its leases expire and another worker takes over its
+bundles (see Worker.reclaim_bundles).
+
+If it is given a WorkerNotifier, the worker waits for notifications from the
+server (when bundles are created or killed) and from the machine (when bundles
+finish) instead of polling every sleep_time seconds, and only polls every
+poll_interval seconds as a fallback.
 '''
 import contextlib
 import datetime
+from multiprocessing.pool import ThreadPool
+import Queue
 import random
+import socket
 import subprocess
 import sys
+import threading
 import time
 import tempfile
 import traceback
@@ -26,6 +41,8 @@ from codalab.lib import (
   canonicalize,
   path_util,
 )
+from codalab.lib.dependency_index import DependencyIndex
+from codalab.lib.scheduling import get_scheduling_policy
 from codalab.bundles.run_bundle import RunBundle
 from codalab.bundles.make_bundle import MakeBundle
 from codalab.machines import (
@@ -33,13 +50,32 @@ from codalab.machines import (
 )
 
 class Worker(object):
-    def __init__(self, bundle_store, model, machine, auth_handler):
+    LEASE_TIME = 120
+
+    def __init__(self, bundle_store, model, machine, auth_handler, notifier=None, scheduling_policy=None, worker_id=None, lease_time=LEASE_TIME, num_finalizers=2, memoize_runs=False):
         self.bundle_store = bundle_store
         self.model = model
         self.profiling_depth = 0
         self.verbose = 0
         self.machine = machine
         self.auth_handler = auth_handler  # In order to get names of owners
+        self.notifier = notifier
+        self.dependency_index = DependencyIndex(model)
+        # Same default as the worker config (see get_scheduling_policy).
+        self.scheduling_policy = scheduling_policy or get_scheduling_policy({})
+        # uuid -> time when the bundle was staged, for bundles that are STAGED
+        self.staged_times = {}
+        # Bundles are finalized in the background, by num_finalizers threads.
+        self.finalizer_pool = ThreadPool(num_finalizers)
+        self.finalizing = set()
+        self.finalized_queue = Queue.Queue()
+        # Called when a bundle is finalized, to wake up the main loop.
+        self.wakeup = None
+        # Identifies the leases of this worker (see BundleModel.acquire_bundle_lease).
+        self.worker_id = worker_id or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.lease_time = lease_time
+        # Whether runs reuse the results of identical READY runs (see memoize_bundles).
+        self.memoize_runs = memoize_runs
 
     def pretty_print(self, message):
         time_str = datetime.datetime.utcnow().isoformat()[:19].replace('T', ' ')
@@ -86,11 +122,13 @@ class Worker(object):
         parent_dict = {parent.uuid: parent for parent in parents}
         return parent_dict
 
-    def start_bundle(self, bundle):
+    def start_bundle(self, bundle, scheduling_metadata=None):
         '''
         Run the given bundle using an available Machine.
+        scheduling_metadata is recorded in the bundle's metadata if it starts.
         Return whether something was started.
         '''
+        scheduling_metadata = scheduling_metadata or {}
         # Check that we're running a bundle in the QUEUED state.
         state_message = 'Unexpected bundle state: %s' % (bundle.state,)
         precondition(bundle.state == State.QUEUED, state_message)
@@ -136,6 +174,7 @@ class Worker(object):
 
             # Update database
             if started:
+                status = dict(scheduling_metadata, **status)
                 self.update_running_bundle(status)
             return started
 
@@ -150,7 +189,7 @@ class Worker(object):
         For bundles that need to be killed, tell the machine to kill it.
         If unable to kill, still discard the action.
         '''
-        bundle_actions = self.model.pop_bundle_actions()
+        bundle_actions = self.model.pop_bundle_actions(self.worker_id)
         if self.verbose >= 2: print 'bundle_actions:', bundle_actions
         db_update = {}
         for x in bundle_actions:
@@ -172,18 +211,23 @@ class Worker(object):
 
     # Poll processes to see if bundles have finished running
     # Either way, update the bundle metadata.
+    # Return whether any bundle finished.
     def check_finished_bundles(self):
         statuses = self.machine.get_bundle_statuses()
+        self.reclaim_bundles(statuses)
+        # Only look at the bundles that this worker is responsible for, which are
+        # fetched all at once.
+        leased_uuids = self.model.get_leased_bundle_uuids(self.worker_id)
+        leased_bundles = self.model.batch_get_bundles(uuid=leased_uuids)
+        job_handle_bundles = dict(
+          (bundle.metadata.job_handle, bundle) for bundle in leased_bundles
+          if getattr(bundle.metadata, 'job_handle', None)
+        )
 
-        # Lookup the bundle given the uuid from the status
+        # Lookup the bundle given the job handle from the status
         new_statuses = []
         for status in statuses:
-            handle = status['job_handle']
-            # Note: should probably have a more specalized way of getting this.
-            uuids = self.model.search_bundle_uuids(worksheet_uuid=None, user_id=self.model.root_user_id, keywords=['job_handle='+handle])
-            if len(uuids) == 0:
-                continue
-            bundle = self._safe_get_bundle(uuids[0])
+            bundle = job_handle_bundles.get(status['job_handle'])
             if not bundle:
                 continue
             status['bundle'] = bundle
@@ -201,8 +245,8 @@ class Worker(object):
         # mentioned in statuses.  These are probably zombies, and we want to
         # get rid of them if they have been issued a kill action.
         status_bundle_uuids = set(status['bundle'].uuid for status in statuses)
-        running_bundles = self.model.batch_get_bundles(state=State.RUNNING)
-        for bundle in running_bundles:
+        for bundle in leased_bundles:
+            if bundle.state != State.RUNNING: continue
             if bundle.uuid in status_bundle_uuids: continue  # Exists, skip
             if Command.KILL not in getattr(bundle.metadata, 'actions', set()): continue  # Not killing
             status = {'state': State.FAILED, 'bundle': bundle}
@@ -210,12 +254,55 @@ class Worker(object):
             self.update_running_bundle(status)
 
         # Update the status of these bundles.
+        finished = False
         for status in statuses:
             bundle = status['bundle']
-            if bundle.state in [State.READY, State.FAILED]:  # Skip bundles that have already completed.
+            if bundle.state in [State.FINALIZING, State.READY, State.FAILED]:  # Skip bundles that have already completed.
                 continue
             print 'work_manager: %s (%s): %s' % (bundle.uuid, bundle.state, status)
             self.update_running_bundle(status)
+            if status.get('success') != None:
+                finished = True
+        return finished
+
+    def reclaim_bundles(self, statuses):
+        '''
+        Take over the QUEUED, RUNNING and FINALIZING bundles whose leases expired
+        (because their worker stopped). Bundles that weren't started yet are
+        staged again. Bundles that were started are adopted if this worker's
+        machine knows about their job, and failed otherwise. Finalization is
+        started over.
+        '''
+        orphan_states = self.model.get_unleased_bundle_states([State.QUEUED, State.RUNNING, State.FINALIZING])
+        if not orphan_states:
+            return
+        job_handles = set(status['job_handle'] for status in statuses)
+        for bundle in self.model.batch_get_bundles(uuid=orphan_states.keys()):
+            if not self.model.acquire_bundle_lease(bundle.uuid, self.worker_id, self.lease_time):
+                continue
+            job_handle = getattr(bundle.metadata, 'job_handle', None)
+            if bundle.state == State.FINALIZING:
+                self.pretty_print('Resuming finalization of %s' % bundle.uuid)
+                if isinstance(bundle, RunBundle):
+                    self.machine.finalize_bundle(bundle)
+                success = getattr(bundle.metadata, 'final_state', None) == State.READY
+                self.start_finalizing(bundle, success)
+                continue
+            elif bundle.state not in (State.QUEUED, State.RUNNING):
+                # Finished in the meantime.
+                pass
+            elif job_handle in job_handles:
+                self.pretty_print('Adopting %s, which was started by another worker' % bundle.uuid)
+                continue
+            elif job_handle is None:
+                self.pretty_print('Restaging %s, which was left %s' % (bundle.uuid, bundle.state.upper()))
+                self.update_bundle_states([bundle], State.STAGED)
+            else:
+                self.pretty_print('Failing %s, whose worker stopped' % bundle.uuid)
+                update = {'state': State.FAILED, 'metadata': {'failure_message': 'Lost track of the job when its worker stopped'}}
+                self.model.update_bundle(bundle, update)
+                self.dependency_index.update_state(bundle.uuid, State.FAILED)
+            self.model.release_bundle_lease(bundle.uuid, self.worker_id)
 
     def update_running_bundle(self, status):
         '''
@@ -245,21 +332,74 @@ class Worker(object):
         # See if the bundle is completed.
         success = status.get('success')
         if success != None:
+            # Clean up any state for RunBundles.
+            if isinstance(bundle, RunBundle):
+                try:
+                    self.machine.finalize_bundle(bundle)
+                except Exception as e:
+                    success = False
+                    if 'failure_message' not in metadata:
+                        metadata['failure_message'] = e.message
+                    else:
+                        metadata['failure_message'] += '\n' + e.message
+            # Install the results in the background (see _finalize_bundle). The
+            # outcome is recorded first, so that another worker can finish the
+            # job if this one stops.
+            db_update['state'] = State.FINALIZING
+            metadata['final_state'] = State.READY if success else State.FAILED
+            self.model.update_bundle(bundle, db_update)
+            self.start_finalizing(bundle, success, status.get('temp_dir'))
+            return
+
+        # Update database!
+        self.model.update_bundle(bundle, db_update)
+        if 'state' in db_update:
+            self.dependency_index.update_state(bundle.uuid, db_update['state'])
+            if db_update['state'] in State.FINAL_STATES:
+                self.model.release_bundle_lease(bundle.uuid, self.worker_id)
+
+    def start_finalizing(self, bundle, success, temp_dir=None):
+        '''
+        Install the results of the FINALIZING bundle in the bundle store, using
+        the finalizer pool.
+        '''
+        if not temp_dir:
+            temp_dir = getattr(bundle.metadata, 'temp_dir', None) or \
+                       canonicalize.get_current_location(self.bundle_store, bundle.uuid)
+        self.finalizing.add(bundle.uuid)
+        self.pretty_print('Finalizing %s (%d bundles finalizing)' % (bundle.uuid, len(self.finalizing)))
+        self.finalizer_pool.apply_async(self._finalize_bundle, (bundle, success, temp_dir))
+
+    def _finalize_bundle(self, bundle, success, temp_dir):
+        '''
+        Move the FINALIZING bundle to READY or FAILED once its results are in the
+        bundle store. Runs in the finalizer pool, and reports the new state to
+        the main loop through finalized_queue (see collect_finalized_bundles).
+        '''
+        state = State.FAILED
+        try:
+            start_time = time.time()
+            db_update = {}
+            db_update['metadata'] = metadata = {}
             # Re-install dependencies.
             # - For RunBundle, remove the dependencies.
             # - For MakeBundle, copy.  This way, we maintain the invariant that
             # we always only need to look back one-level at the dependencies,
             # not recurse.
+            parent_dict = {}
             try:
-                temp_dir = status.get('temp_dir')
-                if not temp_dir:
-                    temp_dir = bundle.metadata.temp_dir
+                # Finalizing again (see reclaim_bundles) is fine, unless an
+                # earlier attempt stopped right after moving the results to the
+                # bundle store. Those are removed by BundleStore.full_cleanup.
+                if not os.path.isdir(temp_dir):
+                    raise IOError('Results missing from %s (lost while finalizing)' % temp_dir)
+                parent_dict = self.get_parent_dict(bundle)
                 if isinstance(bundle, RunBundle):
                     print >>sys.stderr, 'Worker.finalize_bundle: removing dependencies from %s (RunBundle)' % temp_dir
-                    bundle.remove_dependencies(self.bundle_store, self.get_parent_dict(bundle), temp_dir)
+                    bundle.remove_dependencies(self.bundle_store, parent_dict, temp_dir)
                 else:
                     print >>sys.stderr, 'Worker.finalize_bundle: installing (copying) dependencies to %s (MakeBundle)' % temp_dir
-                    bundle.install_dependencies(self.bundle_store, self.get_parent_dict(bundle), temp_dir, copy=True)
+                    bundle.install_dependencies(self.bundle_store, parent_dict, temp_dir, copy=True)
 
                 # Note: uploading will move temp_dir to the bundle store.
                 data_hash, new_metadata = self.bundle_store.upload(temp_dir, follow_symlinks=False, exclude_patterns=[])
@@ -271,82 +411,143 @@ class Worker(object):
                 success = False
                 metadata['failure_message'] = 'Internal error: ' + e.message
 
-            # Clean up any state for RunBundles.
-            if isinstance(bundle, RunBundle):
-                try:
-                    self.machine.finalize_bundle(bundle)
-                except Exception as e:
-                    success = False
-                    if 'failure_message' not in metadata:
-                        metadata['failure_message'] = e.message
-                    else:
-                        metadata['failure_message'] += '\n' + e.message
-
             state = State.READY if success else State.FAILED
             db_update['state'] = state
-            print '-- END BUNDLE: %s [%s]' % (bundle, state)
+            print '-- END BUNDLE: %s [%s] (finalized in %0.2fs)' % (bundle, state, time.time() - start_time)
             print ''
             self._update_events_log('finalize_bundle', bundle, (bundle.uuid, state, metadata))
+            self.model.update_bundle(bundle, db_update)
+            self.model.release_bundle_lease(bundle.uuid, self.worker_id)
+            if state == State.READY and isinstance(bundle, RunBundle):
+                self.record_fingerprint(bundle, parent_dict)
+        except Exception as e:
+            print '=== INTERNAL ERROR: %s' % e
+            traceback.print_exc()
+            try:
+                state = State.FAILED
+                self.model.update_bundle(bundle, {'state': state, 'metadata': {'failure_message': 'Internal error: ' + e.message}})
+                self.model.release_bundle_lease(bundle.uuid, self.worker_id)
+            except Exception as e:
+                # Leave the bundle FINALIZING.
+                print '=== INTERNAL ERROR: %s' % e
+                state = None
+        self.finalized_queue.put((bundle.uuid, state))
+        if self.wakeup:
+            self.wakeup()
 
-        # Update database!
-        self.model.update_bundle(bundle, db_update)
+    def record_fingerprint(self, bundle, parent_dict):
+        '''
+        Index the READY run by its fingerprint, so that identical runs can reuse
+        its results.  This is done even if memoize_runs is off, so that the index
+        is complete when it is turned on.
+        '''
+        try:
+            fingerprint = bundle.get_fingerprint(parent_dict)
+            if fingerprint:
+                self.model.add_run_fingerprint(fingerprint, bundle.uuid)
+        except Exception as e:
+            # The bundle is fine, it just can't be reused.
+            print '=== INTERNAL ERROR: %s' % e
+            traceback.print_exc()
+
+    def collect_finalized_bundles(self):
+        '''
+        Record the bundles that the finalizer pool is done with.
+        Return whether there were any.
+        '''
+        collected = False
+        while True:
+            try:
+                (uuid, state) = self.finalized_queue.get_nowait()
+            except Queue.Empty:
+                return collected
+            collected = True
+            self.finalizing.discard(uuid)
+            if state:
+                self.dependency_index.update_state(uuid, state)
 
     def update_created_bundles(self):
         '''
-        Scan through CREATED bundles check their dependencies' statuses.
+        Check the CREATED bundles whose parents changed state (see
+        DependencyIndex).
         If any parent is FAILED, move them to FAILED.
         If all parents are READY, move them to STAGED.
         Return whether something happened
         '''
         #print '-- Updating CREATED bundles! --'
-        with self.profile('Getting CREATED bundles...'):
-            bundles = self.model.batch_get_bundles(state=State.CREATED)
-            if self.verbose >= 1 and len(bundles) > 0:
-                self.pretty_print('Updating %s created bundles.' % (len(bundles),))
-        parent_uuids = set(
-          dep.parent_uuid for bundle in bundles for dep in bundle.dependencies
-        )
-
-        with self.profile('Getting parents...'):
-            parents = self.model.batch_get_bundles(uuid=parent_uuids)
-        all_parent_states = {parent.uuid: parent.state for parent in parents}
-        all_parent_uuids = set(all_parent_states)
+        with self.profile('Syncing dependency index...'):
+            self.dependency_index.sync()
         bundles_to_fail = []
         bundles_to_stage = []
-        for bundle in bundles:
-            parent_uuids = set(dep.parent_uuid for dep in bundle.dependencies)
-            missing_uuids = parent_uuids - all_parent_uuids
-            # If uuid doesn't exist, then don't process this bundle yet (the dependency might show up later)
-            if missing_uuids: continue
-            parent_states = {uuid: all_parent_states[uuid] for uuid in parent_uuids}
-            failed_uuids = [
-              uuid for (uuid, state) in parent_states.iteritems()
-              if state == State.FAILED
-            ]
-            if failed_uuids:
-                bundles_to_fail.append(
-                  (bundle, 'Parent bundles failed: %s' % (', '.join(failed_uuids),)))
-            elif all(state == State.READY for state in parent_states.itervalues()):
-                bundles_to_stage.append(bundle)
-
-        with self.profile('Failing %s bundles...' % (len(bundles_to_fail),)):
-            for (bundle, failure_message) in bundles_to_fail:
-                metadata_update = {'failure_message': failure_message}
-                update = {'state': State.FAILED, 'metadata': metadata_update}
-                self.model.update_bundle(bundle, update)
-        self.update_bundle_states(bundles_to_stage, State.STAGED)
+        # Failing a bundle resolves its own children, so repeat until nothing changes.
+        resolved = self.dependency_index.pop_resolved()
+        while resolved:
+            with self.profile('Getting CREATED bundles...'):
+                bundles = self.model.batch_get_bundles(uuid=resolved.keys(), state=State.CREATED)
+                if self.verbose >= 1 and len(bundles) > 0:
+                    self.pretty_print('Updating %s created bundles.' % (len(bundles),))
+            ready_bundles = []
+            with self.profile('Failing bundles...'):
+                for bundle in bundles:
+                    failed_uuids = resolved[bundle.uuid]
+                    if not failed_uuids:
+                        ready_bundles.append(bundle)
+                        continue
+                    failure_message = 'Parent bundles failed: %s' % (', '.join(failed_uuids),)
+                    metadata_update = {'failure_message': failure_message}
+                    update = {'state': State.FAILED, 'metadata': metadata_update}
+                    self.model.update_bundle(bundle, update)
+                    self.dependency_index.update_state(bundle.uuid, State.FAILED)
+                    bundles_to_fail.append(bundle)
+            if self.memoize_runs:
+                with self.profile('Memoizing bundles...'):
+                    ready_bundles = self.memoize_bundles(ready_bundles)
+            bundles_to_stage.extend(ready_bundles)
+            resolved = self.dependency_index.pop_resolved()
+        if self.update_bundle_states(bundles_to_stage, State.STAGED):
+            now = time.time()
+            for bundle in bundles_to_stage:
+                self.staged_times[bundle.uuid] = now
+        else:
+            # Try again on the next iteration with the bundles that are still
+            # CREATED (the others were processed elsewhere).
+            self.dependency_index.restore_resolved(dict((bundle.uuid, []) for bundle in bundles_to_stage))
         num_processed = len(bundles_to_fail) + len(bundles_to_stage)
-        num_blocking  = len(bundles) - num_processed
+        num_blocking = len(self.dependency_index.waiting)
         if num_processed > 0:
             self.pretty_print('%s CREATED bundles => %s STAGED, %s FAILED; %s bundles still waiting on dependencies.' % \
                 (num_processed, len(bundles_to_stage), len(bundles_to_fail), num_blocking,))
             return True
         return False
 
+    def memoize_bundles(self, bundles):
+        '''
+        Give the run bundles that are identical to a READY run (see
+        RunBundle.get_fingerprint) its results, and move them to READY.
+        Return the other bundles.
+        '''
+        parent_uuids = set(dep.parent_uuid for bundle in bundles for dep in bundle.dependencies)
+        parents = self.model.batch_get_bundles(uuid=parent_uuids) if parent_uuids else []
+        parent_dict = dict((parent.uuid, parent) for parent in parents)
+        remaining_bundles = []
+        for bundle in bundles:
+            source = None
+            if isinstance(bundle, RunBundle):
+                fingerprint = bundle.get_fingerprint(parent_dict)
+                source = fingerprint and self.model.get_memoized_run(fingerprint)
+            if not source:
+                remaining_bundles.append(bundle)
+                continue
+            self.model.update_bundle(bundle, bundle.get_memoized_update(source))
+            self.dependency_index.update_state(bundle.uuid, State.READY)
+            self.pretty_print('Reused the results of %s for %s' % (source.uuid, bundle.uuid))
+        return remaining_bundles
+
     def update_staged_bundles(self):
         '''
-        If there are any STAGED bundles, pick one and try to lock it.
-        If we get a lock, move the locked bundle to QUEUED.
+        Offer the STAGED bundles to the machine, in the order given by the
+        scheduling policy, until it can't start one. Lock each bundle by moving
+        it to QUEUED before starting it.
         The status will be changed to RUNNING later.
         '''
         #print '-- Updating STAGED bundles! --'
@@ -354,43 +555,98 @@ class Worker(object):
             bundles = self.model.batch_get_bundles(state=State.STAGED)
             if self.verbose >= 1 and len(bundles) > 0:
                 self.pretty_print('Staging %s bundles.' % (len(bundles),))
+        if not bundles:
+            return False
+        # Bundles staged before the worker started are counted from when it first saw them.
+        now = time.time()
+        self.staged_times = dict((bundle.uuid, self.staged_times.get(bundle.uuid, now)) for bundle in bundles)
+        wait_times = dict((uuid, now - staged_time) for (uuid, staged_time) in self.staged_times.iteritems())
+        running_counts = self.model.get_owner_bundle_counts([State.QUEUED, State.RUNNING])
         new_running_bundles = 0
-        for bundle in bundles:
+        for (bundle, score) in self.scheduling_policy.order(bundles, running_counts, wait_times):
+            # Claim the bundle, in case other workers are trying to start it.
+            if not self.model.acquire_bundle_lease(bundle.uuid, self.worker_id, self.lease_time):
+                continue
             if not self.update_bundle_states([bundle], State.QUEUED):
                 self.pretty_print('WARNING: Bundle running, but state failed to update')
+                self.model.release_bundle_lease(bundle.uuid, self.worker_id)
+                continue
+            scheduling_metadata = {'queue_wait': wait_times[bundle.uuid], 'scheduling_priority': score}
+            if self.start_bundle(bundle, scheduling_metadata):
+                new_running_bundles += 1
+                del self.staged_times[bundle.uuid]
             else:
-                if self.start_bundle(bundle):
-                    new_running_bundles += 1
-                else:
-                    # Restage: undo state change to RUNNING
-                    self.update_bundle_states([bundle], State.STAGED)
-        else:
-            if self.verbose >= 2: self.pretty_print('Failed to lock a bundle!')
+                # Restage: undo state change to QUEUED
+                self.update_bundle_states([bundle], State.STAGED)
+                self.model.release_bundle_lease(bundle.uuid, self.worker_id)
+                # Don't let the bundles after this one jump ahead of it.
+                break
         return new_running_bundles > 0
 
-    def run_loop(self, num_iterations, sleep_time):
+    def run_loop(self, num_iterations, sleep_time, poll_interval=60):
         '''
         Repeat forever (if iterations != None) or for a finite number of iterations.
         Moves created bundles to staged and actually executes the staged bundles.
+        When nothing happens, wait sleep_time seconds, or, if the worker is
+        notified of changes, until the next notification (at most poll_interval
+        seconds).
         '''
-        self.pretty_print('Running worker loop (num_iterations = %s, sleep_time = %s)' % (num_iterations, sleep_time))
+        listening = self.notifier is not None and self.notifier.listen()
+        if listening:
+            self.machine.set_wakeup(self.notifier.notify)
+            self.wakeup = self.notifier.notify
+            # Bundles running on machines that don't notify have to be polled.
+            wait_time = poll_interval if self.machine.NOTIFIES_ON_CHANGES else sleep_time
+            self.pretty_print('Running worker loop (num_iterations = %s, listening on %s, poll_interval = %s)' % (num_iterations, self.notifier.path, wait_time))
+        else:
+            self.pretty_print('Running worker loop (num_iterations = %s, sleep_time = %s)' % (num_iterations, sleep_time))
+        self.pretty_print('Worker id: %s (leases last %s seconds)' % (self.worker_id, self.lease_time))
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stop_heartbeat,))
+        heartbeat.daemon = True
+        heartbeat.start()
         iteration = 0
-        while not num_iterations or iteration < num_iterations:
-            # Check to see if any bundles should be killed
-            bool_killed = self.check_killed_bundles()
-            # Try to stage bundles
-            self.update_created_bundles()
-            # Try to run bundles with Ready parents
-            bool_run = self.update_staged_bundles()
-            # Check to see if any bundles are done running
-            bool_done = self.check_finished_bundles()
-
-            # Sleep only if nothing happened.
-            if not (bool_killed or bool_run or bool_done):
-                time.sleep(sleep_time)
-            else:
-                # Advance counter only if something interesting happened
-                iteration += 1
+        try:
+            while not num_iterations or iteration < num_iterations:
+                # Check to see if any bundles should be killed
+                bool_killed = self.check_killed_bundles()
+                # Try to stage bundles
+                self.update_created_bundles()
+                # Try to run bundles with Ready parents
+                bool_run = self.update_staged_bundles()
+                # Check to see if any bundles are done running
+                bool_done = self.check_finished_bundles()
+                bool_done = self.collect_finalized_bundles() or bool_done
+
+                # Wait only if nothing happened.
+                if not (bool_killed or bool_run or bool_done):
+                    if listening:
+                        self.notifier.wait(wait_time)
+                    else:
+                        time.sleep(sleep_time)
+                else:
+                    # Advance counter only if something interesting happened
+                    iteration += 1
+        finally:
+            # Let the bundles being finalized finish.
+            self.finalizer_pool.close()
+            self.finalizer_pool.join()
+            stop_heartbeat.set()
+            if listening:
+                self.machine.set_wakeup(None)
+                self.wakeup = None
+                self.notifier.close()
+
+    def _heartbeat(self, stop):
+        '''
+        Renew the leases of this worker until stop is set, so that they only
+        expire if the worker stops.
+        '''
+        while not stop.wait(self.lease_time / 3.0):
+            try:
+                self.model.renew_bundle_leases(self.worker_id, self.lease_time)
+            except Exception as e:
+                print '=== INTERNAL ERROR: unable to renew leases: %s' % e
 
     def _update_events_log(self, command, bundle, args):
       self.model.update_events_log(
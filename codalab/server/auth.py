@@ -1,7 +1,9 @@
 '''
 AuthHandler encapsulates the logic to authenticate users on the server-side.
 '''
+import collections
 import json
+import threading
 import time
 import urllib
 import urllib2
@@ -9,6 +11,47 @@ from base64 import encodestring
 
 from codalab.common import UsageError, PermissionError
 
+# Returned by TTLCache.get for keys that are not cached, since None is cached
+# for tokens and users that don't exist.
+_MISSING = object()
+
+
+class TTLCache(object):
+    '''
+    Thread-safe map whose entries expire ttl seconds after they are set. When
+    it holds more than max_entries entries, the oldest ones are evicted.
+    '''
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()  # key -> (expires_at, value), oldest first
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.time():
+                del self.entries[key]
+                return default
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        '''
+        Set the value of key, which expires in ttl seconds (self.ttl by default).
+        '''
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
 class User(object):
     '''
     Defines a registered user with a unique name and a unique (int) identifier.
@@ -49,6 +92,8 @@ class MockAuthHandler(object):
         '''
         return True
 
+    def invalidate_token(self, token):
+        pass
 
     def get_users(self, key_type, keys):
         '''
@@ -77,13 +122,21 @@ class MockAuthHandler(object):
 class OAuthHandler(object):
     '''
     Handles user authentication with an OAuth authorization server.
+
+    The users of validated tokens and the users looked up by get_users are
+    cached for cache_ttl seconds, so that most requests don't wait for the
+    authorization server. Tokens and users that don't exist are cached too,
+    for negative_cache_ttl seconds.
     '''
-    def __init__(self, address, app_id, app_key):
+    def __init__(self, address, app_id, app_key, cache_ttl=60, negative_cache_ttl=10, cache_size=10000):
         '''
         address: the address of the OAuth authorization server
                  (e.g. https://www.codalab.org).
         app_id: OAuth application identifier.
         app_key: OAuth application key.
+        cache_ttl, negative_cache_ttl: how long (in seconds) to cache the users
+                 that exist and the ones that don't.
+        cache_size: maximum number of tokens and of users to cache.
         '''
         self._address = address
         self._app_id = app_id
@@ -93,6 +146,9 @@ class OAuthHandler(object):
         self._user = None
         self._access_token = None
         self._expires_at = 0.0
+        self._negative_cache_ttl = negative_cache_ttl
+        self._token_cache = TTLCache(cache_ttl, cache_size)  # token -> User or None
+        self._user_cache = TTLCache(cache_ttl, cache_size)  # (key_type, key) -> User or None
 
     def _get_token_url(self):
         return "{0}/clients/token/".format(self._address)
@@ -190,21 +246,33 @@ class OAuthHandler(object):
         if len(token) <= 0:
             return False
 
-        if self._access_token is None or self._expires_at < time.time():
-            self._generate_app_token()
-        headers = {'Authorization': 'Bearer {0}'.format(self._access_token)}
-        data = [('token', token)]
-        request = urllib2.Request(self._get_validation_url(), urllib.urlencode(data, True), headers)
-        response = urllib2.urlopen(request)
-        result = json.load(response)
-        status_code = result['code'] if 'code' in result else 500
-        if status_code == 200:
-            self._user = User(result['user']['name'], str(result['user']['id']))
-            return True
-        elif status_code == 403 or status_code == 404:
-            return False # 'User credentials are not valid'
-        else:
-            return False # 'The token translation failed.'
+        user = self._token_cache.get(token, _MISSING)
+        if user is _MISSING:
+            if self._access_token is None or self._expires_at < time.time():
+                self._generate_app_token()
+            headers = {'Authorization': 'Bearer {0}'.format(self._access_token)}
+            data = [('token', token)]
+            request = urllib2.Request(self._get_validation_url(), urllib.urlencode(data, True), headers)
+            response = urllib2.urlopen(request)
+            result = json.load(response)
+            status_code = result['code'] if 'code' in result else 500
+            if status_code == 200:
+                user = User(result['user']['name'], str(result['user']['id']))
+                self._token_cache.set(token, user)
+            elif status_code == 403 or status_code == 404:
+                # 'User credentials are not valid'
+                self._token_cache.set(token, None, self._negative_cache_ttl)
+                return False
+            else:
+                return False # 'The token translation failed.'
+        self._user = user
+        return user is not None
+
+    def invalidate_token(self, token):
+        '''
+        Forget the cached validation of the given token (e.g., on logout).
+        '''
+        self._token_cache.delete(token)
 
     def get_users(self, key_type, keys):
         '''
@@ -221,6 +289,35 @@ class OAuthHandler(object):
         '''
         if key_type not in ('names', 'ids'):
             raise ValueError('Invalid key_type')
+        users = {}
+        missing_keys = []
+        for key in keys:
+            user = self._user_cache.get((key_type, key), _MISSING)
+            if user is _MISSING:
+                missing_keys.append(key)
+            else:
+                users[key] = user
+        if not missing_keys:
+            return users
+
+        user_dict = self._fetch_users(key_type, missing_keys)
+        if user_dict is None:
+            return None
+        for key in missing_keys:
+            user = users[key] = user_dict.get(str(key))
+            if user is None:
+                self._user_cache.set((key_type, key), None, self._negative_cache_ttl)
+            else:
+                # Cache the user under both its id and its name.
+                self._user_cache.set(('ids', str(user.unique_id)), user)
+                self._user_cache.set(('names', user.name), user)
+        return users
+
+    def _fetch_users(self, key_type, keys):
+        '''
+        Ask the authorization server for the users, as in get_users.
+        Return None if the request fails.
+        '''
         if self._access_token is None or self._expires_at < time.time():
             self._generate_app_token()
         headers = {'Authorization': 'Bearer {0}'.format(self._access_token)}
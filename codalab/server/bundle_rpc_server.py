@@ -8,12 +8,19 @@ in RemoteBundleClient.CLIENT_COMMANDS) are simply passed to the internal client.
 Other methods, like upload and cat, are more complicated because they perform
 filesystem operations. BundleRPCServer supports variants of these methods:
   upload_bundle_zip: used to implement RemoteBundleClient.upload
+  open_upload_archive, upload_bundle_archive: used to implement
+    RemoteBundleClient.upload and copy_bundle
   open_target: used to implement RemoteBundleClient.cat
+  open_target_archive: used to implement RemoteBundleClient.download_target
 
-Important: each call to open_temp_file, open_target, open_target_zip should
-have a matching call to finalize_file.
+Important: each call to open_temp_file, open_target, open_target_zip and
+open_target_archive should have a matching call to finalize_file, and each call
+to open_upload_archive should have a matching call to upload_bundle_archive (or
+finalize_file, to abandon the upload). Uploads that are never finished are
+discarded after UPLOAD_EXPIRATION seconds.
 '''
 import tempfile
+import threading
 import traceback
 import os
 import time
@@ -25,16 +32,23 @@ from codalab.common import (
     PermissionError,
 )
 from codalab.client.remote_bundle_client import RemoteBundleClient
-from codalab.lib import zip_util, path_util
+from codalab.lib import file_util, zip_util, path_util
+from codalab.lib.archive_cache import ArchiveStream
 from codalab.server.file_server import FileServer
 
 class BundleRPCServer(FileServer):
+    # Streams opened by open_upload_archive that aren't passed to
+    # upload_bundle_archive within this many seconds are discarded.
+    UPLOAD_EXPIRATION = 24 * 60 * 60
+
     def __init__(self, manager):
         self.host = manager.config['server']['host']
         self.port = manager.config['server']['port']
         self.verbose = manager.config['server']['verbose']
         # This server is backed by a LocalBundleClient that processes client commands
         self.client = manager.client('local', is_cli=False)
+        # Archives generated by open_target_archive are cached here (if not None).
+        self.archive_cache = manager.archive_cache()
 
         # args might be a large object; summarize it (e.g., take prefixes of lists)
         def compress_args(args):
@@ -52,6 +66,8 @@ class BundleRPCServer(FileServer):
                 return dict((compress_args(k), compress_args(v)) for k, v in args.items())
             return args
 
+        # Extraction state of the streams opened by open_upload_archive, by file uuid.
+        self.uploads = {}
         tempdir = tempfile.gettempdir()  # Consider using CodaLab's temp directory
         FileServer.__init__(self, (self.host, self.port), tempdir, manager.auth_handler())
         def wrap(command, func):
@@ -64,7 +80,9 @@ class BundleRPCServer(FileServer):
                     print "bundle_rpc_server: %s %s" % (command, log_args)
                 try:
                     start_time = time.time()
-                    result = func(*args, **kwargs)
+                    # Share the bundles, worksheets and permissions read while handling this call.
+                    with self.client.model.request_cache():
+                        result = func(*args, **kwargs)
                     # Log this activity.
                     self.client.model.update_events_log(
                         start_time=start_time,
@@ -121,6 +139,89 @@ class BundleRPCServer(FileServer):
             self.finalize_file(file_uuid, final_path != orig_path)  # Remove temporary file
         return result
 
+    def open_upload_archive(self):
+        '''
+        Open a stream for writing a tar archive of one file/directory (as
+        generated by zip_util.tar_stream) and return a file uuid identifying it.
+        The archive is extracted into a temporary directory as it is written, and
+        files are hashed as they are extracted. Once the stream is closed, pass
+        the file uuid to upload_bundle_archive.
+        '''
+        self.expire_uploads()
+        (read_fd, write_fd) = os.pipe()
+        upload = {
+          'container_path': tempfile.mkdtemp(),  # In the bundle store's temp directory
+          'contents_hashes': {},
+          'error': None,
+          'open_time': time.time(),
+        }
+        def extract():
+            with os.fdopen(read_fd, 'rb') as source:
+                try:
+                    zip_util.untar(source, upload['container_path'], None, upload['contents_hashes'])
+                    # Consume any padding after the end of the archive, so that the
+                    # writer doesn't fail.
+                    while source.read(file_util.BUFFER_SIZE):
+                        pass
+                except Exception, e:
+                    # Stop reading: writes to the stream fail from now on, and
+                    # upload_bundle_archive reports the error.
+                    upload['error'] = e
+        upload['thread'] = threading.Thread(target=extract)
+        upload['thread'].daemon = True
+        upload['thread'].start()
+        # Unbuffered, so that closing the stream doesn't fail if extraction stopped.
+        file_uuid = self.open_stream(os.fdopen(write_fd, 'wb', 0))
+        self.uploads[file_uuid] = upload
+        return file_uuid
+
+    def upload_bundle_archive(self, file_uuid, construct_args, worksheet_uuid, follow_symlinks, add_to_worksheet):
+        '''
+        |file_uuid| specifies a stream returned by open_upload_archive, whose
+        contents are uploaded as a bundle once they are extracted. The extracted
+        files are moved into the bundle store without being copied or read again.
+        Return the new bundle's uuid.
+        '''
+        upload = self.uploads.pop(file_uuid, None)
+        if not upload:
+            raise UsageError('Unknown upload %s (uploads expire after %d seconds)' % (file_uuid, self.UPLOAD_EXPIRATION))
+        self.finalize_file(file_uuid, False)  # Signal the end of the archive
+        upload['thread'].join()
+        container_path = upload['container_path']
+        try:
+            if upload['error']:
+                raise upload['error']
+            sub_files = os.listdir(container_path)
+            if len(sub_files) != 1:
+                raise UsageError('Archive should contain exactly one file or directory')
+            final_path = os.path.join(container_path, sub_files[0])
+            return self.client.upload_bundle(final_path, construct_args, worksheet_uuid, follow_symlinks, exclude_patterns=[], add_to_worksheet=add_to_worksheet, contents_hashes=upload['contents_hashes'])
+        finally:
+            path_util.remove(container_path)  # Remove temporary directory
+
+    def finalize_file(self, file_uuid, delete):
+        '''
+        Like FileServer.finalize_file, but also discard the extracted files of a
+        stream opened by open_upload_archive, which won't be uploaded anymore.
+        '''
+        FileServer.finalize_file(self, file_uuid, delete)
+        upload = self.uploads.pop(file_uuid, None)
+        if upload:
+            # Closing the stream ends the extraction.
+            upload['thread'].join()
+            path_util.remove(upload['container_path'])
+
+    def expire_uploads(self):
+        '''
+        Discard the streams opened by open_upload_archive more than
+        UPLOAD_EXPIRATION seconds ago, whose clients must have gone away.
+        '''
+        expiration_time = time.time() - self.UPLOAD_EXPIRATION
+        for (file_uuid, upload) in self.uploads.items():
+            if upload['open_time'] < expiration_time and file_uuid in self.uploads:
+                print 'bundle_rpc_server: discarding abandoned upload %s' % file_uuid
+                self.finalize_file(file_uuid, False)
+
     def open_target(self, target):
         '''
         Open a read-only file handle to the given bundle target and return a file
@@ -139,6 +240,26 @@ class BundleRPCServer(FileServer):
         zip_path = zip_util.zip(path, follow_symlinks=follow_symlinks, exclude_patterns=[], file_name=name)  # Create temporary zip file
         return self.open_file(zip_path), name
 
+    def open_target_archive(self, target, follow_symlinks):
+        '''
+        Return a file uuid for a tar archive of the given target, and the name
+        that the archive contains. The archive is generated from the bundle
+        location as it is read, unless it is in the archive cache. Either way,
+        the file can be seeked forward, so interrupted downloads can resume.
+        '''
+        bundle_uuid = target[0]
+        path = self.client.get_target_path(target)
+        info = self.client.get_bundle_info(bundle_uuid)
+        name = info['metadata']['name']
+        generate = lambda: zip_util.tar_stream(path, follow_symlinks=follow_symlinks, exclude_patterns=[], file_name=name)
+        # Bundles without a data hash (for example, running ones) can still change.
+        if self.archive_cache is None or not info['data_hash']:
+            archive = ArchiveStream(generate())
+        else:
+            key = self.archive_cache.get_key(bundle_uuid, info['data_hash'], target[1], name, follow_symlinks)
+            archive = self.archive_cache.open(key, generate)
+        return self.open_stream(archive), name
+
     def serve_forever(self):
         print 'BundleRPCServer serving to %s at port %s...' % ('ALL hosts' if self.host == '' else 'host ' + self.host, self.port)
         FileServer.serve_forever(self)
@@ -10,8 +10,16 @@ all return a file uuid, which is like a Unix file descriptor.
 The other RPC methods on this server are read_file, write_file, and close_file.
 These methods take a file uuid in addition to their regular arguments, and they
 perform the requested operation on the file handle corresponding to that uuid.
+
+File uuids can also be read and written in bulk over plain HTTP, without the
+base64 and XML encoding of read_file and write_file:
+  GET /file/<file uuid>[?num_bytes=<n>]: like read_file; the response is chunked.
+    A Range header seeks to the start of the range first.
+  PUT /file/<file uuid>: like write_file, with the data as the request body.
 '''
 import os
+import re
+import urlparse
 from SimpleXMLRPCServer import (
     SimpleXMLRPCServer,
     SimpleXMLRPCRequestHandler,
@@ -30,24 +38,127 @@ from codalab.lib import (
 class AuthenticatedXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
     """
     Simple XML-RPC request handler class which also reads authentication
-    information included in HTTP headers.
+    information included in HTTP headers, and serves the raw file transfer
+    requests described above.
     """
+    # Needed for chunked responses, and lets clients reuse connections.
+    protocol_version = 'HTTP/1.1'
+    FILE_PATH_PREFIX = '/file/'
+    # Size of the pieces in which raw file transfers are read and written.
+    CHUNK_SIZE = 256 * 1024
 
-    def decode_request_content(self, data):
+    def authenticate(self):
         '''
-        Overrides in order to capture Authorization header.
+        Validate the Authorization header, and send a 401 response if it is invalid.
+        Return whether the request is authorized.
         '''
         token = None
         if 'Authorization' in self.headers:
             value = self.headers.get("Authorization", "")
             token = value[8:] if value.startswith("Bearer: ") else ""
         if self.server.auth_handler.validate_token(token):
+            return True
+        self.send_response(401, "Could not authenticate with OAuth")
+        self.send_header("WWW-Authenticate", "realm=\"https://www.codalab.org\"")
+        self.send_header("Content-length", "0")
+        self.end_headers()
+        return False
+
+    def decode_request_content(self, data):
+        '''
+        Overrides in order to capture Authorization header.
+        '''
+        if self.authenticate():
             return SimpleXMLRPCRequestHandler.decode_request_content(self, data)
+
+    def get_file_handle(self):
+        '''
+        Return the file handle and query parameters of a raw file transfer
+        request, or (None, None) after sending an error response.
+        '''
+        url = urlparse.urlparse(self.path)
+        file_uuid = url.path[len(self.FILE_PATH_PREFIX):]
+        # Authenticate first, so that unauthenticated clients can't tell which
+        # file uuids exist.
+        if self.authenticate():
+            if not url.path.startswith(self.FILE_PATH_PREFIX) or file_uuid not in self.server.file_handles:
+                self.report_404()
+            else:
+                if self.server.verbose >= 1:
+                    print "file_server: %s %s" % (self.command, file_uuid)
+                return (self.server.file_handles[file_uuid], urlparse.parse_qs(url.query))
+        # Don't reuse the connection after an error, since the request body (if
+        # any) was not read.
+        self.close_connection = 1
+        return (None, None)
+
+    def do_GET(self):
+        '''
+        Send up to num_bytes (or all remaining bytes) read from a file uuid.
+        '''
+        (file_handle, query) = self.get_file_handle()
+        if file_handle is None:
+            return
+        remaining = int(query['num_bytes'][0]) if 'num_bytes' in query else None
+        # Support single byte ranges (bytes=<first>-[<last>]), by seeking first.
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get("Range", ""))
+        if match:
+            try:
+                file_handle.seek(int(match.group(1)), 0)
+            except IOError:
+                self.send_response(416)
+                self.send_header("Content-length", "0")
+                self.end_headers()
+                return
+            if match.group(2):
+                length = int(match.group(2)) - int(match.group(1)) + 1
+                remaining = length if remaining is None else min(remaining, length)
+            self.send_response(206)
         else:
-            self.send_response(401, "Could not authenticate with OAuth")
-            self.send_header("WWW-Authenticate", "realm=\"https://www.codalab.org\"")
+            self.send_response(200)
+        self.send_header("Content-type", "application/octet-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            while remaining is None or remaining > 0:
+                data = file_handle.read(self.CHUNK_SIZE if remaining is None else min(self.CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                self.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+                if remaining is not None:
+                    remaining -= len(data)
+        except (IOError, ValueError):
+            # The response can't report the error anymore, so close the
+            # connection without ending the chunked body.
+            self.close_connection = 1
+            raise
+        self.wfile.write('0\r\n\r\n')
+
+    def do_PUT(self):
+        '''
+        Write the request body to a file uuid.
+        '''
+        (file_handle, _) = self.get_file_handle()
+        if file_handle is None:
+            return
+        remaining = int(self.headers.get("Content-length", 0))
+        try:
+            while remaining > 0:
+                data = self.rfile.read(min(self.CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                file_handle.write(data)
+                remaining -= len(data)
+        except (IOError, ValueError), e:
+            # For example, the reader of a stream stopped reading.
+            self.send_response(500, str(e))
             self.send_header("Content-length", "0")
             self.end_headers()
+            self.close_connection = 1
+            return
+        self.send_response(200)
+        self.send_header("Content-length", "0")
+        self.end_headers()
 
     def send_response(self, code, message=None):
         '''
@@ -102,6 +213,16 @@ class FileServer(AsyncXMLRPCServer):
         '''
         return self._open_file(path, 'rb')
 
+    def open_stream(self, file_handle):
+        '''
+        Register a file object that is not backed by a path (for example, the read
+        end of a pipe) and return a file uuid identifying it.
+        '''
+        file_uuid = uuid.uuid4().hex
+        self.file_paths[file_uuid] = None
+        self.file_handles[file_uuid] = file_handle
+        return file_uuid
+
     def open_temp_file(self):
         '''
         Open a new temp file for write and return a file uuid identifying it.
@@ -156,9 +277,12 @@ class FileServer(AsyncXMLRPCServer):
 
     def finalize_file(self, file_uuid, delete):
         '''
-        Remove the record from the file server.
+        Remove the record from the file server, closing the file handle if the
+        client didn't (which also stops any process writing to a stream).
         '''
         path = self.file_paths.pop(file_uuid)
         file_handle = self.file_handles.pop(file_uuid, None)
+        if file_handle and not file_handle.closed:
+            file_handle.close()
         if delete and path: path_util.remove(path)
         #print "SHOULD BE SMALL:", self.file_paths, self.file_handles
@@ -2,17 +2,106 @@
 RPCFileHandle is a wrapper class that takes a file uuid and a proxy for the
 FileServer that provided that file uuid. This wrapper provides a very simple
 file-like interface for that file handle.
+
+If it is also given an HTTPFileTransfer for the same server, reads and writes
+go through the FileServer's raw HTTP endpoint instead of read_file and
+write_file, which avoids encoding the data as base64 inside XML.
+
+ResumableReader wraps an RPCFileHandle that is read sequentially, and reopens
+the file where it left off if the connection is lost.
 '''
+import errno
+import httplib
+import socket
+import sys
+import urllib
 import xmlrpclib
 
 
+class HTTPFileTransfer(object):
+    '''
+    Client for the raw file transfer endpoint of a FileServer (see file_server).
+    The connection is kept alive between requests.
+    '''
+    FILE_PATH_PREFIX = '/file/'
+
+    def __init__(self, address, get_auth_token):
+        '''
+        address: the address of the server (http://... or https://...)
+        get_auth_token: a function which yields the access token for the Bearer
+          authentication scheme.
+        '''
+        (url_type, rest) = urllib.splittype(address)
+        (self.host, _) = urllib.splithost(rest)
+        self.connection_class = httplib.HTTPSConnection if url_type == 'https' else httplib.HTTPConnection
+        self.get_auth_token = get_auth_token
+        self.connection = None
+        # Cleared if the server doesn't have the endpoint, in which case callers
+        # should fall back to XML-RPC.
+        self.supported = True
+
+    def _request(self, method, file_uuid, query, body=None):
+        '''
+        Send a request for the given file uuid and return the response body, or
+        None if the server doesn't support raw file transfers.
+        '''
+        path = self.FILE_PATH_PREFIX + file_uuid
+        if query:
+            path += '?' + urllib.urlencode(query)
+        headers = {}
+        token = self.get_auth_token()
+        if token:
+            headers['Authorization'] = 'Bearer: ' + token
+        # Like xmlrpclib.Transport, retry once if a kept-alive connection was
+        # closed by the server.
+        for attempt in (0, 1):
+            if self.connection is None:
+                self.connection = self.connection_class(self.host)
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (socket.error, httplib.BadStatusLine), e:
+                self.close()
+                if attempt or (isinstance(e, socket.error) and e.errno not in (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE)):
+                    raise
+            except httplib.HTTPException:
+                self.close()
+                raise
+        if response.will_close:
+            self.close()
+        if response.status in (httplib.NOT_IMPLEMENTED, httplib.METHOD_NOT_ALLOWED):
+            self.supported = False
+            return None
+        if response.status != httplib.OK:
+            raise xmlrpclib.ProtocolError(self.host + path, response.status, response.reason, response.msg)
+        return data
+
+    def read(self, file_uuid, num_bytes=None):
+        return self._request('GET', file_uuid, {'num_bytes': num_bytes} if num_bytes is not None else None)
+
+    def write(self, file_uuid, buffer):
+        return self._request('PUT', file_uuid, None, buffer)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
 class RPCFileHandle(object):
-    def __init__(self, file_uuid, proxy):
+    def __init__(self, file_uuid, proxy, file_transfer=None):
         self.file_uuid = file_uuid
         self.proxy = proxy
+        self.file_transfer = file_transfer
         self.closed = False
 
     def read(self, num_bytes=None):
+        if self.file_transfer and self.file_transfer.supported:
+            data = self.file_transfer.read(self.file_uuid, num_bytes)
+            if data is not None:
+                return data
         return self.proxy.read_file(self.file_uuid, num_bytes).data
 
     def seek(self, offset, whence):
@@ -25,6 +114,9 @@ class RPCFileHandle(object):
         return self.proxy.readline_file(self.file_uuid).data
 
     def write(self, buffer):
+        if self.file_transfer and self.file_transfer.supported:
+            if self.file_transfer.write(self.file_uuid, buffer) is not None:
+                return
         binary = xmlrpclib.Binary(buffer)
         self.proxy.write_file(self.file_uuid, binary)
 
@@ -32,3 +124,51 @@ class RPCFileHandle(object):
         if not self.closed:
             self.proxy.close_file(self.file_uuid)
             self.closed = True
+
+
+class ResumableReader(object):
+    '''
+    File-like wrapper around an RPCFileHandle. If a read fails because the
+    connection was lost, the file is reopened at the current position with
+    reopen(offset), which returns a new RPCFileHandle, and the read is retried.
+    The handle that was abandoned is passed to discard(handle).
+    '''
+    MAX_RETRIES = 5
+    RETRY_EXCEPTIONS = (socket.error, httplib.HTTPException)
+
+    def __init__(self, handle, reopen, discard):
+        self.handle = handle
+        self.reopen = reopen
+        self.discard = discard
+        self.position = 0
+
+    @property
+    def file_uuid(self):
+        return self.handle.file_uuid
+
+    @property
+    def closed(self):
+        return self.handle.closed
+
+    def read(self, num_bytes=None):
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                data = self.handle.read(num_bytes)
+                self.position += len(data)
+                return data
+            except self.RETRY_EXCEPTIONS, e:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                print >>sys.stderr, '\nTransfer interrupted (%s), resuming at byte %d' % (e, self.position)
+                self.discard(self.handle)
+                self.handle = self.reopen(self.position)
+
+    def seek(self, offset, whence):
+        self.handle.seek(offset, whence)
+        self.position = offset if whence == 0 else self.handle.tell()
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.handle.close()
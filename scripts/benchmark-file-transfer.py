@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# Benchmark reading and writing file uuids through a FileServer, over XML-RPC
+# (read_file/write_file) versus the raw HTTP endpoint (/file/<file uuid>).
+# Starts a FileServer on localhost, so this measures encoding overhead rather
+# than the network.
+
+# Usage: benchmark-file-transfer.py [size in MB (default 256)]
+
+import os, sys, tempfile, threading, time, xmlrpclib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from codalab.lib import file_util, formatting, path_util
+from codalab.server.auth import MockAuthHandler
+from codalab.server.file_server import FileServer
+from codalab.server.rpc_file_handle import HTTPFileTransfer, RPCFileHandle
+
+class BenchmarkFileServer(FileServer):
+    verbose = 0
+    daemon_threads = True
+
+size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 256 * 1024 * 1024
+temp_path = tempfile.mkdtemp()
+server = BenchmarkFileServer(('localhost', 0), temp_path, MockAuthHandler([None]))
+thread = threading.Thread(target=server.serve_forever)
+thread.daemon = True
+thread.start()
+address = 'http://localhost:%d' % server.server_address[1]
+proxy = xmlrpclib.ServerProxy(address, allow_none=True)
+
+source_path = os.path.join(temp_path, 'source')
+with open(source_path, 'wb') as f:
+    for _ in range(size / file_util.BUFFER_SIZE):
+        f.write(os.urandom(file_util.BUFFER_SIZE))
+size = os.path.getsize(source_path)
+
+class NullFile(object):
+    def write(self, buffer):
+        pass
+
+class ZeroFile(object):
+    def __init__(self, size):
+        self.remaining = size
+    def read(self, num_bytes):
+        num_bytes = min(num_bytes, self.remaining)
+        self.remaining -= num_bytes
+        return '\0' * num_bytes
+
+def benchmark(name, file_transfer):
+    # Read
+    file_uuid = server.open_file(source_path)
+    source = RPCFileHandle(file_uuid, proxy, file_transfer)
+    start_time = time.time()
+    file_util.copy(source, NullFile(), autoflush=False)
+    read_time = time.time() - start_time
+    source.close()
+    server.finalize_file(file_uuid, False)
+    # Write
+    file_uuid = proxy.open_temp_file()
+    dest = RPCFileHandle(file_uuid, proxy, file_transfer)
+    start_time = time.time()
+    file_util.copy(ZeroFile(size), dest, autoflush=False)
+    dest.close()
+    write_time = time.time() - start_time
+    proxy.finalize_file(file_uuid, True)
+    print '%-8s read %s/s, write %s/s' % (
+        name, formatting.size_str(size / read_time), formatting.size_str(size / write_time))
+
+print 'Transferring %s in chunks of %s' % (formatting.size_str(size), formatting.size_str(file_util.BUFFER_SIZE))
+benchmark('XML-RPC', None)
+file_transfer = HTTPFileTransfer(address, lambda: None)
+benchmark('HTTP', file_transfer)
+
+file_transfer.close()
+proxy('close')()
+server.shutdown()
+path_util.remove(temp_path)
@@ -3,31 +3,22 @@
 # Wrapper for fig's simple workqueue system.
 # https://github.com/percyliang/fig/blob/master/bin/q
 # Each command outputs JSON.
+#
+# In serve mode, the script stays up and reads one request per line on stdin,
+# writing the response on a single line of stdout, so that the worker doesn't
+# have to start a new process for every command.
 
 import sys, os, json, re
 import subprocess
 import argparse
 
-def get_output(command):
+def get_output(command, cwd=None):
     print >>sys.stderr, 'dispatch-q.py: ' + command,
-    output = subprocess.check_output(command, shell=True)
+    output = subprocess.check_output(command, shell=True, cwd=cwd)
     print >>sys.stderr, ('=> %d lines' % len(output.split('\n')))
     return output
 
-if len(sys.argv) <= 1:
-    print 'Usage:'
-    print '  start [--request-time <seconds>] [--request-memory <bytes>] <script>'
-    print '    => {handle: ...}'
-    print '  info <handle>*'
-    print '    => {..., infos: [{handle: ..., hostname: ..., memory: ...}, ...]}'
-    print '  kill <handle>'
-    print '    => {handle: ...}'
-    print '  cleanup <handle>'
-    print '    => {handle: ...}'
-    sys.exit(1)
-
-mode = sys.argv[1]
-if mode == 'start':
+def start(argv):
     parser = argparse.ArgumentParser()
     parser.add_argument('--username', type=str, help='user who is running this job')
     parser.add_argument('--request_time', type=float, help='request this much computation time (in seconds)')
@@ -38,7 +29,7 @@ if mode == 'start':
     parser.add_argument('--request_priority', type=int, help='priority of this job (higher is more important)')
     parser.add_argument('--share_working_path', help='whether we should run the job directly in the script directory', action='store_true')
     parser.add_argument('script', type=str, help='script to run')
-    args = parser.parse_args(sys.argv[2:])
+    args = parser.parse_args(argv)
 
     resource_args = ''
     if args.request_time != None:
@@ -53,6 +44,7 @@ if mode == 'start':
     if args.request_priority != None:
         resource_args += ' -priority -- %d' % (-args.request_priority)  # Note: need to invert
 
+    cwd = None
     if args.share_working_path:
         # Run directly in the same directory.
         resource_args += ' -shareWorkingPath true'
@@ -72,17 +64,18 @@ if mode == 'start':
         if args.script.startswith('/'):
             # Strip leading / to make path relative.
             # This way, q will run the right script.
-            os.chdir('/')
+            cwd = '/'
             launch_script = args.script[1:]
         else:
             launch_script = args.script
 
-    stdout = get_output('q%s -add bash %s use_script_for_temp_dir' % (resource_args, launch_script))
+    stdout = get_output('q%s -add bash %s use_script_for_temp_dir' % (resource_args, launch_script), cwd=cwd)
     m = re.match(r'Job (J-.+) added successfully', stdout)
     handle = m.group(1) if m else None
-    response = {'raw': stdout, 'handle': handle}
-elif mode == 'info':
-    handles = sys.argv[2:]  # If empty, then get info about everything
+    return {'raw': stdout, 'handle': handle}
+
+def info(handles):
+    # If handles is empty, then get info about everything
     list_args = ''
     if len(handles) > 0:
         list_args += ' ' + ' '.join(handles)
@@ -121,20 +114,88 @@ elif mode == 'info':
 
         infos.append(info)
     response['infos'] = infos
-elif mode == 'kill':
-    handle = sys.argv[2]
-    response = {
+    return response
+
+def kill(handle):
+    return {
         'handle': handle,
         'raw': get_output('q -kill %s' % handle)
     }
-elif mode == 'cleanup':
-    handle = sys.argv[2]
-    response = {
+
+def cleanup(handle):
+    return {
         'handle': handle,
         'raw': get_output('q -del %s' % handle)
     }
-else:
-    print 'Invalid mode: %s' % mode
+
+def run(mode, args):
+    if mode == 'start':
+        return start(args)
+    elif mode == 'info':
+        return info(args)
+    elif mode == 'kill':
+        return kill(args[0])
+    elif mode == 'cleanup':
+        return cleanup(args[0])
+    raise ValueError('Invalid mode: %s' % mode)
+
+def serve():
+    # Last info about each job, to answer incremental info requests.
+    last_infos = {}
+
+    def handle_request(request):
+        try:
+            mode, args = request['mode'], request.get('args', [])
+            response = run(mode, args)
+            if mode == 'info' and request.get('incremental'):
+                # Only return the jobs that changed since the last incremental
+                # request, and the ones that are gone.
+                infos = dict((info['handle'], info) for info in response['infos'])
+                response = {
+                    'infos': [info for (handle, info) in infos.iteritems() if last_infos.get(handle) != info],
+                    'removed': [handle for handle in last_infos if handle not in infos],
+                }
+                last_infos.clear()
+                last_infos.update(infos)
+            return response
+        except (Exception, SystemExit), e:
+            # argparse exits on invalid arguments.
+            return {'error': '%s: %s' % (e.__class__.__name__, e)}
+
+    for line in iter(sys.stdin.readline, ''):
+        if line.strip() == '': continue
+        request = json.loads(line)
+        # A list of requests is answered with the list of their responses.
+        if isinstance(request, list):
+            response = map(handle_request, request)
+        else:
+            response = handle_request(request)
+        sys.stdout.write(json.dumps(response) + '\n')
+        sys.stdout.flush()
+
+if len(sys.argv) <= 1:
+    print 'Usage:'
+    print '  start [--request-time <seconds>] [--request-memory <bytes>] <script>'
+    print '    => {handle: ...}'
+    print '  info <handle>*'
+    print '    => {..., infos: [{handle: ..., hostname: ..., memory: ...}, ...]}'
+    print '  kill <handle>'
+    print '    => {handle: ...}'
+    print '  cleanup <handle>'
+    print '    => {handle: ...}'
+    print '  serve'
+    print '    reads requests on stdin, one per line: {mode: ..., args: [...]} or a list of them'
+    print '    (info requests with incremental: true only return the jobs that changed, and the removed handles)'
+    print '    => one response per line, {error: ...} if the command failed'
     sys.exit(1)
 
+mode = sys.argv[1]
+if mode == 'serve':
+    serve()
+    sys.exit(0)
+try:
+    response = run(mode, sys.argv[2:])
+except ValueError, e:
+    print e
+    sys.exit(1)
 print json.dumps(response)
@@ -5,9 +5,10 @@ import unittest
 
 from codalab.common import UsageError
 from codalab.client.local_bundle_client import LocalBundleClient
-from codalab.lib import path_util, spec_util
+from codalab.lib import path_util, spec_util, worksheet_util
 from codalab.lib.bundle_store import BundleStore
 from codalab.model.sqlite_model import SQLiteModel
+from codalab.model.tables import GROUP_OBJECT_PERMISSION_READ
 from codalab.server.auth import MockAuthHandler, User
 
 class GroupsAndPermsTest(unittest.TestCase):
@@ -158,3 +159,34 @@ class GroupsAndPermsTest(unittest.TestCase):
         _assert_group_count_for('root', 0)
         _assert_group_count_for('user1', 0)
         _assert_group_count_for('user2', 0)
+
+    def test_subworksheet_items(self):
+        '''
+        Test that the subworksheets of a worksheet are fetched in a constant
+        number of queries, and that missing ones are still listed.
+        '''
+        self.set_current_user('user1', '')
+        index_uuid = self.client.new_worksheet('index', None)
+        missing_uuid = spec_util.generate_uuid()
+        self.client.add_worksheet_item(index_uuid, worksheet_util.subworksheet_item(missing_uuid))
+        def get_subworksheet_infos():
+            # Count the permission queries too.
+            self.model._permission_cache.clear()
+            with self.model.request_cache() as cache:
+                info = self.client.get_worksheet_info(index_uuid, fetch_items=True)
+            return ([item[1] for item in info['items']], cache.num_queries)
+
+        subworksheet_uuids = []
+        for i in range(3):
+            subworksheet_uuids.append(self.client.new_worksheet('sub%d' % i, None))
+            self.client.add_worksheet_item(index_uuid, worksheet_util.subworksheet_item(subworksheet_uuids[-1]))
+            (infos, num_queries) = get_subworksheet_infos()
+            if i == 0:
+                first_num_queries = num_queries
+            self.assertEqual(num_queries, first_num_queries)
+        self.set_current_user('user2', '')
+        (infos, num_queries) = get_subworksheet_infos()
+        self.assertEqual(infos[0], {'uuid': missing_uuid})
+        self.assertEqual([info['name'] for info in infos[1:]], ['sub0', 'sub1', 'sub2'])
+        self.assertEqual([info['owner_name'] for info in infos[1:]], ['user1'] * 3)
+        self.assertEqual([info['permission'] for info in infos[1:]], [GROUP_OBJECT_PERMISSION_READ] * 3)
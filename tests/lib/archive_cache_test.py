@@ -0,0 +1,103 @@
+import errno
+import io
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from codalab.lib import zip_util
+from codalab.lib.archive_cache import ArchiveCache
+
+
+class ArchiveCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.cache = ArchiveCache(os.path.join(self.temp_directory, 'archives'), 100)
+    self.num_generated = 0
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+
+  def generate(self, contents):
+    def generate():
+      self.num_generated += 1
+      return io.BytesIO(contents)
+    return generate
+
+  def test_open(self):
+    '''
+    Test that an archive is cached once it is read to the end, and that
+    partially read archives are not cached.
+    '''
+    key = ArchiveCache.get_key('0x123', '0xabc', '', 'bundle', False)
+    self.assertNotEqual(key, ArchiveCache.get_key('0x123', '0xabc', '', 'bundle', True))
+    archive = self.cache.open(key, self.generate('a' * 50))
+    self.assertEqual(archive.read(10), 'a' * 10)
+    archive.close()
+    archive = self.cache.open(key, self.generate('a' * 50))
+    # Streams can skip forward, but not back.
+    archive.seek(20)
+    self.assertEqual(archive.tell(), 20)
+    self.assertRaises(IOError, lambda: archive.seek(10))
+    self.assertEqual(archive.read(), 'a' * 30)
+    self.assertEqual(archive.read(), '')
+    archive.close()
+    self.assertEqual(self.num_generated, 2)
+    self.assertEqual(os.listdir(self.cache.path), [key + ArchiveCache.SUFFIX])
+
+    # The cached archive is a regular file.
+    archive = self.cache.open(key, self.generate('a' * 50))
+    archive.seek(40)
+    self.assertEqual(archive.read(), 'a' * 10)
+    archive.close()
+    self.assertEqual(self.num_generated, 2)
+
+  def test_evict(self):
+    '''
+    Test that archives that are too large aren't cached, and that the least
+    recently used archives are evicted.
+    '''
+    archive = self.cache.open('large', self.generate('a' * 101))
+    archive.read()
+    archive.read()
+    self.assertEqual(os.listdir(self.cache.path), [])
+    for key in ('first', 'second', 'third'):
+      archive = self.cache.open(key, self.generate('a' * 40))
+      archive.read()
+      archive.read()
+      os.utime(self.cache.get_location(key), (len(key), len(key)))
+    self.assertEqual(sorted(os.listdir(self.cache.path)), ['second.tar', 'third.tar'])
+
+  def test_write_error(self):
+    '''
+    Test that archives are still served when they can't be written to the cache.
+    '''
+    archive = self.cache.open('full', self.generate('a' * 50))
+    archive.cache_file = mock.Mock(wraps=archive.cache_file)
+    archive.cache_file.write.side_effect = IOError(errno.ENOSPC, 'No space left on device')
+    self.assertEqual(archive.read(10), 'a' * 10)
+    self.assertEqual(archive.cache_file, None)
+    self.assertEqual(archive.read(), 'a' * 40)
+    self.assertEqual(archive.read(), '')
+    archive.close()
+    self.assertEqual(os.listdir(self.cache.path), [])
+
+  def test_rename(self):
+    '''
+    Test that renaming a bundle doesn't serve an archive of its old name.
+    '''
+    bundle_path = os.path.join(self.temp_directory, 'bundle')
+    with open(bundle_path, 'w') as f:
+      f.write('contents')
+    cache = ArchiveCache(os.path.join(self.temp_directory, 'large_archives'), 1000000)
+    for name in ('old', 'new', 'old'):
+      key = ArchiveCache.get_key('0x123', '0xabc', '', name, False)
+      archive = cache.open(key, lambda: zip_util.tar_stream(bundle_path, False, [], name))
+      dest_path = tempfile.mkdtemp(dir=self.temp_directory)
+      result_path = zip_util.untar(archive, dest_path, name)
+      archive.read()
+      archive.close()
+      with open(result_path) as f:
+        self.assertEqual(f.read(), 'contents')
+    self.assertEqual(len(os.listdir(cache.path)), 2)
@@ -0,0 +1,103 @@
+import BaseHTTPServer
+import json
+import threading
+import unittest
+import urlparse
+
+from codalab.server.auth import OAuthHandler, TTLCache
+
+USERS = [
+  {'id': 1, 'name': 'alice', 'active': True},
+  {'id': 2, 'name': 'bob', 'active': False},
+]
+TOKENS = {'alice-token': USERS[0]}
+
+
+class StubAuthHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  '''
+  Serves the part of the OAuth authorization server's API used by OAuthHandler.
+  '''
+  def do_POST(self):
+    self.server.paths.append(self.path)
+    data = urlparse.parse_qs(self.rfile.read(int(self.headers['Content-Length'])))
+    if self.path == '/clients/token/':
+      result = {'access_token': 'app-token', 'expires_in': 3600}
+    elif self.path == '/clients/validation/':
+      user = TOKENS.get(data['token'][0])
+      result = {'code': 200, 'user': user} if user else {'code': 403}
+    elif self.path == '/clients/info/':
+      key_type = 'names' if 'names' in data else 'ids'
+      keys = data[key_type]
+      field = 'name' if key_type == 'names' else 'id'
+      result = {'code': 200, 'users': [user for user in USERS if str(user[field]) in keys]}
+    body = json.dumps(result)
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class OAuthHandlerTest(unittest.TestCase):
+  def setUp(self):
+    self.server = BaseHTTPServer.HTTPServer(('localhost', 0), StubAuthHandler)
+    self.server.paths = []
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.start()
+    self.handler = OAuthHandler('http://localhost:%d' % self.server.server_port, 'app', 'key')
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.thread.join()
+
+  def requests(self, path):
+    return self.server.paths.count(path)
+
+  def test_validate_token(self):
+    '''
+    Test that tokens are validated once, until they are invalidated.
+    '''
+    for _ in range(3):
+      self.assertTrue(self.handler.validate_token('alice-token'))
+      self.assertEqual(self.handler.current_user().name, 'alice')
+      self.assertFalse(self.handler.validate_token('bad-token'))
+      self.assertEqual(self.handler.current_user(), None)
+    self.assertEqual(self.requests('/clients/validation/'), 2)
+    self.assertEqual(self.requests('/clients/token/'), 1)
+
+    self.handler.invalidate_token('alice-token')
+    self.assertTrue(self.handler.validate_token('alice-token'))
+    self.assertEqual(self.requests('/clients/validation/'), 3)
+
+  def test_get_users(self):
+    '''
+    Test that users are looked up once, by id or by name, and that missing and
+    inactive users are cached too.
+    '''
+    users = self.handler.get_users('ids', ['1', '2', '3'])
+    self.assertEqual(users['1'].name, 'alice')
+    self.assertEqual((users['2'], users['3']), (None, None))
+    users = self.handler.get_users('names', ['alice'])
+    self.assertEqual(users['alice'].unique_id, 1)
+    self.assertEqual(self.handler.get_users('ids', ['2', '3', '1'])['1'].name, 'alice')
+    self.assertEqual(self.requests('/clients/info/'), 1)
+    self.assertEqual(self.handler.get_users('names', ['bob']), {'bob': None})
+    self.assertEqual(self.requests('/clients/info/'), 2)
+
+
+class TTLCacheTest(unittest.TestCase):
+  def test_cache(self):
+    cache = TTLCache(ttl=60, max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', None)
+    self.assertEqual((cache.get('a'), cache.get('b', 'missing')), (1, None))
+    # The oldest entry is evicted.
+    cache.set('c', 3)
+    self.assertEqual([cache.get(key, 'missing') for key in 'abc'], ['missing', None, 3])
+    cache.delete('c')
+    self.assertEqual(cache.get('c', 'missing'), 'missing')
+    cache.set('d', 4, ttl=0)
+    self.assertEqual(cache.get('d', 'missing'), 'missing')
@@ -80,7 +80,13 @@ class BundleStoreTest(unittest.TestCase):
     temp_path = os.path.join(test_temp, temp_dir)
     mock_uuid.uuid4.return_value = type('MockUUID', (), {'hex': temp_dir})()
 
-    test_dirs_and_files = 'my test dirs_and_files sentinel'
+    test_summary = {
+      'hash': test_directory_hash,
+      'size': 100,
+      'file_count': 2,
+      'directory_count': 1,
+      'largest_file_size': 60,
+    }
 
     def normalize(path):
       self.assertEqual(path, unnormalized_bundle_path)
@@ -92,24 +98,10 @@ class BundleStoreTest(unittest.TestCase):
       check_isvalid_called[0] = True
     mock_path_util.check_isvalid = check_isvalid
 
-    def recursive_ls(path):
+    def summarize(path, num_workers=1, use_processes=False, hash_cache=None, known_hashes=None):
       self.assertEqual(path, temp_path)
-      return test_dirs_and_files
-    mock_path_util.recursive_ls = recursive_ls
-    
-    def set_permissions(path, permissions, dirs_and_files=None):
-      if dirs_and_files is not None:
-        self.assertEqual(dirs_and_files, test_dirs_and_files)
-      self.assertEqual(path, temp_path)
-      self.assertEqual(permissions, 0o755)
-    mock_path_util.set_permissions = set_permissions
-
-    def hash_directory(path, dirs_and_files=None):
-      if dirs_and_files is not None:
-        self.assertEqual(dirs_and_files, test_dirs_and_files)
-      self.assertTrue(path, temp_path)
-      return test_directory_hash
-    mock_path_util.hash_directory = hash_directory
+      return test_summary
+    mock_path_util.summarize = summarize
 
     mock_path_util.path_is_url = lambda x : False
 
@@ -118,11 +110,21 @@ class BundleStoreTest(unittest.TestCase):
         self.root = root
         self.data = os.path.join(root, 'data')
         self.temp = os.path.join(root, 'temp') 
+        self.hash_workers = 1
+        self.hash_processes = False
+        self.hash_cache = None
 
     bundle_store = MockBundleStore(test_root)
     self.assertFalse(check_isvalid_called[0])
-    bundle_store.upload(unnormalized_bundle_path, False, [])
+    (data_hash, metadata) = bundle_store.upload(unnormalized_bundle_path, False, [])
     self.assertTrue(check_isvalid_called[0])
+    self.assertEqual(data_hash, '0x' + test_directory_hash)
+    self.assertEqual(metadata, {
+      'data_size': 100,
+      'data_file_count': 2,
+      'data_directory_count': 1,
+      'data_largest_file_size': 60,
+    })
     if new:
       self.assertTrue(rename_called[0])
     else:
@@ -0,0 +1,77 @@
+import mock
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from codalab.lib import path_util
+from codalab.lib.dedup_bundle_store import DedupBundleStore
+
+
+class DedupBundleStoreTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.bundle_store = DedupBundleStore(self.home, [])
+    self.model = mock.Mock()
+    self.model.batch_get_bundles.return_value = []
+
+  def tearDown(self):
+    shutil.rmtree(self.home)
+
+  def make_temp_bundle(self, files):
+    path = tempfile.mkdtemp(dir=self.bundle_store.temp)
+    for (name, contents) in files.iteritems():
+      with open(os.path.join(path, name), 'w') as fd:
+        fd.write(contents)
+    return path
+
+  def test_upload_and_cleanup(self):
+    '''
+    Test that identical files in different bundles share an inode, and that
+    objects are deleted only when no bundle uses them anymore.
+    '''
+    (hash1, _) = self.bundle_store.upload(self.make_temp_bundle({'a': 'shared', 'b': 'one'}), False, [])
+    (hash2, _) = self.bundle_store.upload(self.make_temp_bundle({'c': 'shared', 'd': 'two'}), False, [])
+    path1 = self.bundle_store.get_location(hash1)
+    path2 = self.bundle_store.get_location(hash2)
+    self.assertEqual(os.stat(os.path.join(path1, 'a')).st_ino, os.stat(os.path.join(path2, 'c')).st_ino)
+    self.assertEqual(os.stat(os.path.join(path1, 'a')).st_nlink, 3)
+
+    self.bundle_store.cleanup(self.model, hash1, [], False)
+    self.assertFalse(os.path.exists(path1))
+    self.assertEqual(os.stat(os.path.join(path2, 'c')).st_nlink, 2)
+    num_objects = sum(len(files) for (_, _, files) in os.walk(self.bundle_store.objects))
+    self.assertEqual(num_objects, 2)
+
+    self.bundle_store.cleanup(self.model, hash2, [], False)
+    num_objects = sum(len(files) for (_, _, files) in os.walk(self.bundle_store.objects))
+    self.assertEqual(num_objects, 0)
+    self.assertEqual(os.listdir(self.bundle_store.manifests), [])
+
+  def test_migrate(self):
+    '''
+    Test that migrate deduplicates data that has no manifest.
+    '''
+    for (data_hash, name) in (('0x1', 'a'), ('0x2', 'b')):
+      os.mkdir(self.bundle_store.get_location(data_hash))
+      with open(os.path.join(self.bundle_store.get_location(data_hash), name), 'w') as fd:
+        fd.write('contents')
+    self.bundle_store.migrate(False)
+    self.assertEqual(
+      os.stat(os.path.join(self.bundle_store.get_location('0x1'), 'a')).st_ino,
+      os.stat(os.path.join(self.bundle_store.get_location('0x2'), 'b')).st_ino,
+    )
+    self.assertEqual(sorted(os.listdir(self.bundle_store.manifests)), ['0x1', '0x2'])
+
+  def test_read_only_object(self):
+    '''
+    Test that objects made read-only by staging aren't shared with files that
+    are still writable.
+    '''
+    (hash1, _) = self.bundle_store.upload(self.make_temp_bundle({'a': 'shared'}), False, [])
+    path_util.materialize(self.bundle_store.get_location(hash1), os.path.join(self.home, 'staged'), 'hardlink')
+    (hash2, _) = self.bundle_store.upload(self.make_temp_bundle({'b': 'shared'}), False, [])
+    file2 = os.path.join(self.bundle_store.get_location(hash2), 'b')
+    self.assertNotEqual(os.stat(os.path.join(self.bundle_store.get_location(hash1), 'a')).st_ino, os.stat(file2).st_ino)
+    self.assertEqual(stat.S_IMODE(os.stat(file2).st_mode) & 0o222, 0o200)
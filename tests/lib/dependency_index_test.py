@@ -0,0 +1,81 @@
+from sqlalchemy import create_engine
+import unittest
+
+from codalab.common import State
+from codalab.lib.dependency_index import DependencyIndex
+from codalab.model.bundle_model import BundleModel
+from codalab.model.tables import (
+  bundle as cl_bundle,
+  bundle_dependency as cl_bundle_dependency,
+)
+
+
+class DependencyIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.engine = create_engine('sqlite://', strategy='threadlocal')
+    self.model = BundleModel(self.engine)
+    self.model.create_tables()
+    self.index = DependencyIndex(self.model)
+
+  def add_bundle(self, uuid, state, parent_uuids=()):
+    with self.engine.begin() as connection:
+      connection.execute(cl_bundle.insert().values(uuid=uuid, bundle_type='run', state=state))
+      for parent_uuid in parent_uuids:
+        connection.execute(cl_bundle_dependency.insert().values(
+          child_uuid=uuid, child_path=parent_uuid, parent_uuid=parent_uuid, parent_path=''))
+
+  def set_state(self, uuid, state, report=True):
+    with self.engine.begin() as connection:
+      connection.execute(cl_bundle.update().where(cl_bundle.c.uuid == uuid).values(state=state))
+    if report:
+      self.index.update_state(uuid, state)
+
+  def test_resolve(self):
+    '''
+    Test that CREATED bundles are resolved once all their parents are READY, or
+    as soon as one of them FAILED.
+    '''
+    self.add_bundle('ready', State.READY)
+    self.add_bundle('running', State.RUNNING)
+    self.add_bundle('a', State.CREATED)
+    self.add_bundle('b', State.CREATED, ['ready'])
+    self.add_bundle('c', State.CREATED, ['ready', 'running'])
+    self.add_bundle('d', State.CREATED, ['running', 'missing'])
+    self.index.sync()
+    self.assertEqual(self.index.pop_resolved(), {'a': [], 'b': []})
+    self.assertEqual(self.index.pop_resolved(), {})
+    # Bundles are only discovered once.
+    self.index.sync()
+    self.assertEqual(self.index.pop_resolved(), {})
+
+    self.add_bundle('e', State.CREATED, ['c'])
+    self.index.sync()
+    self.assertEqual(sorted(self.index.waiting), ['c', 'd', 'e'])
+    self.set_state('running', State.READY)
+    self.assertEqual(self.index.pop_resolved(), {'c': []})
+    self.set_state('c', State.FAILED)
+    self.assertEqual(self.index.pop_resolved(), {'e': ['c']})
+    self.set_state('e', State.FAILED)
+    self.assertEqual(self.index.waiting, {'d': set(['missing'])})
+
+    # Changes made behind the index's back are picked up on the next sync.
+    self.add_bundle('missing', State.READY)
+    self.index.sync()
+    self.assertEqual(self.index.pop_resolved(), {'d': []})
+    self.add_bundle('f', State.CREATED, ['running2'])
+    self.add_bundle('running2', State.RUNNING)
+    self.index.sync()
+    self.assertEqual(self.index.pop_resolved(), {})
+    self.set_state('running2', State.FAILED, report=False)
+    self.index.sync()
+    self.assertEqual(self.index.pop_resolved(), {'f': ['running2']})
+    self.assertEqual(self.index.waiting, {})
+
+    # Bundles that couldn't be processed are returned again.
+    self.index.restore_resolved({'d': []})
+    self.assertEqual(self.index.pop_resolved(), {'d': []})
+
+    # Rebuilding the index finds all the CREATED bundles again.
+    self.index.reset()
+    self.index.sync()
+    self.assertEqual(self.index.pop_resolved(), {'a': [], 'b': [], 'd': [], 'f': ['running2']})
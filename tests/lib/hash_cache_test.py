@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from codalab.lib import path_util
+from codalab.lib.hash_cache import HashCache
+
+
+class HashCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.cache = HashCache(os.path.join(self.temp_directory, 'hash_cache.sqlite'), 10)
+    self.files = []
+    for i in range(3):
+      path = os.path.join(self.temp_directory, 'file%d' % (i,))
+      with open(path, 'w') as fd:
+        fd.write('contents %d' % (i,))
+      self.files.append(path)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+
+  def test_hash_files_contents(self):
+    '''
+    Test that hashes are cached, and that cached hashes are used instead of
+    reading the files.
+    '''
+    expected_hashes = path_util.hash_files_contents(self.files)
+    self.assertEqual(path_util.hash_files_contents(self.files, hash_cache=self.cache), expected_hashes)
+    keys = [self.cache.get_key(path) for path in self.files]
+    self.assertEqual(self.cache.lookup(keys), dict(zip(keys, expected_hashes)))
+    # Poison an entry to check that it is used instead of the file's contents.
+    self.cache.store([(keys[0], 'cached hash')])
+    self.assertEqual(path_util.hash_file_contents(self.files[0], self.cache), 'cached hash')
+
+  def test_invalidation(self):
+    '''
+    Test that modifying a file invalidates its entry.
+    '''
+    key = self.cache.get_key(self.files[0])
+    self.cache.store([(key, 'old hash')])
+    with open(self.files[0], 'a') as fd:
+      fd.write('more contents')
+    os.utime(self.files[0], (time.time() + 10, time.time() + 10))
+    new_key = self.cache.get_key(self.files[0])
+    self.assertNotEqual(new_key, key)
+    self.assertEqual(self.cache.lookup([new_key]), {})
+    self.assertNotEqual(path_util.hash_file_contents(self.files[0], self.cache), 'old hash')
+    self.cache.invalidate(self.files[:1])
+    self.assertEqual(self.cache.lookup([new_key]), {})
+
+  def test_eviction(self):
+    '''
+    Test that the least recently used entries are evicted when the cache is full.
+    '''
+    keys = [(0, i, 0, 0.0) for i in range(10)]
+    self.cache.store([(key, 'hash') for key in keys])
+    time.sleep(0.01)
+    self.cache.lookup(keys[:1])
+    self.cache.store([((0, 10, 0, 0.0), 'hash')])
+    remaining = self.cache.lookup(keys + [(0, 10, 0, 0.0)])
+    self.assertEqual(len(remaining), 9)
+    self.assertIn(keys[0], remaining)
+    self.assertIn((0, 10, 0, 0.0), remaining)
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from codalab.bundles.run_bundle import RunBundle
+from codalab.lib.bundle_store import BundleStore
+from codalab.machines.local_machine import LocalMachine
+
+
+def construct_run_bundle(command, **metadata):
+  metadata['name'] = 'run'
+  for spec in RunBundle.METADATA_SPECS:
+    if not spec.generated:
+      metadata.setdefault(spec.key, spec.default or spec.get_constructor()())
+  return RunBundle.construct([], command, metadata, owner_id='1')
+
+
+class LocalMachineTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.bundle_store = BundleStore(self.temp_directory, [])
+    self.machine = LocalMachine({'cpus': 2, 'memory': '1g'})
+    self.finished = threading.Event()
+    self.machine.set_wakeup(self.finished.set)
+
+  def tearDown(self):
+    for job in self.machine.jobs.values():
+      self.machine.kill_bundle(job['bundle'])
+    shutil.rmtree(self.temp_directory)
+
+  def start_bundle(self, command, **metadata):
+    bundle = construct_run_bundle(command, **metadata)
+    return (bundle, self.machine.start_bundle(bundle, self.bundle_store, {}, 'user'))
+
+  def get_statuses(self):
+    return dict((status['job_handle'], status) for status in self.machine.get_bundle_statuses())
+
+  def wait_for_exit(self, job_handle):
+    while self.get_statuses()[job_handle]['exitcode'] is None:
+      self.finished.wait(10)
+      self.finished.clear()
+    return self.get_statuses()[job_handle]
+
+  def test_admission(self):
+    '''
+    Test that bundles are only started when the CPUs and memory they request
+    fit in what is left, and that larger requests get the whole machine.
+    '''
+    (_, result) = self.start_bundle('sleep 10', request_cpus=1, request_memory='600m')
+    self.assertNotEqual(result, None)
+    self.assertEqual(self.start_bundle('true', request_cpus=1, request_memory='600m')[1], None)
+    self.assertEqual(self.start_bundle('true', request_cpus=2, request_memory='1m')[1], None)
+    self.assertEqual(len(self.machine.jobs), 1)
+
+    bundle = construct_run_bundle('true', request_cpus=8, request_memory='100g')
+    self.assertEqual(self.machine.get_requested_resources(bundle), (2, 1024 ** 3))
+
+  def test_concurrent_bundles(self):
+    '''
+    Test that two bundles run at once, and that killing and finalizing one
+    leaves the other alone.
+    '''
+    (bundle1, result1) = self.start_bundle('sleep 10')
+    (bundle2, result2) = self.start_bundle('echo hello')
+    statuses = self.get_statuses()
+    self.assertEqual(sorted(statuses), sorted([result1['job_handle'], result2['job_handle']]))
+    self.assertEqual(statuses[result1['job_handle']]['exitcode'], None)
+
+    status2 = self.wait_for_exit(result2['job_handle'])
+    self.assertEqual((status2['exitcode'], status2['success']), (0, True))
+    with open(os.path.join(result2['temp_dir'], 'stdout')) as f:
+      self.assertEqual(f.read(), 'hello\n')
+    self.assertEqual(self.get_statuses()[result1['job_handle']]['exitcode'], None)
+
+    self.assertTrue(self.machine.kill_bundle(bundle1))
+    status1 = self.wait_for_exit(result1['job_handle'])
+    self.assertEqual(status1['success'], False)
+    self.assertTrue(self.machine.finalize_bundle(bundle1))
+    self.assertEqual(self.get_statuses().keys(), [result2['job_handle']])
+    # Killing a bundle that has already finished does nothing.
+    self.assertTrue(self.machine.kill_bundle(bundle2))
+    self.assertTrue(self.machine.finalize_bundle(bundle2))
+    self.assertEqual(self.get_statuses(), {})
+    self.assertFalse(self.machine.kill_bundle(bundle1))
@@ -1,4 +1,5 @@
 import hashlib
+import mock
 import os
 import shutil
 import stat
@@ -102,3 +103,91 @@ class PathUtilFSTest(unittest.TestCase):
     os.symlink(link_target, symlink_path)
     link_hash = path_util.hash_file_contents(symlink_path)
     self.assertEqual(link_hash, expected_hash)
+
+  def test_hash_file_contents_mmap(self):
+    '''
+    Test that hashing a file through a memory map gives the same hash.
+    '''
+    expected_hash = hashlib.sha1(path_util.FILE_PREFIX + self.contents).hexdigest()
+    with mock.patch('codalab.lib.path_util.MMAP_THRESHOLD', 1), \
+         mock.patch('codalab.lib.path_util.MMAP_BLOCK_SIZE', 3):
+      file_hash = path_util.hash_file_contents(self.bundle_files[0])
+    self.assertEqual(file_hash, expected_hash)
+
+  def test_hash_directory_parallel(self):
+    '''
+    Test that hashing a directory in parallel gives the same hash as hashing it
+    serially, with both threads and processes.
+    '''
+    os.symlink('foo', os.path.join(self.bundle_path, 'blah', 'link'))
+    expected_hash = path_util.hash_directory(self.bundle_path)
+    for use_processes in (False, True):
+      directory_hash = path_util.hash_directory(self.bundle_path, None, 3, use_processes)
+      self.assertEqual(directory_hash, expected_hash)
+
+  def test_summarize(self):
+    '''
+    Test that summarize agrees with recursive_ls, hash_directory and get_size.
+    '''
+    os.symlink('asdf', os.path.join(self.bundle_path, 'blah', 'link'))
+    summary = path_util.summarize(self.bundle_path)
+    (directories, files) = path_util.recursive_ls(self.bundle_path)
+    self.assertEqual(summary['directories'], sorted(directories))
+    self.assertEqual(summary['files'], sorted(files))
+    self.assertEqual(summary['hash'], path_util.hash_directory(self.bundle_path))
+    self.assertEqual(summary['size'], path_util.get_size(self.bundle_path))
+    self.assertEqual(summary['file_count'], len(files))
+    self.assertEqual(summary['directory_count'], len(directories))
+    self.assertEqual(summary['largest_file_size'], len(self.contents))
+    # Single files are summarized too.
+    summary = path_util.summarize(self.bundle_files[0])
+    self.assertEqual(summary['hash'], path_util.hash_directory(self.bundle_files[0], ([], self.bundle_files[:1])))
+    self.assertEqual(summary['file_count'], 1)
+
+  def test_materialize(self):
+    '''
+    Test that each materialize mode reproduces the directory, and that files are
+    shared with the source only in the hardlink and symlink modes, in which
+    they are read-only.
+    '''
+    os.symlink('asdf', os.path.join(self.bundle_path, 'blah', 'link'))
+    expected_hash = path_util.hash_directory(self.bundle_path)
+    for mode in ('reflink', 'hardlink', 'symlink'):
+      dest_path = os.path.join(self.temp_directory, mode)
+      path_util.materialize(self.bundle_path, dest_path, mode)
+      self.assertEqual(os.readlink(os.path.join(dest_path, 'blah', 'link')), 'asdf')
+      source_stat = os.stat(self.bundle_files[0])
+      dest_file = dest_path + path_util.get_relative_path(self.bundle_path, self.bundle_files[0])
+      self.assertEqual(source_stat.st_ino == os.stat(dest_file).st_ino, mode != 'reflink')
+      self.assertEqual(stat.S_IMODE(os.stat(dest_file).st_mode) & 0o222 == 0, mode != 'reflink')
+      if mode == 'symlink':
+        self.assertEqual(os.readlink(dest_file), self.bundle_files[0])
+      else:
+        self.assertEqual(path_util.hash_directory(dest_path), expected_hash)
+
+  def test_copy(self):
+    '''
+    Test that copy reproduces a directory with its permissions, copies or follows
+    symlinks, and skips excluded paths.
+    '''
+    os.symlink('../asdf', os.path.join(self.bundle_path, 'blah', 'link'))
+    os.chmod(self.bundle_files[1], 0o500)
+    dest_path = os.path.join(self.temp_directory, 'copy')
+    stats = path_util.copy(self.bundle_path, dest_path)
+    self.assertEqual(stats, {'num_files': 4, 'num_bytes': 3 * len(self.contents)})
+    self.assertEqual(path_util.hash_directory(dest_path), path_util.hash_directory(self.bundle_path))
+    dest_file = dest_path + path_util.get_relative_path(self.bundle_path, self.bundle_files[1])
+    self.assertEqual(stat.S_IMODE(os.lstat(dest_file).st_mode), 0o500)
+    self.assertRaises(ValueError, lambda: path_util.copy(self.bundle_path, dest_path))
+
+    # Following symlinks copies the linked directory.
+    dest_path = os.path.join(self.temp_directory, 'follow')
+    path_util.copy(self.bundle_path, dest_path, follow_symlinks=True, exclude_patterns=['ba?', 'asdf/craw/'])
+    self.assertFalse(os.path.islink(os.path.join(dest_path, 'blah', 'link')))
+    self.assertEqual(os.listdir(os.path.join(dest_path, 'blah', 'link')), ['craw'])
+    self.assertEqual(os.listdir(os.path.join(dest_path, 'asdf')), [])
+
+    # Lists of paths are copied into a new directory.
+    dest_path = os.path.join(self.temp_directory, 'list')
+    path_util.copy(self.bundle_files[:2], dest_path, num_workers=1)
+    self.assertEqual(sorted(os.listdir(dest_path)), ['bar', 'foo'])
@@ -0,0 +1,91 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+from codalab.machines.remote_machine import RemoteMachine
+
+DISPATCH_Q = os.path.join(os.path.dirname(__file__), '..', '..', 'scripts', 'dispatch-q.py')
+
+
+class RemoteMachineTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.jobs_path = os.path.join(self.temp_directory, 'jobs')
+    # A fake q, which lists the jobs in jobs_path.
+    self.write_script('q', '\n'.join([
+      '#!/bin/sh',
+      'case "$1" in',
+      '  -list) cat %s ;;' % self.jobs_path,
+      '  -kill|-del) echo ok ;;',
+      '  *) echo "Job J-new added successfully" ;;',
+      'esac',
+    ]))
+    self.path = os.environ['PATH']
+    os.environ['PATH'] = self.temp_directory + os.pathsep + self.path
+    self.machine = RemoteMachine({
+      'verbose': 0,
+      'dispatch_command': '%s %s' % (sys.executable, DISPATCH_Q),
+      'dispatch_serve': True,
+    })
+
+  def tearDown(self):
+    if self.machine.dispatcher:
+      self.machine.dispatcher.close()
+    os.environ['PATH'] = self.path
+    shutil.rmtree(self.temp_directory)
+
+  def write_script(self, name, contents):
+    path = os.path.join(self.temp_directory, name)
+    with open(path, 'w') as f:
+      f.write(contents + '\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+  def set_jobs(self, *jobs):
+    with open(self.jobs_path, 'w') as f:
+      for (handle, worker, status, exitcode) in jobs:
+        print >>f, '\t'.join([handle, worker, status, exitcode, '', '', '', '', '', 'bash run.sh'])
+
+  def get_states(self):
+    return sorted((status['job_handle'], status['state'], status['exitcode'])
+                  for status in self.machine.get_bundle_statuses())
+
+  def test_serve(self):
+    '''
+    Test that all the commands go to a single dispatcher process, and that the
+    statuses are kept up to date with incremental info requests.
+    '''
+    self.set_jobs(('J-a', '', 'queued', ''), ('J-b', 'w1 host1', 'running', ''))
+    self.assertEqual(self.get_states(), [('J-a', 'queued', None), ('J-b', 'running', None)])
+    pid = self.machine.dispatcher.proc.pid
+    self.assertEqual(self.machine.dispatch('start', ['/tmp/0x1.sh'])['handle'], 'J-new')
+    self.set_jobs(('J-b', 'w1 host1', 'done', '0'), ('J-new', '', 'queued', ''))
+    self.assertEqual(self.get_states(), [('J-b', 'queued', 0), ('J-new', 'queued', None)])
+    self.assertEqual(self.machine.dispatch('cleanup', ['J-b'])['handle'], 'J-b')
+    self.assertEqual(self.machine.dispatcher.proc.pid, pid)
+    # Errors are reported without bringing the dispatcher down.
+    self.assertRaises(SystemError, lambda: self.machine.dispatch('start', ['--request_time', 'x', '/tmp/0x2.sh']))
+    self.assertEqual(self.machine.dispatcher.proc.pid, pid)
+
+    # A new dispatcher process starts from scratch.
+    self.machine.dispatcher.close()
+    self.assertEqual(self.get_states(), [('J-b', 'queued', 0), ('J-new', 'queued', None)])
+    self.assertNotEqual(self.machine.dispatcher.proc.pid, pid)
+
+  def test_fallback(self):
+    '''
+    Test that dispatchers without a serve mode are run once per command.
+    '''
+    self.machine.dispatcher.close()
+    self.machine.dispatcher.args = [self.write_script('dispatch', '\n'.join([
+      '#!/bin/sh',
+      'if [ "$1" = serve ]; then echo "Invalid mode: $1"; exit 1; fi',
+      'echo \'{"infos": [{"handle": "J-a", "state": "running"}]}\'',
+    ])), 'serve']
+    self.machine.dispatch_command = self.machine.dispatcher.args[0]
+    self.assertEqual(self.get_states(), [('J-a', 'running', None)])
+    self.assertEqual(self.machine.dispatcher, None)
+    self.assertEqual(self.get_states(), [('J-a', 'running', None)])
@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from codalab.lib.resource_usage import (
+  ResourceSeries,
+  sample_cgroup,
+  sample_processes,
+)
+
+
+class ResourceUsageTest(unittest.TestCase):
+  def test_series(self):
+    '''
+    Test that the series keeps the peak memory and the latest counters, and
+    that it is downsampled when it gets too long.
+    '''
+    series = ResourceSeries(start_time=0, interval=1, max_samples=4)
+    for t in range(6):
+      series.add({'time_user': t, 'memory': 10 * (t % 3), 'disk_read': 100 * t}, now=t)
+    # Samples that come too soon are merged into the previous point.
+    series.add({'time_system': 1, 'memory': 5}, now=5.5)
+    self.assertEqual(series.interval, 2)
+    self.assertEqual(series.points, [
+      [1, 1, 10, 100, 0],
+      [3, 3, 20, 300, 0],
+      [4, 6, 20, 500, 0],
+    ])
+    usage = series.get_usage()
+    self.assertEqual(usage['memory'], 5)
+    self.assertEqual(usage['memory_max'], 20)
+    self.assertEqual(usage['time_user'], 5)
+    self.assertEqual(json.loads(usage['resource_usage'])['points'], series.points)
+
+    # Sampling can continue from the saved series.
+    loaded = ResourceSeries.from_string(usage['resource_usage'], max_samples=4)
+    self.assertEqual((loaded.start_time, loaded.interval, loaded.points), (0, 2, series.points))
+    self.assertEqual(loaded.memory_max, 20)
+    loaded.add({'memory': 30}, now=10)
+    self.assertEqual(loaded.points[-2:], [[4, 6, 20, 500, 0], [10, 6, 30, 500, 0]])
+    self.assertEqual(loaded.get_usage()['memory_max'], 30)
+
+  def test_sample_processes(self):
+    if not os.path.exists('/proc'):
+      return
+    # Wait until the child is running its own program, so that it isn't sampled
+    # half way through starting.
+    process = subprocess.Popen([sys.executable, '-c', 'import time; print "ready"; time.sleep(10)'], stdout=subprocess.PIPE)
+    try:
+      process.stdout.readline()
+      samples = sample_processes([os.getpid(), process.pid, -1])
+      self.assertEqual(sorted(samples.keys()), sorted([os.getpid(), process.pid]))
+      # The children of the process are included.
+      self.assertTrue(samples[os.getpid()]['memory'] > samples[process.pid]['memory'] > 0)
+      self.assertTrue(samples[os.getpid()]['time_user'] >= 0)
+    finally:
+      process.kill()
+      process.wait()
+
+  def test_sample_cgroup(self):
+    status_dir = tempfile.mkdtemp()
+    try:
+      self.assertEqual(sample_cgroup(status_dir), {})
+      with open(os.path.join(status_dir, 'cpuacct.stat'), 'w') as f:
+        f.write('user 150\nsystem 50\n')
+      with open(os.path.join(status_dir, 'memory.max_usage_in_bytes'), 'w') as f:
+        f.write('1024\n')
+      with open(os.path.join(status_dir, 'blkio.throttle.io_service_bytes'), 'w') as f:
+        f.write('8:0 Read 10\n8:0 Write 20\n')
+      self.assertEqual(sample_cgroup(status_dir), {
+        'time_user': 1.5,
+        'time_system': 0.5,
+        'memory_max': 1024,
+        'disk_read': 10,
+        'disk_write': 20,
+      })
+    finally:
+      shutil.rmtree(status_dir)
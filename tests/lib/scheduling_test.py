@@ -0,0 +1,52 @@
+import unittest
+
+from codalab.common import UsageError
+from codalab.lib.scheduling import (
+  FairSharePolicy,
+  FifoPolicy,
+  get_scheduling_policy,
+)
+
+
+class MockMetadata(object):
+  def __init__(self, request_priority):
+    self.request_priority = request_priority
+
+
+class MockBundle(object):
+  def __init__(self, id, owner_id, request_priority=None):
+    self.id = id
+    self.uuid = '0x%d' % id
+    self.owner_id = owner_id
+    self.metadata = MockMetadata(request_priority)
+
+
+class SchedulingTest(unittest.TestCase):
+  def order(self, policy, bundles, running_counts={}, wait_times={}):
+    return [bundle.id for (bundle, _) in policy.order(bundles, running_counts, wait_times)]
+
+  def test_fifo(self):
+    bundles = [MockBundle(2, 'a', 5), MockBundle(1, 'a'), MockBundle(3, 'b')]
+    self.assertEqual(self.order(FifoPolicy(), bundles), [1, 2, 3])
+
+  def test_fair_share(self):
+    '''
+    Test that bundles are ordered by priority, that owners take turns, and that
+    waiting raises the priority.
+    '''
+    policy = FairSharePolicy(aging_interval=100, fair_share_weight=1)
+    bundles = [MockBundle(i, 'a') for i in range(1, 5)] + [MockBundle(5, 'b'), MockBundle(6, 'b', 3)]
+    self.assertEqual(self.order(policy, bundles), [6, 1, 2, 5, 3, 4])
+    # Owners with running bundles go after the others.
+    self.assertEqual(self.order(policy, bundles, {'a': 3}), [6, 5, 1, 2, 3, 4])
+    # Bundles that have waited long enough overtake higher priority ones.
+    self.assertEqual(self.order(policy, bundles, {}, {'0x4': 500}), [4, 6, 1, 5, 2, 3])
+    (bundle, score) = policy.order(bundles[:1], {'a': 2}, {'0x1': 50})[0]
+    self.assertEqual(score, -1.5)
+
+  def test_get_scheduling_policy(self):
+    self.assertTrue(isinstance(get_scheduling_policy({}), FairSharePolicy))
+    policy = get_scheduling_policy({'scheduling': {'policy': 'fair_share', 'aging_interval': 60}})
+    self.assertEqual(policy.aging_interval, 60)
+    self.assertTrue(isinstance(get_scheduling_policy({'scheduling': {'policy': 'fifo'}}), FifoPolicy))
+    self.assertRaises(UsageError, lambda: get_scheduling_policy({'scheduling': {'policy': 'random'}}))
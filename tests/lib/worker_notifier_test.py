@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from codalab.lib.worker_notifier import WorkerNotifier
+
+
+class WorkerNotifierTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.temp_directory, 'worker.sock')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+
+  def test_notify(self):
+    '''
+    Test that notifications wake up the listener, and that notifying without a
+    listener is harmless.
+    '''
+    notifier = WorkerNotifier(self.path)
+    self.assertFalse(notifier.notify())
+    self.assertTrue(notifier.listen())
+    self.assertFalse(notifier.wait(0))
+    for _ in range(3):
+      self.assertTrue(WorkerNotifier(self.path).notify())
+    # Pending notifications are consumed at once.
+    self.assertTrue(notifier.wait(0))
+    self.assertFalse(notifier.wait(0))
+    notifier.close()
+    self.assertFalse(os.path.exists(self.path))
+    self.assertFalse(notifier.notify())
+
+  def test_listen(self):
+    '''
+    Test that a second listener doesn't take over the socket of a live one, but
+    that a socket left over by a dead one is replaced.
+    '''
+    notifier = WorkerNotifier(self.path)
+    self.assertTrue(notifier.listen())
+    other = WorkerNotifier(self.path)
+    self.assertFalse(other.listen())
+    # The probe counts as a notification.
+    self.assertTrue(notifier.wait(0))
+    # Simulate a worker that exited without cleaning up.
+    notifier.socket.close()
+    self.assertTrue(other.listen())
+    self.assertTrue(notifier.notify())
+    self.assertTrue(other.wait(0))
+    other.close()
@@ -0,0 +1,100 @@
+import io
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import unittest
+
+from codalab.common import UsageError
+from codalab.lib import path_util, zip_util
+
+
+class ZipUtilTest(unittest.TestCase):
+  contents = 'random file contents'
+
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.bundle_path = os.path.join(self.temp_directory, 'test_bundle')
+    os.makedirs(os.path.join(self.bundle_path, 'asdf', 'craw'))
+    for name in ('foo', os.path.join('asdf', 'bar')):
+      with open(os.path.join(self.bundle_path, name), 'w') as fd:
+        fd.write(self.contents)
+    os.chmod(os.path.join(self.bundle_path, 'foo'), 0o500)
+    os.symlink('asdf', os.path.join(self.bundle_path, 'link'))
+
+  def tearDown(self):
+    path_util.set_write_permissions(self.temp_directory)
+    shutil.rmtree(self.temp_directory)
+
+  def test_tar_stream(self):
+    '''
+    Test that a streamed tar archive extracts to the same data, and that
+    archiving the same data twice gives the same bytes.
+    '''
+    archive = zip_util.tar_stream(self.bundle_path, False, [], 'bundle').read()
+    self.assertEqual(zip_util.tar_stream(self.bundle_path, False, [], 'bundle').read(), archive)
+
+    dest_path = os.path.join(self.temp_directory, 'dest')
+    os.mkdir(dest_path)
+    result_path = zip_util.untar(io.BytesIO(archive), dest_path, 'bundle')
+    self.assertEqual(result_path, os.path.join(dest_path, 'bundle'))
+    self.assertEqual(path_util.hash_directory(result_path), path_util.hash_directory(self.bundle_path))
+    self.assertEqual(os.readlink(os.path.join(result_path, 'link')), 'asdf')
+    self.assertEqual(stat.S_IMODE(os.lstat(os.path.join(result_path, 'foo')).st_mode), 0o500)
+
+    # Closing the stream early doesn't leave the generator blocked.
+    zip_util.tar_stream(self.bundle_path, False, [], 'bundle').close()
+
+  def test_tar_stream_error(self):
+    '''
+    Test that archives of files that are removed or truncated while they are
+    streamed can't be extracted, and that reading them raises the error.
+    '''
+    large_path = os.path.join(self.bundle_path, 'asdf', 'large')
+    for change in ('remove', 'truncate'):
+      # The stream blocks on the large file, which is archived before foo.
+      with open(large_path, 'w') as fd:
+        fd.write('a' * 4 * 1024 * 1024)
+      stream = zip_util.tar_stream(self.bundle_path, False, [], 'bundle')
+      if change == 'remove':
+        os.remove(os.path.join(self.bundle_path, 'foo'))
+      else:
+        with open(large_path, 'w') as fd:
+          fd.write('short')
+      chunks = []
+      def read_all():
+        while True:
+          data = stream.read(65536)
+          if not data:
+            break
+          chunks.append(data)
+      self.assertRaises(IOError, read_all)
+      stream.close()
+      dest_path = tempfile.mkdtemp(dir=self.temp_directory)
+      self.assertRaises(UsageError, lambda: zip_util.untar(io.BytesIO(''.join(chunks)), dest_path, 'bundle'))
+
+  def test_untar_rejects_unsafe_entries(self):
+    '''
+    Test that entries outside the destination, including through symlinks in
+    the archive, and duplicated entries are rejected.
+    '''
+    evil_path = os.path.join(self.temp_directory, 'evil')
+    for entries in ([('../evil', tarfile.REGTYPE, '')],
+                    [('link', tarfile.SYMTYPE, '/'), ('link/evil', tarfile.REGTYPE, '')],
+                    [('link', tarfile.SYMTYPE, evil_path), ('link', tarfile.REGTYPE, '')],
+                    [('link', tarfile.SYMTYPE, self.temp_directory), ('link', tarfile.DIRTYPE, ''),
+                     ('link/evil', tarfile.REGTYPE, '')],
+                    [('foo', tarfile.REGTYPE, ''), ('./foo', tarfile.REGTYPE, '')]):
+      archive = io.BytesIO()
+      tar = tarfile.open(fileobj=archive, mode='w')
+      for (name, type, linkname) in entries:
+        info = tarfile.TarInfo(name)
+        info.type = type
+        info.linkname = linkname
+        tar.addfile(info, io.BytesIO())
+      tar.close()
+      archive.seek(0)
+      dest_path = tempfile.mkdtemp(dir=self.temp_directory)
+      self.assertRaises(UsageError, lambda: zip_util.untar(archive, dest_path, None))
+      self.assertFalse(os.path.lexists(evil_path))
@@ -116,3 +116,29 @@ class BundleModelTest(unittest.TestCase):
       retrieved_bundle = self.model.get_bundle(bundle.uuid)
     self.assertTrue(isinstance(retrieved_bundle, MockBundle))
     self.assertTrue(retrieved_bundle._validate_called)
+
+  def test_bundle_leases(self):
+    bundle = MockBundle()
+    self.model.save_bundle(bundle)
+    self.assertEqual(self.model.get_unleased_bundle_states(['my_state']), {'my_uuid': 'my_state'})
+    self.assertTrue(self.model.acquire_bundle_lease('my_uuid', 'worker_1', 60))
+    self.assertTrue(self.model.acquire_bundle_lease('my_uuid', 'worker_1', 60))
+    self.assertFalse(self.model.acquire_bundle_lease('my_uuid', 'worker_2', 60))
+    self.assertEqual(self.model.get_unleased_bundle_states(['my_state']), {})
+    self.assertEqual(self.model.get_leased_bundle_uuids('worker_1'), set(['my_uuid']))
+
+    # Actions on bundles leased by other workers are left for them.
+    self.model.add_bundle_action('my_uuid', 'kill')
+    self.assertEqual(self.model.pop_bundle_actions('worker_2'), [])
+    self.assertEqual([action.action for action in self.model.pop_bundle_actions('worker_1')], ['kill'])
+    self.assertEqual(self.model.pop_bundle_actions(), [])
+
+    # Expired leases can be taken over.
+    self.model.renew_bundle_leases('worker_1', -1)
+    self.assertEqual(self.model.get_unleased_bundle_states(['my_state']), {'my_uuid': 'my_state'})
+    self.assertTrue(self.model.acquire_bundle_lease('my_uuid', 'worker_2', 60))
+    self.assertEqual(self.model.get_leased_bundle_uuids('worker_1'), set())
+    self.model.release_bundle_lease('my_uuid', 'worker_1')
+    self.assertFalse(self.model.acquire_bundle_lease('my_uuid', 'worker_1', 60))
+    self.model.release_bundle_lease('my_uuid', 'worker_2')
+    self.assertTrue(self.model.acquire_bundle_lease('my_uuid', 'worker_1', 60))
@@ -0,0 +1,89 @@
+from sqlalchemy import create_engine
+import unittest
+
+from codalab.bundles.run_bundle import RunBundle
+from codalab.common import State
+from codalab.model.bundle_model import BundleModel
+from codalab.model.tables import bundle_summary
+
+
+def construct_run_bundle(name, owner_id, **generated):
+  metadata = {'name': name}
+  for spec in RunBundle.METADATA_SPECS:
+    if not spec.generated:
+      metadata.setdefault(spec.key, spec.default or spec.get_constructor()())
+  bundle = RunBundle.construct([], 'echo', metadata, owner_id=owner_id)
+  for (key, value) in generated.iteritems():
+    bundle.metadata.set_metadata_key(key, value)
+  return bundle
+
+
+class BundleSummaryTest(unittest.TestCase):
+  def setUp(self):
+    self.model = BundleModel(create_engine('sqlite://', strategy='threadlocal'))
+    self.model.root_user_id = '0'
+    self.bundles = [
+      construct_run_bundle('alpha', '1', data_size=100, time=2.5, created=3),
+      construct_run_bundle('bravo', '1', data_size=20, time=10.0, created=1),
+      construct_run_bundle('charlie', '2', data_size=3, created=2),
+    ]
+    for bundle in self.bundles:
+      self.model.save_bundle(bundle)
+    self.uuids = [bundle.uuid for bundle in self.bundles]
+
+  def get_summary(self, bundle):
+    row = self.model.engine.execute(bundle_summary.select().where(bundle_summary.c.bundle_uuid == bundle.uuid)).fetchone()
+    return (row.name, row.created, row.data_size, row.time, row.state, row.owner_id)
+
+  def search(self, *keywords):
+    return self.model.search_bundle_uuids('0', None, list(keywords))
+
+  def test_summary(self):
+    '''
+    Test that the summary follows the changes to the bundles.
+    '''
+    (a, b, c) = self.bundles
+    self.assertEqual(self.get_summary(a), ('alpha', 3, 100, 2.5, State.CREATED, '1'))
+    self.assertEqual(self.get_summary(c), ('charlie', 2, 3, None, State.CREATED, '2'))
+    self.model.update_bundle(a, {'owner_id': '2', 'metadata': {'name': 'delta', 'data_size': 5}})
+    self.assertEqual(self.get_summary(a), ('delta', 3, 5, 2.5, State.CREATED, '2'))
+    # Only the bundles that satisfy the condition are updated.
+    self.model.update_bundle(b, {'state': State.QUEUED})
+    self.assertFalse(self.model.batch_update_bundles([a, b], {'state': State.RUNNING}, {'state': State.QUEUED}))
+    self.assertEqual(self.get_summary(a)[4], State.CREATED)
+    self.assertEqual(self.get_summary(b)[4], State.RUNNING)
+    self.model.delete_bundles([c.uuid])
+    self.assertEqual(self.model.engine.execute(bundle_summary.count()).scalar(), 2)
+
+  def test_search(self):
+    '''
+    Test searching on the keys in the summary.
+    '''
+    uuids = self.uuids
+    # Numbers are sorted as numbers.
+    self.assertEqual(self.search('size=.sort'), [uuids[2], uuids[1], uuids[0]])
+    self.assertEqual(self.search('time=.sort-'), [uuids[1], uuids[0], uuids[2]])
+    self.assertEqual(self.search('created=.sort-', 'owner_id=1'), [uuids[0], uuids[1]])
+    self.assertEqual(self.search('data_size=.sum'), 123)
+    self.assertEqual(self.search('owner_id=1', 'data_size=.sum'), 120)
+    self.assertEqual(self.search('data_size=20'), [uuids[1]])
+    self.assertEqual(self.search('name=bravo'), [uuids[1]])
+    self.assertEqual(self.search('rav'), [uuids[1]])
+    self.assertEqual(self.search('state=created', '.count'), 3)
+    self.assertEqual(self.search('name=.sort', 'name=%'), uuids)
+
+  def test_missing_summary(self):
+    '''
+    Test that bundles without a summary row are still found, and that their
+    summary is added back when they are updated.
+    '''
+    (a, b, c) = self.bundles
+    delete_summary = lambda: self.model.engine.execute(bundle_summary.delete().where(bundle_summary.c.bundle_uuid == b.uuid))
+    delete_summary()
+    self.assertEqual(self.search('rav'), [b.uuid])
+    self.assertEqual(self.search(b.uuid), [b.uuid])
+    self.assertEqual(set(self.search('size=.sort')), set(self.uuids))
+    # Updating the summary of the bundle adds its row.
+    self.model.update_bundle(b, {'state': State.QUEUED})
+    self.assertEqual(self.get_summary(b), ('bravo', 1, 20, 10.0, State.QUEUED, '1'))
+    self.assertEqual(self.search('state=queued'), [b.uuid])
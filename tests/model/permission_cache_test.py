@@ -0,0 +1,88 @@
+from sqlalchemy import create_engine
+import unittest
+
+from codalab.bundles.run_bundle import RunBundle
+from codalab.lib import spec_util
+from codalab.model.bundle_model import BundleModel
+from codalab.model.tables import (
+  GROUP_OBJECT_PERMISSION_ALL,
+  GROUP_OBJECT_PERMISSION_NONE,
+  GROUP_OBJECT_PERMISSION_READ,
+)
+
+
+def construct_run_bundle(command):
+  metadata = {'name': 'run'}
+  for spec in RunBundle.METADATA_SPECS:
+    if not spec.generated:
+      metadata.setdefault(spec.key, spec.default or spec.get_constructor()())
+  return RunBundle.construct([], command, metadata, owner_id='1')
+
+
+class PermissionCacheTest(unittest.TestCase):
+  def setUp(self):
+    engine = create_engine('sqlite://', strategy='threadlocal')
+    self.model = BundleModel(engine)
+    # Another process using the same database.
+    self.other_model = BundleModel(engine)
+    for model in (self.model, self.other_model):
+      model.root_user_id = '0'
+    self.bundle = construct_run_bundle('echo')
+    self.model.save_bundle(self.bundle)
+    self.group_uuid = self.model.create_group({
+      'uuid': spec_util.generate_uuid(), 'name': 'group', 'owner_id': '1', 'user_defined': True,
+    })['uuid']
+
+  def get_permission(self, user_id):
+    with self.model.request_cache() as cache:
+      permissions = self.model.get_user_bundle_permissions(user_id, [self.bundle.uuid], {self.bundle.uuid: '1'})
+    return (permissions[self.bundle.uuid], cache.num_queries)
+
+  def search(self, user_id):
+    return self.model.search_bundle_uuids(user_id, None, [])
+
+  def test_permission_cache(self):
+    '''
+    Test that effective permissions are computed once, until permissions or
+    group memberships change, even in another process.
+    '''
+    # version, group permissions and user groups.
+    self.assertEqual(self.get_permission('2'), (GROUP_OBJECT_PERMISSION_NONE, 3))
+    # Only the version.
+    self.assertEqual(self.get_permission('2'), (GROUP_OBJECT_PERMISSION_NONE, 1))
+    self.assertEqual(self.get_permission('1'), (GROUP_OBJECT_PERMISSION_ALL, 0))
+    self.assertEqual(self.search('2'), [])
+
+    self.other_model.add_bundle_permission(self.group_uuid, self.bundle.uuid, GROUP_OBJECT_PERMISSION_READ)
+    self.assertEqual(self.get_permission('2')[0], GROUP_OBJECT_PERMISSION_NONE)
+    self.other_model.add_user_in_group('2', self.group_uuid, False)
+    self.assertEqual(self.get_permission('2')[0], GROUP_OBJECT_PERMISSION_READ)
+    self.assertEqual(self.search('2'), [self.bundle.uuid])
+    self.other_model.update_bundle_permission(self.group_uuid, self.bundle.uuid, GROUP_OBJECT_PERMISSION_ALL)
+    self.assertEqual(self.get_permission('2')[0], GROUP_OBJECT_PERMISSION_ALL)
+    self.other_model.delete_user_in_group('2', self.group_uuid)
+    self.assertEqual(self.get_permission('2')[0], GROUP_OBJECT_PERMISSION_NONE)
+    self.assertEqual(self.search('2'), [])
+
+    # The public group gives permissions to everyone, even anonymous users.
+    self.other_model.add_bundle_permission(self.model.public_group_uuid, self.bundle.uuid, GROUP_OBJECT_PERMISSION_READ)
+    self.assertEqual(self.get_permission(None)[0], GROUP_OBJECT_PERMISSION_READ)
+    self.assertEqual(self.search(None), [self.bundle.uuid])
+    self.other_model.delete_group(self.group_uuid)
+    self.model.delete_bundle_permission(self.model.public_group_uuid, self.bundle.uuid)
+    self.assertEqual(self.get_permission(None)[0], GROUP_OBJECT_PERMISSION_NONE)
+
+  def test_permission_change(self):
+    '''
+    Test that a change to the permissions of an object only drops the cached
+    permissions on that object.
+    '''
+    other_bundle = construct_run_bundle('echo')
+    self.model.save_bundle(other_bundle)
+    self.assertEqual(self.get_permission('2'), (GROUP_OBJECT_PERMISSION_NONE, 3))
+    self.other_model.add_bundle_permission(self.model.public_group_uuid, other_bundle.uuid, GROUP_OBJECT_PERMISSION_READ)
+    # Only the version and the changes.
+    self.assertEqual(self.get_permission('2'), (GROUP_OBJECT_PERMISSION_NONE, 1))
+    with self.model.request_cache():
+      permissions = self.model.get_user_bundle_permissions('2', [other_bundle.uuid], {other_bundle.uuid: '1'})
+    self.assertEqual(permissions[other_bundle.uuid], GROUP_OBJECT_PERMISSION_READ)
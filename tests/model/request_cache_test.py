@@ -0,0 +1,66 @@
+from sqlalchemy import create_engine
+import unittest
+
+from codalab.bundles.run_bundle import RunBundle
+from codalab.model.bundle_model import BundleModel
+from codalab.objects.permission import GROUP_OBJECT_PERMISSION_READ
+from codalab.objects.worksheet import Worksheet
+
+
+def construct_run_bundle(targets, command):
+  metadata = {'name': 'run'}
+  for spec in RunBundle.METADATA_SPECS:
+    if not spec.generated:
+      metadata.setdefault(spec.key, spec.default or spec.get_constructor()())
+  return RunBundle.construct(targets, command, metadata, owner_id='1')
+
+
+class RequestCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.model = BundleModel(create_engine('sqlite://', strategy='threadlocal'))
+    self.model.root_user_id = '0'
+    self.parent = construct_run_bundle([], 'make data')
+    self.model.save_bundle(self.parent)
+    self.bundle = construct_run_bundle([('a', (self.parent.uuid, ''))], 'cat a')
+    self.model.save_bundle(self.bundle)
+    self.worksheet = Worksheet({'name': 'ws', 'uuid': None, 'title': None, 'frozen': None, 'items': [], 'owner_id': '1'})
+    self.model.new_worksheet(self.worksheet)
+    self.model.add_bundle_permission(self.model.public_group_uuid, self.bundle.uuid, GROUP_OBJECT_PERMISSION_READ)
+
+  def read_all(self):
+    uuids = [self.parent.uuid, self.bundle.uuid]
+    bundles = self.model.batch_get_bundles(uuid=uuids)
+    self.model.get_bundle(self.bundle.uuid)
+    self.model.get_worksheet(self.worksheet.uuid, fetch_items=False)
+    owner_ids = self.model.get_bundle_owner_ids(uuids)
+    permissions = self.model.get_user_bundle_permissions('2', uuids, owner_ids)
+    names = self.model.get_bundle_names(uuids)
+    return (bundles, owner_ids, permissions, names)
+
+  def test_request_cache(self):
+    '''
+    Test that each object is fetched once per request, and that writes drop
+    the cache.
+    '''
+    expected = self.read_all()
+    with self.model.request_cache() as cache:
+      self.assertEqual(self.read_all()[1:], expected[1:])
+      self.assertEqual([bundle.uuid for bundle in self.read_all()[0]], [self.parent.uuid, self.bundle.uuid])
+      # bundles (+ dependencies and metadata), worksheet, owner ids,
+      # permission version and names (the permissions are still in the
+      # PermissionCache).
+      self.assertEqual(cache.num_queries, 7)
+      num_queries = cache.num_queries
+      self.assertTrue(cache.hits > cache.misses)
+      with self.model.request_cache() as nested:
+        self.assertTrue(nested is cache)
+        self.read_all()
+      self.assertEqual(cache.num_queries, num_queries)
+
+      # The request sees its own writes.
+      self.model.update_bundle(self.bundle, {'metadata': {'name': 'renamed'}})
+      self.assertEqual(self.model.get_bundle(self.bundle.uuid).metadata.name, 'renamed')
+      self.assertEqual(self.model.get_bundle_names([self.bundle.uuid]), {self.bundle.uuid: 'renamed'})
+      self.model.delete_bundle_permission(self.model.public_group_uuid, self.bundle.uuid)
+      self.assertEqual(self.read_all()[2], {self.parent.uuid: 0, self.bundle.uuid: 0})
+    self.assertEqual(self.model._get_request_cache(), None)
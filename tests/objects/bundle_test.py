@@ -1,6 +1,12 @@
 import json
+import mock
+import os
+import shutil
+import stat
+import tempfile
 import unittest
 
+from codalab.lib import path_util
 from codalab.model.tables import bundle as cl_bundle
 from codalab.objects.bundle import Bundle
 from codalab.objects.metadata_spec import MetadataSpec
@@ -88,3 +94,32 @@ class BundleTest(unittest.TestCase):
     json_bundle = json.loads(json.dumps(serialized_bundle))
     deserialized_bundle = MockBundle(json_bundle)
     self.check_bundle(deserialized_bundle, uuid=bundle.uuid)
+
+  def test_remove_dependencies(self):
+    '''
+    Test that removing dependencies staged with hardlinks or symlinks doesn't
+    make the files they share with the bundle store writable again.
+    '''
+    temp_directory = tempfile.mkdtemp()
+    try:
+      source = os.path.join(temp_directory, 'data')
+      os.makedirs(os.path.join(source, 'sub'))
+      source_file = os.path.join(source, 'sub', 'file')
+      with open(source_file, 'w') as f:
+        f.write('contents')
+      parent = mock.Mock(data_hash='0x1')
+      bundle_store = mock.Mock()
+      bundle_store.get_location.return_value = source
+      bundle = self.construct_mock_bundle()
+      bundle.update_in_memory({'dependencies': [{
+        'child_uuid': bundle.uuid, 'child_path': 'dep', 'parent_uuid': '0x' + '1' * 32, 'parent_path': '',
+      }]})
+      for mode in ('hardlink', 'symlink'):
+        dest_path = os.path.join(temp_directory, mode)
+        os.mkdir(dest_path)
+        path_util.materialize(source, os.path.join(dest_path, 'dep'), mode)
+        bundle.remove_dependencies(bundle_store, {'0x' + '1' * 32: parent}, dest_path)
+        self.assertEqual(os.listdir(dest_path), [])
+        self.assertEqual(stat.S_IMODE(os.stat(source_file).st_mode) & 0o222, 0)
+    finally:
+      shutil.rmtree(temp_directory)
@@ -0,0 +1,97 @@
+from sqlalchemy import create_engine
+import unittest
+
+from codalab.bundles.run_bundle import RunBundle
+from codalab.common import State
+from codalab.lib import spec_util
+from codalab.model.bundle_model import BundleModel
+
+
+def construct_run_bundle(targets, command, state=State.CREATED, data_hash=None, **metadata):
+  metadata.setdefault('name', 'run')
+  for spec in RunBundle.METADATA_SPECS:
+    if not spec.generated:
+      metadata.setdefault(spec.key, spec.default or spec.get_constructor()())
+  return RunBundle.construct(targets, command, metadata, owner_id='0', data_hash=data_hash, state=state)
+
+
+class RunBundleTest(unittest.TestCase):
+  def setUp(self):
+    self.parent = construct_run_bundle([], 'make data', State.READY, '0x1')
+    self.other_parent = construct_run_bundle([], 'make more data', State.READY, '0x2')
+    self.parent_dict = dict((bundle.uuid, bundle) for bundle in (self.parent, self.other_parent))
+
+  def test_fingerprint(self):
+    '''
+    Test that runs have the same fingerprint exactly when they have the same
+    command, docker image and dependencies, down to the data of their parents.
+    '''
+    targets = [('a', (self.parent.uuid, '')), ('b', (self.other_parent.uuid, 'sub'))]
+    bundle = construct_run_bundle(targets, 'cat a b/*')
+    fingerprint = bundle.get_fingerprint(self.parent_dict)
+    self.assertTrue(fingerprint)
+    # The order of the dependencies and the other metadata don't matter.
+    same = construct_run_bundle(list(reversed(targets)), 'cat a b/*', name='other', request_memory='1g')
+    self.assertEqual(same.get_fingerprint(self.parent_dict), fingerprint)
+
+    for different in [
+      construct_run_bundle(targets, 'cat b/* a'),
+      construct_run_bundle(targets, 'cat a b/*', request_docker_image='ubuntu'),
+      construct_run_bundle(targets[:1] + [('b', (self.other_parent.uuid, ''))], 'cat a b/*'),
+      construct_run_bundle([('a', (self.parent.uuid, '')), ('b', (self.parent.uuid, 'sub'))], 'cat a b/*'),
+    ]:
+      self.assertNotEqual(different.get_fingerprint(self.parent_dict), fingerprint)
+
+    # The same parent with different data is a different run.
+    self.other_parent.data_hash = '0x3'
+    self.assertNotEqual(bundle.get_fingerprint(self.parent_dict), fingerprint)
+    # Runs whose parents are not all READY have no fingerprint.
+    self.other_parent.state = State.RUNNING
+    self.assertEqual(bundle.get_fingerprint(self.parent_dict), None)
+    self.assertEqual(bundle.get_fingerprint({}), None)
+
+  def test_memoized_run(self):
+    '''
+    Test that READY runs are found by their fingerprint, and that their results
+    are given to identical runs.
+    '''
+    model = BundleModel(create_engine('sqlite://', strategy='threadlocal'))
+    model.create_tables()
+    targets = [('a', (self.parent.uuid, ''))]
+    source = construct_run_bundle(targets, 'wc a', State.READY, '0x4')
+    source.metadata.set_metadata_key('data_size', 10)
+    model.save_bundle(source)
+    fingerprint = source.get_fingerprint(self.parent_dict)
+    self.assertEqual(model.get_memoized_run(fingerprint), None)
+    model.add_run_fingerprint(fingerprint, source.uuid)
+    # The first run with a fingerprint is kept.
+    model.add_run_fingerprint(fingerprint, spec_util.generate_uuid())
+    self.assertEqual(model.get_memoized_run(fingerprint).uuid, source.uuid)
+
+    bundle = construct_run_bundle(targets, 'wc a')
+    model.save_bundle(bundle)
+    model.update_bundle(bundle, bundle.get_memoized_update(model.get_memoized_run(bundle.get_fingerprint(self.parent_dict))))
+    bundle = model.get_bundle(bundle.uuid)
+    self.assertEqual((bundle.state, bundle.data_hash), (State.READY, '0x4'))
+    self.assertEqual((bundle.metadata.memoized_from, bundle.metadata.data_size), (source.uuid, 10))
+
+    model.delete_bundles([source.uuid])
+    self.assertEqual(model.get_memoized_run(fingerprint), None)
+
+  def test_memoized_run_without_data(self):
+    '''
+    Test that runs whose data was removed (cl rm --data-only) aren't reused.
+    '''
+    model = BundleModel(create_engine('sqlite://', strategy='threadlocal'))
+    targets = [('a', (self.parent.uuid, ''))]
+    source = construct_run_bundle(targets, 'wc a', State.READY, '0x4')
+    model.save_bundle(source)
+    fingerprint = source.get_fingerprint(self.parent_dict)
+    model.add_run_fingerprint(fingerprint, source.uuid)
+    model.remove_data_hash_references([source.uuid])
+    self.assertEqual(model.get_memoized_run(fingerprint), None)
+    # An identical run can take its place.
+    other = construct_run_bundle(targets, 'wc a', State.READY, '0x5')
+    model.save_bundle(other)
+    model.add_run_fingerprint(fingerprint, other.uuid)
+    self.assertEqual(model.get_memoized_run(fingerprint).uuid, other.uuid)
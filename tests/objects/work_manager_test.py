@@ -0,0 +1,170 @@
+import mock
+import os
+import shutil
+from sqlalchemy import create_engine
+import tempfile
+import threading
+import time
+import unittest
+
+from codalab.bundles.run_bundle import RunBundle
+from codalab.common import (
+  Command,
+  State,
+)
+from codalab.lib import canonicalize
+from codalab.lib.bundle_store import BundleStore
+from codalab.machines.local_machine import LocalMachine
+from codalab.model.bundle_model import BundleModel
+from codalab.objects.machine import Machine
+from codalab.objects.work_manager import Worker
+
+
+def construct_run_bundle(command, state, **metadata):
+  metadata.setdefault('name', 'run')
+  for spec in RunBundle.METADATA_SPECS:
+    if not spec.generated:
+      metadata.setdefault(spec.key, spec.default or spec.get_constructor()())
+  return RunBundle.construct([], command, metadata, owner_id='0', state=state)
+
+
+class MockMachine(Machine):
+  def __init__(self):
+    self.statuses = []
+    self.finalized = []
+
+  def get_bundle_statuses(self):
+    return [dict(status) for status in self.statuses]
+
+  def finalize_bundle(self, bundle):
+    self.finalized.append(bundle.uuid)
+    return True
+
+
+class WorkerTest(unittest.TestCase):
+  def setUp(self):
+    self.model = BundleModel(create_engine('sqlite://', strategy='threadlocal'))
+    self.machine = MockMachine()
+    self.worker = Worker(None, self.model, self.machine, None, worker_id='worker')
+
+  def save_bundle(self, command, state, worker_id, **metadata):
+    bundle = construct_run_bundle(command, state, **metadata)
+    self.model.save_bundle(bundle)
+    self.model.acquire_bundle_lease(bundle.uuid, worker_id, 100)
+    return bundle
+
+  def test_check_finished_bundles(self):
+    '''
+    Test that statuses only update the bundles this worker holds leases on,
+    and that killed bundles that the machine has lost track of are failed.
+    '''
+    running = self.save_bundle('sleep 10', State.RUNNING, 'worker', job_handle='host:1')
+    other = self.save_bundle('sleep 10', State.RUNNING, 'other', job_handle='host:2')
+    killed = self.save_bundle('sleep 10', State.RUNNING, 'worker', job_handle='host:3', actions=[Command.KILL])
+    lost = self.save_bundle('sleep 10', State.RUNNING, 'worker', job_handle='host:4')
+    self.machine.statuses = [
+      {'job_handle': 'host:1', 'exitcode': None, 'success': None, 'time': 5.0},
+      {'job_handle': 'host:2', 'exitcode': None, 'success': None, 'time': 7.0},
+    ]
+    self.assertFalse(self.worker.check_finished_bundles())
+
+    self.assertEqual(getattr(self.model.get_bundle(running.uuid).metadata, 'time', None), 5.0)
+    self.assertEqual(getattr(self.model.get_bundle(other.uuid).metadata, 'time', None), None)
+    self.assertEqual(self.model.get_bundle(killed.uuid).state, State.FAILED)
+    self.assertEqual(self.model.get_bundle(lost.uuid).state, State.RUNNING)
+    self.assertEqual(self.model.get_leased_bundle_uuids('worker'), set([running.uuid, lost.uuid]))
+    self.assertEqual(self.model.get_leased_bundle_uuids('other'), set([other.uuid]))
+
+
+class WorkerFinalizationTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.bundle_store = BundleStore(self.temp_directory, [])
+    # The bundles are finalized in other threads, so the database can't be in memory.
+    database = os.path.join(self.temp_directory, 'bundle.db')
+    self.model = BundleModel(create_engine('sqlite:///' + database, strategy='threadlocal'))
+    auth_handler = mock.Mock()
+    auth_handler.get_users.return_value = {}
+    self.machine = LocalMachine({})
+    self.worker = Worker(self.bundle_store, self.model, self.machine, auth_handler, worker_id='worker')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+
+  def join_finalizers(self):
+    self.worker.finalizer_pool.close()
+    self.worker.finalizer_pool.join()
+    self.worker.collect_finalized_bundles()
+
+  def run_bundle(self, command):
+    bundle = construct_run_bundle(command, State.STAGED)
+    self.model.save_bundle(bundle)
+    self.assertTrue(self.worker.update_staged_bundles())
+    self.assertEqual(self.model.get_bundle(bundle.uuid).state, State.RUNNING)
+    while self.machine.get_bundle_statuses()[0]['exitcode'] is None:
+      time.sleep(0.1)
+    return bundle
+
+  def test_finalize(self):
+    '''
+    Test that finished bundles are FINALIZING until their results are in the
+    bundle store, and then READY.
+    '''
+    uploading = threading.Event()
+    upload = self.bundle_store.upload
+    def wait_and_upload(*args, **kwargs):
+      uploading.wait()
+      return upload(*args, **kwargs)
+    bundle = self.run_bundle('echo hello')
+    with mock.patch.object(self.bundle_store, 'upload', side_effect=wait_and_upload):
+      self.assertTrue(self.worker.check_finished_bundles())
+      bundle = self.model.get_bundle(bundle.uuid)
+      self.assertEqual((bundle.state, bundle.metadata.final_state), (State.FINALIZING, State.READY))
+      self.assertEqual(self.worker.finalizing, set([bundle.uuid]))
+      uploading.set()
+      self.join_finalizers()
+    bundle = self.model.get_bundle(bundle.uuid)
+    self.assertEqual(bundle.state, State.READY)
+    with open(os.path.join(self.bundle_store.get_location(bundle.data_hash), 'stdout')) as f:
+      self.assertEqual(f.read(), 'hello\n')
+    self.assertEqual(self.worker.finalizing, set())
+    self.assertEqual(self.model.get_leased_bundle_uuids('worker'), set())
+    self.assertEqual(self.machine.jobs, {})
+
+  def test_failed_upload(self):
+    '''
+    Test that bundles whose results can't be uploaded are FAILED, and that
+    their leases are released.
+    '''
+    bundle = self.run_bundle('echo hello')
+    with mock.patch.object(self.bundle_store, 'upload', side_effect=IOError('disk full')):
+      self.worker.check_finished_bundles()
+      self.join_finalizers()
+    bundle = self.model.get_bundle(bundle.uuid)
+    self.assertEqual((bundle.state, bundle.data_hash), (State.FAILED, None))
+    self.assertIn('disk full', bundle.metadata.failure_message)
+    self.assertEqual(self.model.get_leased_bundle_uuids('worker'), set())
+
+  def test_reclaim_finalizing(self):
+    '''
+    Test that FINALIZING bundles whose worker stopped are finished by another
+    worker, with the outcome recorded by the first one.
+    '''
+    bundles = []
+    for final_state in (State.READY, State.FAILED):
+      bundle = construct_run_bundle('echo hello', State.FINALIZING)
+      bundle.metadata.set_metadata_key('final_state', final_state)
+      self.model.save_bundle(bundle)
+      # The lease of the stopped worker has expired.
+      self.model.acquire_bundle_lease(bundle.uuid, 'other', -1)
+      temp_dir = canonicalize.get_current_location(self.bundle_store, bundle.uuid)
+      os.makedirs(temp_dir)
+      with open(os.path.join(temp_dir, 'stdout'), 'w') as f:
+        f.write('hello\n')
+      bundles.append(bundle)
+    self.worker.check_finished_bundles()
+    self.assertEqual(self.worker.finalizing, set(bundle.uuid for bundle in bundles))
+    self.join_finalizers()
+    self.assertEqual([self.model.get_bundle(bundle.uuid).state for bundle in bundles], [State.READY, State.FAILED])
+    self.assertEqual(self.model.get_leased_bundle_uuids('worker'), set())
+    self.assertEqual(self.model.get_unleased_bundle_states([State.FINALIZING]), {})